@@ -3,73 +3,270 @@
 #
 
 #!/usr/bin/env python3
+import argparse
+import glob
+import gzip
+import os
 import re
 import socket
+import sys
+import time
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 
 LOG_RE = re.compile(r"client @\S+ (\d+\.\d+\.\d+\.\d+)#")
+LOG_RE_B = re.compile(rb"client @\S+ (\d+\.\d+\.\d+\.\d+)#")
+
+BLOCK = 16 * 1024 * 1024          # сколько байт разбираем одним findall
+CHUNK = 256 * 1024 * 1024         # минимальный кусок файла на один процесс
+
+# Team Cymru bulk: хост/порт переопределяются для локального фейкового whois-сервера
+CYMRU_HOST = os.environ.get("CYMRU_HOST", "whois.cymru.com")
+CYMRU_PORT = int(os.environ.get("CYMRU_PORT", "43"))
+CYMRU_CHUNK = 5000                # IP в одном bulk-запросе
+CYMRU_SESSIONS = 4                # одновременных соединений
 
 
 def parse_dns_logs(logfile):
-    """Парсит IP-адреса резолверов из логов BIND"""
-    ips = []
+    """Парсит IP-адреса резолверов из логов BIND (генератор, список не строится)"""
     with open(logfile, "r", encoding="utf-8") as f:
         for line in f:
             m = LOG_RE.search(line)
             if m:
-                ips.append(m.group(1))
-    return ips
+                yield m.group(1)
+
+
+def _pack(ip):
+    # None — не адрес: регулярка пропускает октеты > 255 (мусор в логе вроде 999.1.1.1)
+    try:
+        return int.from_bytes(socket.inet_aton(ip.decode("ascii")), "big")
+    except OSError:
+        return None
+
+
+def _unpack(n):
+    return socket.inet_ntoa(n.to_bytes(4, "big"))
+
+
+def _count_blocks(blocks):
+    """Считает IP по итератору байтовых блоков, выровненных по строкам; ключи — IP в int"""
+    counts = Counter()
+    for buf in blocks:
+        counts.update(LOG_RE_B.findall(buf))
+    # в int переводим только уникальные IP: меньше объектов и дешевле передача между процессами
+    packed = Counter()
+    for ip, n in counts.items():
+        k = _pack(ip)
+        if k is not None:
+            packed[k] += n
+    return packed
+
+
+def _iter_range(path, start, end):
+    """Блоки строк, которые НАЧИНАЮТСЯ в [start, end): хвост последней строки дочитываем"""
+    with open(path, "rb") as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()            # строку, начатую до start, считает предыдущий кусок
+        pos = f.tell()
+        while pos < end:
+            buf = f.read(min(BLOCK, end - pos))
+            if not buf:
+                break
+            pos += len(buf)
+            if not buf.endswith(b"\n"):
+                tail = f.readline()
+                pos += len(tail)
+                buf += tail
+            yield buf
+
+
+def _iter_gzip(path):
+    with gzip.open(path, "rb") as f:
+        rest = b""
+        while True:
+            buf = f.read(BLOCK)
+            if not buf:
+                break
+            buf = rest + buf
+            cut = buf.rfind(b"\n") + 1
+            rest = buf[cut:]
+            yield buf[:cut]
+        if rest:
+            yield rest
+
+
+def _count_job(job):
+    path, start, end = job
+    if path.endswith(".gz"):
+        return _count_blocks(_iter_gzip(path))
+    return _count_blocks(_iter_range(path, start, end))
+
+
+def _jobs(paths, workers):
+    # обычные файлы режем на байтовые диапазоны, .gz — целиком (gzip не делится)
+    jobs = []
+    for path in paths:
+        if path.endswith(".gz"):
+            jobs.append((path, 0, None))
+            continue
+        size = os.path.getsize(path)
+        step = max(CHUNK, -(-size // max(workers, 1)))
+        jobs.extend((path, s, min(s + step, size)) for s in range(0, size, step))
+    return jobs
+
 
+def expand_logs(logfile, rotated=True):
+    """query.log + ротированные query.log.1, query.log.2.gz ..."""
+    paths = [logfile] if os.path.exists(logfile) else []
+    if rotated:
+        paths += sorted(p for p in glob.glob(glob.escape(logfile) + ".*")
+                        if re.search(r"\.\d+(\.gz)?$", p))
+    return paths
 
-def batch_ip_to_asn(ips):
+
+def count_resolvers(paths, workers=None):
+    """
+    Потоковый подсчёт запросов по IP резолвера.
+    Возвращает Counter {ip_int: count}; большие файлы разбираются параллельно по кускам.
+    """
+    workers = workers or os.cpu_count() or 1
+    jobs = _jobs(paths, workers)
+    total = Counter()
+    if workers == 1 or len(jobs) == 1:
+        for job in jobs:
+            total.update(_count_job(job))
+        return total
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        for part in ex.map(_count_job, jobs):
+            total.update(part)
+    return total
+
+
+def _parse_line(line):
+    # "15169   | 8.8.8.8 | 8.8.8.0/24 | US | arin | 2023-12-28 | GOOGLE, US"
+    if line.startswith("AS") or "|" not in line:
+        return None             # заголовок / "Bulk mode; ..."
+    parts = [p.strip() for p in line.split("|")]
+    if len(parts) < 7:
+        return None
+    asn, ip, prefix, cc, registry, date, as_name = parts[:7]
+    return ip, (asn, as_name)
+
+
+def _cymru_session(ips, host, port, timeout):
+    """
+    Один bulk-запрос на кусок IP. Ответ разбирается построчно по мере прихода,
+    поэтому при обрыве соединения уже полученные строки не теряются: их отдаём вместе с ошибкой.
+    """
+    results, error = {}, None
+    query = "begin\nverbose\n" + "\n".join(ips) + "\nend\n"
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as s:
+            s.sendall(query.encode("utf-8"))
+            s.shutdown(socket.SHUT_WR)
+            with s.makefile("rb") as f:
+                for raw in f:
+                    r = _parse_line(raw.decode("utf-8", "replace"))
+                    if r:
+                        results[r[0]] = r[1]
+    except OSError as e:
+        error = e
+    return results, error
+
+
+def load_cache(path):
+    """TSV-кэш ip \t asn \t as_name; при повторе IP побеждает последняя строка"""
+    cache = {}
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) == 3:
+                    cache[parts[0]] = (parts[1], parts[2])
+    return cache
+
+
+def _append_cache(f, results):
+    f.writelines(f"{ip}\t{asn}\t{name.replace(chr(9), ' ')}\n" for ip, (asn, name) in results.items())
+    f.flush()
+
+
+def batch_ip_to_asn(ips, chunk_size=CYMRU_CHUNK, sessions=CYMRU_SESSIONS, retries=3,
+                    cache_path=None, host=CYMRU_HOST, port=CYMRU_PORT, timeout=60.0):
     """
     Определяет ASN через Team Cymru WHOIS API.
     Возвращает словарь {ip: (asn, as_name)}.
+
+    IP делятся на куски по chunk_size, куски идут в sessions параллельных соединений.
+    Недополученные IP (обрыв, таймаут) перезапрашиваются до retries раз.
+    С cache_path ответы дописываются в TSV и при следующем запуске не запрашиваются.
     """
     if not ips:
         return {}
 
-    results = {}
-    query = "begin\nverbose\n" + "\n".join(ips) + "\nend\n"
-
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.connect(("whois.cymru.com", 43))
-        s.sendall(query.encode("utf-8"))
-        data = b""
-        while True:
-            chunk = s.recv(4096)
-            if not chunk:
+    cache = load_cache(cache_path)
+    results = {ip: cache[ip] for ip in ips if ip in cache}
+    todo = [ip for ip in dict.fromkeys(ips) if ip not in results]
+    out = open(cache_path, "a", encoding="utf-8") if cache_path and todo else None
+    try:
+        for attempt in range(retries + 1):
+            if not todo:
                 break
-            data += chunk
-    text = data.decode("utf-8")
-
-    for line in text.splitlines():
-        if line.startswith("AS"):
-            continue  # заголовок
-        parts = [p.strip() for p in line.split("|")]
-        if len(parts) >= 7:
-            asn, ip, prefix, cc, registry, date, as_name = parts
-            results[ip] = (asn, as_name)
+            if attempt:
+                print(f"повтор {attempt}/{retries}: {len(todo)} IP", file=sys.stderr)
+                time.sleep(min(2 ** attempt, 10))
+            chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+            with ThreadPoolExecutor(max_workers=max(1, min(sessions, len(chunks)))) as ex:
+                futures = [ex.submit(_cymru_session, c, host, port, timeout) for c in chunks]
+                for fut in as_completed(futures):
+                    got, error = fut.result()
+                    if error:
+                        print(f"{host}:{port}: {error} (получено {len(got)} строк)", file=sys.stderr)
+                    results.update(got)
+                    if out and got:
+                        _append_cache(out, got)
+            todo = [ip for ip in todo if ip not in results]
+    finally:
+        if out:
+            out.close()
+    if todo:
+        print(f"без ответа: {len(todo)} IP", file=sys.stderr)
     return results
 
 
-def analyze(logfile, top_n=10):
-    ips = parse_dns_logs(logfile)
-    counter = Counter(ips)
+def analyze(logfile, top_n=10, workers=None, rotated=True, cache_path=None,
+            chunk_size=CYMRU_CHUNK, sessions=CYMRU_SESSIONS):
+    paths = expand_logs(logfile, rotated)
+    counter = count_resolvers(paths, workers)
 
-    print(f"Всего запросов: {len(ips)}")
+    print(f"Файлы: {', '.join(paths)}")
+    print(f"Всего запросов: {sum(counter.values())}")
     print(f"Уникальных резолверов: {len(counter)}\n")
 
     # Определяем ASN только для уникальных IP
-    asn_info = batch_ip_to_asn(list(counter.keys()))
+    asn_info = batch_ip_to_asn([_unpack(n) for n in counter], chunk_size=chunk_size,
+                               sessions=sessions, cache_path=cache_path)
 
     # Выводим топ-N резолверов
     print(f"Топ-{top_n} резолверов:")
-    for ip, count in counter.most_common(top_n):
+    for n, count in counter.most_common(top_n):
+        ip = _unpack(n)
         asn, desc = asn_info.get(ip, ("?", "?"))
         print(f"{ip:15} → {count:5} запросов | AS{asn} {desc}")
 
 
 if __name__ == "__main__":
-    analyze("/var/log/named/query.log", top_n=15)
+    ap = argparse.ArgumentParser(description="Топ резолверов по логу BIND + ASN через Team Cymru")
+    ap.add_argument("logfile", nargs="?", default="/var/log/named/query.log")
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--workers", type=int, default=None, help="процессов (по умолчанию — число CPU)")
+    ap.add_argument("--no-rotated", action="store_true", help="не читать query.log.1, query.log.2.gz ...")
+    ap.add_argument("--cache", default="cymru_cache.tsv", help="TSV-кэш IP → ASN между запусками")
+    ap.add_argument("--no-cache", action="store_true")
+    ap.add_argument("--chunk", type=int, default=CYMRU_CHUNK, help="IP в одном bulk-запросе")
+    ap.add_argument("--sessions", type=int, default=CYMRU_SESSIONS, help="параллельных соединений к whois")
+    args = ap.parse_args()
+    analyze(args.logfile, top_n=args.top, workers=args.workers, rotated=not args.no_rotated,
+            cache_path=None if args.no_cache else args.cache, chunk_size=args.chunk, sessions=args.sessions)
@@ -3,41 +3,218 @@
 asn_lookup.py — модуль для определения принадлежности IP к автономной системе (AS).
 Использует библиотеку ipwhois и RDAP-запросы.
 
+IP обрабатываются параллельно (пул потоков), RDAP-запросы к каждому RIR ограничены
+по частоте, результаты печатаются NDJSON по мере готовности. Кэш по префиксам:
+IP из сети, уже определённой в этом или прошлом запуске, повторно не запрашивается.
+
 Примеры запуска:
     python3 asn_lookup.py 8.8.8.8
     python3 asn_lookup.py 8.8.8.8 1.1.1.1 77.88.8.8
+    python3 asn_lookup.py -f ips.txt --workers 16 > result.ndjson
+    cat ips.txt | python3 asn_lookup.py -
 """
 
-import sys
+import argparse
+import ipaddress
 import json
-from ipwhois import IPWhois
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 
+from ipwhois.asn import IPASN
+from ipwhois.net import Net
+from ipwhois.rdap import RDAP
 
-def get_as_info(ip: str) -> dict:
-    try:
-        obj = IPWhois(ip)
-        result = obj.lookup_rdap(depth=1)
-        return {
-            "ip": ip,
-            "asn": result.get("asn"),
-            "asn_description": result.get("asn_description"),
-            "asn_country_code": result.get("asn_country_code"),
-            "asn_date": result.get("asn_date"),
-        }
-    except Exception as e:
-        return {"ip": ip, "error": str(e)}
+FIELDS = ("asn", "asn_description", "asn_country_code", "asn_date", "asn_registry", "asn_cidr")
+
+WORKERS = 8
+RATE_PER_SEC = 5.0                  # RDAP-запросов в секунду к одному RIR
+CACHE_PATH = "rdap_cache.ndjson"
+
+
+class RateLimiter:
+    """Не чаще rate запросов в секунду на каждый ключ (RIR); потокобезопасен"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, key):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next.get(key, 0.0))
+            self._next[key] = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class PrefixCache:
+    """
+    Кэш cidr → поля ASN. Поиск — по длинам префиксов, которые реально встречались
+    (как в бэкенде): O(число разных длин) на IP. Новые записи дописываются в NDJSON-файл.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._nets = {}
+        self._plens = {4: Counter(), 6: Counter()}
+        self._lock = threading.Lock()
+        self._out = None
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                        self._add(ipaddress.ip_network(rec["asn_cidr"], strict=False), rec)
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        if path:
+            self._out = open(path, "a", encoding="utf-8")
+
+    def _add(self, net, rec):
+        if net not in self._nets:
+            self._plens[net.version][net.prefixlen] += 1
+        self._nets[net] = rec
+
+    def get(self, ip):
+        addr = ipaddress.ip_address(ip)
+        with self._lock:
+            for plen in sorted(self._plens[addr.version], reverse=True):
+                rec = self._nets.get(ipaddress.ip_network(f"{addr}/{plen}", strict=False))
+                if rec is not None:
+                    return rec
+        return None
+
+    def put(self, rec):
+        try:
+            net = ipaddress.ip_network(rec["asn_cidr"], strict=False)
+        except (ValueError, KeyError, TypeError):
+            return
+        with self._lock:
+            self._add(net, rec)
+            if self._out:
+                self._out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                self._out.flush()
+
+    def close(self):
+        if self._out:
+            self._out.close()
+
+
+class Resolver:
+    def __init__(self, cache, rate=RATE_PER_SEC, depth=1):
+        self.cache, self.depth = cache, depth
+        self.limiter = RateLimiter(rate)
+        self._inflight = {}         # asn_cidr -> Future: один RDAP на сеть
+        self._lock = threading.Lock()
+
+    def lookup(self, ip):
+        # любая ошибка — запись {"ip", "error"}, а не исключение в пуле: мусорная строка входа не рвёт прогон
+        try:
+            ip = str(ipaddress.ip_address(ip))
+            rec = self.cache.get(ip)
+            if rec is not None:
+                return {"ip": ip, **rec, "cached": True}
+            net = Net(ip)
+            # IPASN — дешёвый запрос (DNS к Cymru): даёт RIR и BGP-префикс до похода в RDAP
+            asn_data = IPASN(net).lookup()
+        except Exception as e:
+            return {"ip": ip, "error": str(e)}
+        cidr = asn_data.get("asn_cidr")
+        if not cidr:
+            # сеть неизвестна — склеивать не по чему: общий ключ None свёл бы в один RDAP чужие IP
+            return self._rdap(ip, net, asn_data)
+        with self._lock:
+            fut = self._inflight.get(cidr)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[cidr] = Future()
+        if not owner:
+            rec = fut.result()
+            return {"ip": ip, **rec, "cached": True} if rec else self._rdap(ip, net, asn_data)
+        rec = None
+        try:
+            res = self._rdap(ip, net, asn_data)
+            if "error" not in res:
+                rec = {k: res.get(k) for k in FIELDS}
+                self.cache.put(rec)
+            return res
+        finally:
+            fut.set_result(rec)
+            with self._lock:
+                self._inflight.pop(cidr, None)
+
+    def _rdap(self, ip, net, asn_data):
+        self.limiter.wait(asn_data.get("asn_registry"))
+        try:
+            result = dict(asn_data)
+            result.update(RDAP(net).lookup(asn_data=asn_data, depth=self.depth))
+            return {"ip": ip, **{k: result.get(k) for k in FIELDS}, "cached": False}
+        except Exception as e:
+            return {"ip": ip, "error": str(e)}
+
+
+def iter_ips(args):
+    """IP из аргументов, файла или stdin ("-") — построчно, без чтения всего списка"""
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            yield from (line.strip() for line in f if line.strip())
+    for ip in args.ips:
+        if ip == "-":
+            yield from (line.strip() for line in sys.stdin if line.strip())
+        else:
+            yield ip
+
+
+def run(ips, resolver, workers, emit):
+    # в работе держим не больше workers*4 IP: вход читается потоково
+    limit = workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        pending = set()
+        for ip in ips:
+            pending.add(ex.submit(resolver.lookup, ip))
+            # готовое отдаём сразу; если очередь полна — ждём хотя бы одного
+            done, pending = wait(pending, timeout=None if len(pending) >= limit else 0,
+                                 return_when=FIRST_COMPLETED)
+            for fut in done:
+                emit(fut.result())
+        for fut in as_completed(pending):
+            emit(fut.result())
 
 
 def main():
-    if len(sys.argv) < 2:
-        print("Использование: python3 asn_lookup.py <IP1> <IP2> ...")
-        sys.exit(1)
+    ap = argparse.ArgumentParser(description="ASN по IP через RDAP (ipwhois)")
+    ap.add_argument("ips", nargs="*", help="IP-адреса; '-' — читать из stdin")
+    ap.add_argument("-f", "--file", help="файл со списком IP, по одному в строке")
+    ap.add_argument("--workers", type=int, default=WORKERS)
+    ap.add_argument("--rate", type=float, default=RATE_PER_SEC, help="RDAP-запросов/с к одному RIR (0 — без ограничения)")
+    ap.add_argument("--cache", default=CACHE_PATH, help="файл кэша по префиксам")
+    ap.add_argument("--no-cache", action="store_true")
+    args = ap.parse_args()
+    if not args.ips and not args.file:
+        if sys.stdin.isatty():
+            print("Использование: python3 asn_lookup.py <IP1> <IP2> ... | -f файл | -")
+            sys.exit(1)
+        args.ips = ["-"]
+
+    cache = PrefixCache(None if args.no_cache else args.cache)
+    resolver = Resolver(cache, rate=args.rate)
 
-    ips = sys.argv[1:]
-    results = [get_as_info(ip) for ip in ips]
+    # NDJSON-вывод: строка на IP, по мере готовности
+    def emit(rec):
+        sys.stdout.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
 
-    # JSON-вывод
-    print(json.dumps(results, indent=4, ensure_ascii=False))
+    try:
+        run(iter_ips(args), resolver, args.workers, emit)
+    finally:
+        cache.close()
 
 
 if __name__ == "__main__":
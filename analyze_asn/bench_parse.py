@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк разбора query.log: старый построчный разбор (regex на строку + список IP + Counter)
+против потокового count_resolvers() в 1 и N процессов.
+
+    python3 bench_parse.py                  # 10M строк во временном файле
+    python3 bench_parse.py --lines 1000000 --keep /tmp/query.log
+"""
+import argparse
+import gzip
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+
+from asn_lookup_teamcymru import LOG_RE, count_resolvers, expand_logs
+
+LINE = ("17-Oct-2025 13:15:23.123 queries: info: client @0x7f1d12345678 {ip}#{port} "
+        "({name}.ns-testing-rr.ru): query: {name}.ns-testing-rr.ru IN A -E(0)DC ({srv})\n")
+
+
+def generate(path, lines, resolvers=50000, seed=1):
+    rnd = random.Random(seed)
+    pool = [f"{rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}"
+            for _ in range(resolvers)]
+    # немного «горячих» резолверов, как в реальных логах
+    weights = [1.0 / (i + 1) for i in range(resolvers)]
+    with open(path, "w", encoding="utf-8") as f:
+        batch = []
+        for ip in rnd.choices(pool, weights=weights, k=lines):
+            batch.append(LINE.format(ip=ip, port=rnd.randint(1024, 65535),
+                                     name=f"t{rnd.randint(0, 10**6)}", srv="46.19.65.141"))
+            if len(batch) >= 100000:
+                f.writelines(batch); batch.clear()
+        f.writelines(batch)
+
+
+def old_parse(logfile):
+    # как было до потокового разбора: список всех IP, затем Counter
+    ips = []
+    with open(logfile, "r", encoding="utf-8") as f:
+        for line in f:
+            m = LOG_RE.search(line)
+            if m:
+                ips.append(m.group(1))
+    return Counter(ips)
+
+
+def timed(label, fn, lines):
+    t0 = time.perf_counter()
+    res = fn()
+    dt = time.perf_counter() - t0
+    print(f"{label:28} {dt:8.2f} s   {lines / dt / 1e6:6.2f} M строк/с")
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=10_000_000)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--keep", help="сохранить сгенерированный лог по этому пути")
+    ap.add_argument("--skip-old", action="store_true", help="не гонять старый разбор (долго и много памяти)")
+    args = ap.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    path = args.keep or os.path.join(tmpdir, "query.log")
+    t0 = time.perf_counter()
+    generate(path, args.lines)
+    print(f"лог: {path}, {args.lines} строк, {os.path.getsize(path) / 2**20:.0f} МБ, "
+          f"сгенерирован за {time.perf_counter() - t0:.1f} s\n")
+
+    ref = None
+    if not args.skip_old:
+        ref = timed("старый (список + Counter)", lambda: old_parse(path), args.lines)
+    one = timed("потоковый, 1 процесс", lambda: count_resolvers([path], workers=1), args.lines)
+    par = timed(f"потоковый, {args.workers} процессов", lambda: count_resolvers([path], workers=args.workers), args.lines)
+    assert one == par and sum(par.values()) == args.lines
+    if ref is not None:
+        assert len(ref) == len(par) and sum(ref.values()) == sum(par.values())
+
+    # ротированный сжатый лог читается тем же путём
+    gz = path + ".1.gz"
+    with open(path, "rb") as src, gzip.open(gz, "wb", compresslevel=1) as dst:
+        while True:
+            buf = src.read(1 << 24)
+            if not buf:
+                break
+            dst.write(buf)
+    timed("query.log + query.log.1.gz", lambda: count_resolvers(expand_logs(path), workers=args.workers),
+          2 * args.lines)
+    os.remove(gz)
+    if not args.keep:
+        os.remove(path)
+        os.rmdir(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,14 @@
 #!/usr/bin/env python3
-import re
+import argparse
+import bisect
 import ipaddress
+import json
+import re
+import socket
+import sys
+import time
+import urllib.request
+from collections import Counter
 
 # --- Имя лога BIND (можно поменять под себя)
 LOGFILE = "/var/log/named/query.log"
@@ -19,22 +27,175 @@ NSDI_NETS = [
 # --- Регулярка для IP из строки лога BIND
 LOG_RE = re.compile(r"client @\S+ (\S+)#")
 
+# --- Анонсы AS через RIPEstat
+RIPESTAT_URL = "https://stat.ripe.net/data/announced-prefixes/data.json?resource=AS{asn}"
+
+
+class PrefixMatcher:
+    """
+    Набор префиксов, скомпилированный в отсортированные непересекающиеся диапазоны целых
+    (отдельно IPv4 и IPv6): поиск — один bisect. При вложенных префиксах побеждает
+    более специфичный. До разбора IP строка отсекается по первым двум октетам (IPv4).
+    """
+
+    def __init__(self, nets):
+        self.nets = sorted({ipaddress.ip_network(n, strict=False) for n in nets},
+                           key=lambda n: (n.version, int(n.network_address), n.prefixlen))
+        self._ranges = {4: self._flatten([n for n in self.nets if n.version == 4]),
+                        6: self._flatten([n for n in self.nets if n.version == 6])}
+        self._starts = {v: [s for s, _, _ in r] for v, r in self._ranges.items()}
+        self._v4_keys = self._v4_prefix_keys([n for n in self.nets if n.version == 4])
+
+    @staticmethod
+    def _flatten(nets):
+        # nets отсортированы по (начало, длина): объемлющий префикс идёт раньше вложенных
+        out, stack = [], []     # stack: [(end, net)] открытых префиксов
+        pos = None
+
+        def emit(upto):
+            nonlocal pos
+            if stack and pos is not None and pos <= upto:
+                out.append((pos, upto, stack[-1][1]))
+            pos = upto + 1
+
+        for net in nets:
+            start, end = int(net.network_address), int(net.broadcast_address)
+            while stack and stack[-1][0] < start:
+                emit(stack[-1][0])
+                stack.pop()
+            if stack:
+                emit(start - 1)
+            stack.append((end, net))
+            pos = start
+        while stack:
+            emit(stack[-1][0])
+            stack.pop()
+        return out
+
+    @staticmethod
+    def _v4_prefix_keys(nets):
+        # строки "a.b." для быстрого отсева; None — префиксы короче /8, отсев не применяем
+        keys = set()
+        for n in nets:
+            if n.prefixlen < 8:
+                return None
+            subs = n.subnets(new_prefix=16) if n.prefixlen < 16 else [n]
+            for s in subs:
+                a, b, _, _ = str(s.network_address).split(".")
+                keys.add(f"{a}.{b}.")
+        return keys
+
+    def match(self, ip_str):
+        """Префикс, в который попадает IP, или None"""
+        if ":" in ip_str:
+            try:
+                n, v = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip_str.split("%", 1)[0]), "big"), 6
+            except OSError:
+                return None
+        else:
+            if self._v4_keys is not None:
+                dot = ip_str.find(".", ip_str.find(".") + 1)
+                if ip_str[:dot + 1] not in self._v4_keys:
+                    return None
+            try:
+                n, v = int.from_bytes(socket.inet_aton(ip_str), "big"), 4
+            except OSError:
+                return None
+        i = bisect.bisect_right(self._starts[v], n) - 1
+        if i >= 0:
+            start, end, net = self._ranges[v][i]
+            if n <= end:
+                return net
+        return None
+
+    def __contains__(self, ip_str):
+        return self.match(ip_str) is not None
+
+
+def load_prefixes(path):
+    """Файл префиксов: по одному CIDR в строке, # — комментарий"""
+    nets = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                nets.append(ipaddress.ip_network(line, strict=False))
+    return nets
+
+
+def fetch_as_prefixes(asn, timeout=30):
+    """Анонсируемые AS префиксы по данным RIPEstat (announced-prefixes)"""
+    asn = str(asn).upper().removeprefix("AS")
+    with urllib.request.urlopen(RIPESTAT_URL.format(asn=asn), timeout=timeout) as resp:
+        data = json.load(resp)
+    return [ipaddress.ip_network(p["prefix"], strict=False) for p in data["data"]["prefixes"]]
+
+
+_default_matcher = PrefixMatcher(NSDI_NETS)
+
+
 def ip_in_nsdi(ip_str):
     """Проверяет, принадлежит ли IP подсетям НСДИ"""
-    try:
-        ip = ipaddress.ip_address(ip_str)
-        return any(ip in net for net in NSDI_NETS)
-    except ValueError:
-        return False
+    return ip_str in _default_matcher
 
-def filter_log():
-    with open(LOGFILE, "r", encoding="utf-8", errors="ignore") as f:
+
+def print_stats(counts, lines, matched, elapsed, out=sys.stderr):
+    rate = lines / elapsed if elapsed > 0 else 0.0
+    print(f"--- строк: {lines}, совпало: {matched}, {elapsed:.1f} s, {rate:,.0f} строк/с", file=out)
+    for net, c in counts.most_common():
+        print(f"{str(net):20} {c}", file=out)
+    out.flush()
+
+
+def filter_log(logfile=LOGFILE, matcher=_default_matcher, stats=False, interval=0.0):
+    f = sys.stdin if logfile == "-" else open(logfile, "r", encoding="utf-8", errors="ignore")
+    counts = Counter()
+    lines = matched = 0
+    t0 = last = time.monotonic()
+    search, match = LOG_RE.search, matcher.match
+    follow = f is sys.stdin         # из tail -F совпадения отдаём сразу, без буферизации
+    try:
         for line in f:
-            m = LOG_RE.search(line)
+            lines += 1
+            m = search(line)
             if m:
-                ip = m.group(1)
-                if ip_in_nsdi(ip):
-                    print(line.strip())
+                net = match(m.group(1))
+                if net is not None:
+                    matched += 1
+                    counts[net] += 1
+                    sys.stdout.write(line.strip() + "\n")
+                    if follow:
+                        sys.stdout.flush()
+            if interval and not lines & 0x3FFF:
+                now = time.monotonic()
+                if now - last >= interval:
+                    last = now
+                    print_stats(counts, lines, matched, now - t0)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    if stats:
+        print_stats(counts, lines, matched, time.monotonic() - t0)
+    return counts
+
 
 if __name__ == "__main__":
-    filter_log()
+    ap = argparse.ArgumentParser(description="Запросы от резолверов НСДИ (или любого набора префиксов) в логе BIND")
+    ap.add_argument("logfile", nargs="?", default=LOGFILE, help="лог BIND, '-' — stdin (например, tail -F ... |)")
+    ap.add_argument("--prefixes", help="файл со списком префиксов (CIDR в строке)")
+    ap.add_argument("--asn", action="append", default=[], help="взять анонсы AS из RIPEstat, например 41740; можно несколько")
+    ap.add_argument("--save-prefixes", help="сохранить итоговый список префиксов в файл")
+    ap.add_argument("--stats", action="store_true", help="в конце — число запросов по префиксам и строк/с (в stderr)")
+    ap.add_argument("--interval", type=float, default=0.0, help="печатать статистику каждые N секунд")
+    args = ap.parse_args()
+
+    nets = []
+    if args.prefixes:
+        nets += load_prefixes(args.prefixes)
+    for asn in args.asn:
+        nets += fetch_as_prefixes(asn)
+    matcher = PrefixMatcher(nets) if nets else _default_matcher
+    if args.save_prefixes:
+        with open(args.save_prefixes, "w", encoding="utf-8") as out:
+            out.writelines(f"{n}\n" for n in matcher.nets)
+    filter_log(args.logfile, matcher, stats=args.stats or args.interval > 0, interval=args.interval)
@@ -0,0 +1,244 @@
+# app/asn_cache.py — кэш результатов IP→ASN (LRU + TTL, негативные записи, склейка одновременных запросов)
+import asyncio, ipaddress, json, logging, os, sqlite3, threading, time
+from collections import OrderedDict, Counter
+from typing import Awaitable, Callable, Dict, Optional
+
+log = logging.getLogger("app.asn_cache")
+
+class SharedAsnStore:
+    """
+    Второй уровень кэша, общий для воркеров uvicorn: SQLite-файл рядом с данными.
+    Ключ — IP или сеть (как в AsnCache), срок — по настенным часам, чтобы его понимали все процессы.
+    Методы синхронные и короткие (поиск по первичному ключу), но файл может быть занят другим
+    процессом до busy_ms — поэтому AsnCache зовёт их через asyncio.to_thread, а не на цикле;
+    одно соединение на процесс, обращения из потоков идут по очереди под _lock. Занятость дольше
+    busy_ms считается промахом — ждать whois всё равно дольше. Просроченное удаляет purge_loop.
+    """
+
+    def __init__(self, path: str, busy_ms: int = 50):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        # воркеры стартуют одновременно: на создание файла ждём дольше, чем на обычные запросы
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS asn_cache (key TEXT PRIMARY KEY, plen INTEGER, "
+                         "expires REAL NOT NULL, result TEXT NOT NULL) WITHOUT ROWID")
+        self._db.execute(f"PRAGMA busy_timeout={busy_ms}")
+        self._lock = threading.Lock()
+        self._plens = {4: (), 6: ()}
+        self._plens_at = 0.0
+        self.hits = self.misses = self.writes = self.errors = self.purged = 0
+
+    def _prefix_lens(self, version: int):
+        # какие длины префиксов вообще есть в файле — перечитываем не чаще раза в 5 с
+        now = time.monotonic()
+        if now - self._plens_at > 5.0:
+            got = {4: set(), 6: set()}
+            for plen, v6 in self._db.execute("SELECT DISTINCT plen, instr(key, ':') > 0 FROM asn_cache "
+                                             "WHERE plen IS NOT NULL"):
+                got[6 if v6 else 4].add(plen)
+            self._plens = {v: sorted(p, reverse=True) for v, p in got.items()}
+            self._plens_at = now
+        return self._plens[version]
+
+    def get(self, ip: str) -> Optional[Dict]:
+        with self._lock:
+            return self._get(ip)
+
+    def _get(self, ip: str) -> Optional[Dict]:
+        try:
+            now = time.time()
+            row = self._db.execute("SELECT expires, result FROM asn_cache WHERE key = ?", (ip,)).fetchone()
+            if row is None or row[0] <= now:
+                addr = ipaddress.ip_address(ip)
+                keys = [str(ipaddress.ip_network((addr, p), strict=False)) for p in self._prefix_lens(addr.version)]
+                row = None
+                if keys:
+                    # самая длинная из найденных сетей
+                    row = self._db.execute(
+                        f"SELECT expires, result FROM asn_cache WHERE key IN ({','.join('?' * len(keys))}) "
+                        f"AND expires > ? ORDER BY plen DESC LIMIT 1", (*keys, now)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                res = dict(json.loads(row[1]), ip=ip)
+            else:
+                res = json.loads(row[1])
+        except (sqlite3.Error, ValueError) as e:
+            self.errors += 1
+            log.debug("shared asn cache read failed: %s", e)
+            return None
+        self.hits += 1
+        return res
+
+    def put(self, ip: str, result: Dict, ttl: float) -> None:
+        best = result.get("best")
+        rows = [(ip, None, time.time() + ttl, json.dumps(result))]
+        if best and best.get("prefix"):
+            try:
+                net = ipaddress.ip_network(best["prefix"], strict=False)
+                rows.append((str(net), net.prefixlen, rows[0][2], rows[0][3]))
+            except ValueError:
+                pass
+        try:
+            with self._lock:
+                self._db.executemany("INSERT OR REPLACE INTO asn_cache (key, plen, expires, result) "
+                                     "VALUES (?, ?, ?, ?)", rows)
+            self.writes += 1
+        except sqlite3.Error as e:
+            self.errors += 1
+            log.debug("shared asn cache write failed: %s", e)
+
+    def purge(self) -> int:
+        # просроченные записи; при старте (подготовка в init_once) и периодически — purge_loop
+        try:
+            with self._lock:
+                n = self._db.execute("DELETE FROM asn_cache WHERE expires <= ?", (time.time(),)).rowcount
+        except sqlite3.Error:
+            return 0
+        self.purged += n
+        return n
+
+    async def purge_loop(self, interval: float) -> None:
+        # файл общий — при N воркерах запускает лидер
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.purge)
+
+    def stats(self) -> Dict:
+        return {"path": self.path, "hits": self.hits, "misses": self.misses, "writes": self.writes,
+                "errors": self.errors, "purged": self.purged}
+
+class AsnCache:
+    """
+    Ключ — нормализованный IP. Как только для IP известен префикс (best.prefix),
+    результат кладётся ещё и под префикс: соседние адреса из той же сети
+    находятся без whois. Неудачные ответы (best is None) и неполные (partial: в режиме race
+    не все источники успели, ответ мог быть не лучшим) живут neg_ttl секунд.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, neg_ttl: float, shared: Optional[SharedAsnStore] = None):
+        self.maxsize, self.ttl, self.neg_ttl = maxsize, ttl, neg_ttl
+        self.shared = shared            # общий для воркеров уровень (несколько процессов uvicorn)
+        self._ip:  "OrderedDict[str, tuple]" = OrderedDict()    # ip  -> (expires, result)
+        self._pfx: "OrderedDict[object, tuple]" = OrderedDict() # net -> (expires, result)
+        self._plens = {4: Counter(), 6: Counter()}              # какие длины префиксов есть в кэше
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._writes: set = set()       # фоновые записи в shared
+        self.hits = self.prefix_hits = self.neg_hits = 0
+        self.misses = self.coalesced = self.evictions = self.shared_hits = 0
+
+    # --- чтение ---
+    def get(self, ip: str) -> Optional[Dict]:
+        now = time.monotonic()
+        e = self._ip.get(ip)
+        if e is not None:
+            if e[0] > now:
+                self._ip.move_to_end(ip)
+                if e[1].get("best"): self.hits += 1
+                else: self.neg_hits += 1
+                return e[1]
+            del self._ip[ip]
+
+        addr = ipaddress.ip_address(ip)
+        for plen in sorted(self._plens[addr.version], reverse=True):
+            net = ipaddress.ip_network((addr, plen), strict=False)
+            e = self._pfx.get(net)
+            if e is None:
+                continue
+            if e[0] <= now:
+                self._drop_prefix(net)
+                continue
+            self._pfx.move_to_end(net)
+            self.prefix_hits += 1
+            return dict(e[1], ip=ip)
+        return None
+
+    # --- запись ---
+    def put(self, ip: str, result: Dict) -> None:
+        best = result.get("best")
+        expires = time.monotonic() + self._ttl(result)
+        self._ip[ip] = (expires, result)
+        self._ip.move_to_end(ip)
+        if best and best.get("prefix"):
+            try:
+                net = ipaddress.ip_network(best["prefix"], strict=False)
+            except ValueError:
+                net = None
+            if net is not None:
+                if net not in self._pfx:
+                    self._plens[net.version][net.prefixlen] += 1
+                self._pfx[net] = (expires, result)
+                self._pfx.move_to_end(net)
+        self._evict()
+
+    def _ttl(self, result: Dict) -> float:
+        return self.ttl if result.get("best") and not result.get("partial") else self.neg_ttl
+
+    def _drop_prefix(self, net) -> None:
+        del self._pfx[net]
+        c = self._plens[net.version]
+        c[net.prefixlen] -= 1
+        if c[net.prefixlen] <= 0:
+            del c[net.prefixlen]
+
+    def _evict(self) -> None:
+        while len(self._ip) > self.maxsize:
+            self._ip.popitem(last=False); self.evictions += 1
+        while len(self._pfx) > self.maxsize:
+            self._drop_prefix(next(iter(self._pfx))); self.evictions += 1
+
+    def clear(self) -> None:
+        self._ip.clear(); self._pfx.clear()
+        self._plens = {4: Counter(), 6: Counter()}
+
+    # --- основной вход ---
+    async def get_or_load(self, ip: str, loader: Callable[[str], Awaitable[Dict]]) -> Dict:
+        res = self.get(ip)
+        if res is not None:
+            return res
+        fut = self._inflight.get(ip)
+        if fut is None:
+            fut = asyncio.ensure_future(self._load(ip, loader))
+            self._inflight[ip] = fut
+            fut.add_done_callback(lambda f, ip=ip: self._done(ip, f))
+        else:
+            self.coalesced += 1
+        # shield: отмена одного ожидающего не должна отменять общий whois
+        return await asyncio.shield(fut)
+
+    async def _load(self, ip: str, loader: Callable[[str], Awaitable[Dict]]) -> Dict:
+        if self.shared is not None:
+            # другой воркер уже спрашивал whois про этот IP или его сеть; SQLite — в потоке, не на цикле
+            res = await asyncio.to_thread(self.shared.get, ip)
+            if res is not None:
+                self.shared_hits += 1
+                return res
+        self.misses += 1
+        res = await loader(ip)
+        if self.shared is not None:
+            # запись — в фоне: ответ вызывающим не ждёт чужой блокировки файла
+            t = asyncio.ensure_future(asyncio.to_thread(self.shared.put, ip, res, self._ttl(res)))
+            self._writes.add(t); t.add_done_callback(self._writes.discard)
+        return res
+
+    def _done(self, ip: str, fut: asyncio.Future) -> None:
+        self._inflight.pop(ip, None)
+        if not fut.cancelled() and fut.exception() is None:
+            self.put(ip, fut.result())
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.prefix_hits + self.neg_hits + self.shared_hits + self.misses + self.coalesced
+        served = lookups - self.misses
+        out = {
+            "size": len(self._ip), "prefixes": len(self._pfx), "inflight": len(self._inflight),
+            "hits": self.hits, "prefix_hits": self.prefix_hits, "negative_hits": self.neg_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses, "coalesced": self.coalesced, "evictions": self.evictions,
+            "hit_ratio": round(served / lookups, 4) if lookups else None,
+        }
+        if self.shared is not None:
+            out["shared"] = self.shared.stats()
+        return out
@@ -1,58 +1,148 @@
 # app/asn_lookup.py
-import asyncio, ipaddress, re
-from typing import Optional, Dict
+import asyncio, ipaddress, os, re, time
+from collections import Counter, deque
+from typing import Optional, Dict, List
+
+from .asn_cache import AsnCache, SharedAsnStore
+from .prefix_table import LocalAsnResolver
+from .whois_pool import WhoisHost, IrrdHost
+from .settings import (ASN_CACHE_SIZE, ASN_CACHE_TTL, ASN_CACHE_NEG_TTL, CYMRU_BATCH_WINDOW, CYMRU_BATCH_MAX,
+                       LOCAL_ASN_SNAPSHOT, ASN_RESOLVE_MODE, ASN_RACE_BUDGET, CYMRU_DEADLINE, RADB_DEADLINE,
+                       WHOIS_CYMRU_CONNS, WHOIS_RADB_CONNS, RADB_PERSISTENT, RADB_PIPELINE, RADB_IDLE_TIMEOUT,
+                       WHOIS_BREAKER_FAILURES, WHOIS_BREAKER_COOLDOWN, WORKERS, SHARED_ASN_CACHE)
 
 WHOIS_PORT = 43
-CYMRU_HOST = "whois.cymru.com"
-RADB_HOST  = "whois.radb.net"
+# переопределяются окружением — например, на локальный фейковый whois (bench/fake_whois.py)
+CYMRU_HOST = os.environ.get("CYMRU_HOST", "whois.cymru.com")
+CYMRU_PORT = int(os.environ.get("CYMRU_PORT", WHOIS_PORT))
+RADB_HOST  = os.environ.get("RADB_HOST", "whois.radb.net")
+RADB_PORT  = int(os.environ.get("RADB_PORT", WHOIS_PORT))
 TIMEOUT = 6.0
 
-async def _whois(host: str, query: str) -> str:
-    r, w = await asyncio.wait_for(asyncio.open_connection(host, WHOIS_PORT), TIMEOUT)
-    try:
-        w.write(query.encode()); await w.drain()
-        data = await asyncio.wait_for(r.read(-1), TIMEOUT)
-        return data.decode(errors="replace")
-    finally:
-        try: w.close(); await w.wait_closed()
-        except Exception: pass
+# общий кэш результатов ip_to_asn (и для нового пинга, и для ветки дубликата)
+# несколько воркеров: второй уровень в SQLite-файле, чтобы один IP не спрашивали у whois N раз
+cache = AsnCache(ASN_CACHE_SIZE, ASN_CACHE_TTL, ASN_CACHE_NEG_TTL,
+                 shared=SharedAsnStore(SHARED_ASN_CACHE) if WORKERS > 1 else None)
+# локальный LPM по снапшоту pfx2as; загружается на старте (main.on_startup)
+local_table = LocalAsnResolver(LOCAL_ASN_SNAPSHOT)
+
+# соединения с whois: лимит на хост, предохранитель; RADB — постоянные соединения с конвейером
+cymru_host = WhoisHost(CYMRU_HOST, CYMRU_PORT, WHOIS_CYMRU_CONNS, TIMEOUT,
+                       WHOIS_BREAKER_FAILURES, WHOIS_BREAKER_COOLDOWN)
+if RADB_PERSISTENT:
+    radb_host = IrrdHost(RADB_HOST, RADB_PORT, WHOIS_RADB_CONNS, TIMEOUT, WHOIS_BREAKER_FAILURES,
+                         WHOIS_BREAKER_COOLDOWN, RADB_PIPELINE, RADB_IDLE_TIMEOUT)
+else:
+    radb_host = WhoisHost(RADB_HOST, RADB_PORT, WHOIS_RADB_CONNS, TIMEOUT,
+                          WHOIS_BREAKER_FAILURES, WHOIS_BREAKER_COOLDOWN)
 
 def _norm_ip(s: str) -> str:
     return str(ipaddress.ip_address(s))
 
-async def cymru_one(ip: str) -> Dict:
-    ip = _norm_ip(ip)
-    # Bulk-режим с verbose: begin/verbose/end — корректнее для формата
-    raw = await _whois(CYMRU_HOST, f"begin\nverbose\n{ip}\nend\n")
-    # ожидаем строку вида: "AS | IP | BGP Prefix | CC | Registry | Allocated | AS Name"
+def _parse_cymru(raw: str) -> Dict[str, Dict]:
+    # строки вида: "AS | IP | BGP Prefix | CC | Registry | Allocated | AS Name"
+    rows: Dict[str, Dict] = {}
     for line in raw.splitlines():
         if "|" not in line or line.lower().startswith("as |"):
             continue
         parts = [p.strip() for p in line.split("|")]
         if len(parts) < 7: continue
+        try: ip = _norm_ip(parts[1])
+        except ValueError: continue
+        if ip in rows: continue
         asn = None
         try: asn = int(parts[0])
         except: pass
-        return {
+        rows[ip] = {
             "asn": asn,
             "ip": parts[1],
             "prefix": parts[2] or None,
             "as_name": parts[6] or None
         }
-    return {}
+    return rows
+
+class CymruBatcher:
+    """
+    Собирает IP, запрошенные в течение window секунд (или до max_batch штук),
+    и отправляет их одним bulk-запросом begin/verbose/.../end.
+    Каждый вызывающий получает свою строку ответа.
+    """
+
+    def __init__(self, window: float, max_batch: int):
+        self.window, self.max_batch = window, max_batch
+        self._pending: Dict[str, List[asyncio.Future]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+        self.batches = self.ips = self.errors = 0
+        self.sizes = Counter()          # размер пачки -> сколько раз
+        self.recent = deque(maxlen=50)  # размеры последних пачек
+
+    async def lookup(self, ip: str) -> Dict:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.setdefault(ip, []).append(fut)
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel(); self._timer = None
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        t = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(t); t.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: Dict[str, List[asyncio.Future]]) -> None:
+        self.batches += 1; self.ips += len(batch)
+        self.sizes[len(batch)] += 1; self.recent.append(len(batch))
+        try:
+            raw = await cymru_host.query("begin\nverbose\n" + "\n".join(batch) + "\nend\n")
+            rows = _parse_cymru(raw)
+        except Exception as e:
+            self.errors += 1
+            for futs in batch.values():
+                for f in futs:
+                    if not f.done(): f.set_exception(e)
+            return
+        for ip, futs in batch.items():
+            row = rows.get(ip, {})
+            for f in futs:
+                if not f.done(): f.set_result(row)
+
+    def stats(self) -> Dict:
+        return {
+            "window": self.window, "max_batch": self.max_batch,
+            "batches": self.batches, "ips": self.ips, "errors": self.errors,
+            "avg_batch": round(self.ips / self.batches, 2) if self.batches else None,
+            "sizes": dict(sorted(self.sizes.items())), "recent": list(self.recent),
+        }
+
+cymru_batcher = CymruBatcher(CYMRU_BATCH_WINDOW, CYMRU_BATCH_MAX)
+
+async def cymru_one(ip: str) -> Dict:
+    return await cymru_batcher.lookup(_norm_ip(ip))
+
+_ROUTE_RE  = re.compile(r'^(route|route6):\s+([0-9a-fA-F\.:/]+)\s*$', re.I)
+_ORIGIN_RE = re.compile(r'^origin:\s+(AS\d+)\s*$', re.I)
 
 async def radb_one(ip: str) -> Dict:
     ip = _norm_ip(ip)
-    raw = await _whois(RADB_HOST, ip + "\n")
+    if isinstance(radb_host, IrrdHost):
+        return _parse_radb(await radb_host.lookup(ip))
+    return _parse_radb(await radb_host.query(ip + "\n"))
+
+def _parse_radb(raw: str) -> Dict:
     # ищем блоки route/route6 и origin: ASxxxx, берём самый специфичный префикс
-    route_re  = re.compile(r'^(route|route6):\s+([0-9a-fA-F\.:/]+)\s*$', re.I)
-    origin_re = re.compile(r'^origin:\s+(AS\d+)\s*$', re.I)
     best = None
     for block in raw.split("\n\n"):
         route = origin = None
         for ln in block.splitlines():
-            m = route_re.match(ln);  route  = m.group(2) if m else route
-            m = origin_re.match(ln); origin = m.group(1) if m else origin
+            m = _ROUTE_RE.match(ln);  route  = m.group(2) if m else route
+            m = _ORIGIN_RE.match(ln); origin = m.group(1) if m else origin
         if route and origin:
             try:
                 net = ipaddress.ip_network(route, strict=False)
@@ -64,21 +154,88 @@ async def radb_one(ip: str) -> Dict:
 
 async def ip_to_asn(ip: str) -> Dict:
     ip = _norm_ip(ip)
-    try:
-        cymru = await cymru_one(ip)
-    except Exception:
-        cymru = {}
-    if cymru.get("asn"):
+    rec = local_table.lookup(ip)
+    if rec is not None and rec[1]:
+        prefix, asn, as_name = rec
         return {
             "ip": ip,
-            "best": {"source": "cymru", "asn": cymru["asn"], "as_name": cymru.get("as_name"), "prefix": cymru.get("prefix")},
-            "cymru": cymru, "radb": None
+            "best": {"source": "local", "asn": asn, "as_name": as_name, "prefix": prefix},
+            "cymru": None, "radb": None
         }
+    return await cache.get_or_load(ip, _resolve)
+
+async def _timed(fn, ip: str, deadline: float):
+    # -> (ответ источника или {}, мс, ошибка или None)
+    t0 = time.perf_counter()
     try:
-        radb = await radb_one(ip)
-    except Exception:
-        radb = {}
+        res = await asyncio.wait_for(fn(ip), deadline)
+        err = None
+    except asyncio.TimeoutError:
+        res, err = {}, "timeout"
+    except Exception as e:
+        res, err = {}, type(e).__name__
+    return res, round((time.perf_counter() - t0) * 1000, 1), err
+
+def _result(ip: str, cymru: Optional[Dict], radb: Optional[Dict], timings: Dict) -> Dict:
     best = None
-    if radb.get("asn"):
+    if cymru and cymru.get("asn"):
+        best = {"source": "cymru", "asn": cymru["asn"], "as_name": cymru.get("as_name"), "prefix": cymru.get("prefix")}
+    elif radb and radb.get("asn"):
         best = {"source": "radb", "asn": radb["asn"], "as_name": None, "prefix": radb.get("prefix")}
-    return {"ip": ip, "best": best, "cymru": cymru or None, "radb": radb or None}
+    return {"ip": ip, "best": best, "cymru": cymru or None, "radb": radb or None, "timings": timings}
+
+async def _resolve(ip: str) -> Dict:
+    if ASN_RESOLVE_MODE == "race":
+        return await _resolve_race(ip, ASN_RACE_BUDGET)
+    return await _resolve_sequential(ip)
+
+async def _resolve_sequential(ip: str) -> Dict:
+    timings: Dict = {}
+    cymru, timings["cymru"], err = await _timed(cymru_one, ip, CYMRU_DEADLINE)
+    if err: timings["cymru_error"] = err
+    if cymru.get("asn"):
+        return _result(ip, cymru, None, timings)
+    radb, timings["radb"], err = await _timed(radb_one, ip, RADB_DEADLINE)
+    if err: timings["radb_error"] = err
+    return _result(ip, cymru, radb, timings)
+
+async def _resolve_race(ip: str, budget: float) -> Dict:
+    """
+    Cymru и RADB стартуют одновременно. Cymru предпочтительнее: ответ RADB принимается,
+    только если Cymru уже ответил без ASN или общий бюджет истёк. Проигравший отменяется.
+    В timings — мс по каждому источнику (None — не успел или отменён как проигравший).
+    partial=True, только если ответ мог быть лучше: Cymru не ответил в бюджет, либо ASN нет,
+    а какой-то источник не успел или упал по таймауту. Проигравший после победы Cymru — не в счёт.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + budget
+    tasks = {
+        asyncio.ensure_future(_timed(cymru_one, ip, CYMRU_DEADLINE)): "cymru",
+        asyncio.ensure_future(_timed(radb_one, ip, RADB_DEADLINE)): "radb",
+    }
+    got: Dict[str, Dict] = {}
+    timings: Dict = {"cymru": None, "radb": None}
+    pending = set(tasks)
+    try:
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                src = tasks[t]
+                got[src], timings[src], err = t.result()
+                if err: timings[src + "_error"] = err
+            if got.get("cymru", {}).get("asn"):
+                break
+            if "cymru" in got and got.get("radb", {}).get("asn"):
+                break
+    finally:
+        for t in pending:
+            t.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    res = _result(ip, got.get("cymru"), got.get("radb"), timings)
+    timed_out = any(timings[src] is None or timings.get(src + "_error") == "timeout" for src in ("cymru", "radb"))
+    res["partial"] = "cymru" not in got or (res["best"] is None and timed_out)
+    return res
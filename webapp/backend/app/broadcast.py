@@ -0,0 +1,117 @@
+# app/broadcast.py — in-process pub/sub для живой ленты дашборда (/api/ping/stream, SSE)
+#
+# Событие сериализуется один раз (готовый SSE-кадр в байтах) и раскладывается по очередям
+# подписчиков. Очередь каждого клиента ограничена: кто не успевает читать, отключается,
+# а EventSource переподключается с Last-Event-ID — пропущенное досылается из кольцевого
+# буфера последних событий. Отставшим дальше буфера (или пришедшим после рестарта сервера)
+# уходит событие reset: клиент один раз перечитывает снимок через REST.
+import asyncio, json
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+class Subscriber:
+    __slots__ = ("queue", "closed")
+
+    def __init__(self, size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(size)
+        self.closed = False
+
+class Broadcaster:
+    def __init__(self, ring_size: int = 1000, queue_size: int = 256, first_seq: int = 0):
+        self.queue_size = queue_size
+        # несколько воркеров: у каждого свой диапазон id, и Last-Event-ID от другого процесса
+        # даёт reset, а не «догонку» чужими номерами
+        self.seq = first_seq
+        self._ring = deque(maxlen=ring_size)        # (id, кадр)
+        self._subs: Set[Subscriber] = set()
+        self._coalesced: Dict[str, asyncio.Task] = {}
+        self.published = self.dropped = self.resumed = self.resets = 0
+
+    def _frame(self, event: str, data) -> bytes:
+        body = json.dumps(data, ensure_ascii=False, default=str)
+        return f"id: {self.seq}\nevent: {event}\ndata: {body}\n\n".encode()
+
+    def publish(self, event: str, data) -> int:
+        self.seq += 1
+        frame = self._frame(event, data)
+        self._ring.append((self.seq, frame))
+        for sub in list(self._subs):
+            try:
+                sub.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # медленный клиент: отключаем, догонит по Last-Event-ID
+                sub.closed = True
+                self._subs.discard(sub)
+                self.dropped += 1
+        self.published += 1
+        return self.seq
+
+    def publish_coalesced(self, event: str, build: Callable[[], Awaitable], delay: float) -> None:
+        # частые изменения → не больше одного события за delay; build() — один раз на всех
+        if not self._subs:
+            return
+        t = self._coalesced.get(event)
+        if t is not None and not t.done():
+            return
+        async def run():
+            await asyncio.sleep(delay)
+            try:
+                data = await build()
+            except Exception:
+                return                          # следующее изменение попробует снова
+            self.publish(event, data)
+        self._coalesced[event] = asyncio.create_task(run())
+
+    def subscribe(self, last_id: Optional[int] = None) -> Subscriber:
+        sub = Subscriber(self.queue_size)
+        if last_id is not None:
+            missed = [f for i, f in self._ring if i > last_id]
+            oldest = self._ring[0][0] if self._ring else self.seq + 1
+            if last_id > self.seq or last_id < oldest - 1 or len(missed) > self.queue_size:
+                self.resets += 1
+                sub.queue.put_nowait(self._frame("reset", {"seq": self.seq}))
+            else:
+                self.resumed += 1
+                for f in missed:
+                    sub.queue.put_nowait(f)
+        self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        sub.closed = True
+        self._subs.discard(sub)
+
+    async def stream(self, last_id: Optional[int], keepalive: float) -> AsyncIterator[bytes]:
+        sub = self.subscribe(last_id)
+        try:
+            yield b"retry: 3000\n\n"
+            while not sub.closed:
+                try:
+                    frame = await asyncio.wait_for(sub.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"     # держим соединение через прокси
+                    continue
+                if frame is None:               # сервер останавливается
+                    return
+                yield frame
+        finally:
+            self.unsubscribe(sub)
+
+    async def stop(self) -> None:
+        for t in self._coalesced.values():
+            t.cancel()
+        await asyncio.gather(*self._coalesced.values(), return_exceptions=True)
+        for sub in list(self._subs):
+            self.unsubscribe(sub)
+            try:
+                sub.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+
+    def stats(self) -> Dict:
+        return {
+            "subscribers": len(self._subs), "seq": self.seq, "ring": len(self._ring),
+            "ring_size": self._ring.maxlen, "queue_size": self.queue_size,
+            "published": self.published, "dropped_clients": self.dropped,
+            "resumed": self.resumed, "resets": self.resets,
+        }
@@ -0,0 +1,246 @@
+# app/correlation.py — пары «IP клиента ↔ IP резолвера» по токену (HTTP ↔ DNS)
+#
+# Клиентская сторона — token_hits и http_hits, DNS-сторона — dns_hits. Пара — один токен
+# и разница времени не больше CORRELATION_WINDOW. Коррелятор идёт только по новым строкам
+# трёх таблиц (водяные знаки по id в watermarks), вторую сторону ищет по индексу
+# (token, created_at) и одной транзакцией: дописывает token_pairs (ON CONFLICT DO NOTHING),
+# прибавляет asn_pair_stats для реально новых пар и двигает водяные знаки.
+# /api/correlation читает только asn_pair_stats — O(top), от размера сырых таблиц не зависит.
+import asyncio, time
+from collections import deque
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .asn_lookup import ip_to_asn
+from .db import SessionLocal, ReadSessionLocal
+from .models import AsnPairStat, DnsHit, HttpHit, TokenHit, TokenPair, Watermark
+
+CLIENT_TABLES = (TokenHit.__table__, HttpHit.__table__)
+DNS = DnsHit.__table__
+SOURCES = tuple(t.name for t in CLIENT_TABLES) + (DNS.name,)
+
+def _wm_name(table: str) -> str:
+    return f"corr:{table}"
+
+async def reset_source(db: AsyncSession, table: str) -> None:
+    # таблица очищена (id начнутся заново) — читаем её с начала; вызывающий коммитит
+    stmt = sqlite_insert(Watermark).values(name=_wm_name(table), last_id=0)
+    await db.execute(stmt.on_conflict_do_update(index_elements=[Watermark.name], set_={"last_id": 0}))
+
+class Correlator:
+    def __init__(self, window: float, interval: float, batch: int):
+        self.window, self.interval, self.batch = timedelta(seconds=window), interval, batch
+        self._task: Optional[asyncio.Task] = None
+        self.steps = self.candidates = self.pairs = self.errors = 0
+        self.last_error: Optional[str] = None
+        self.step_ms = deque(maxlen=200)
+        self.watermarks: Dict[str, int] = {}
+        self.backlog: Dict[str, int] = {}
+
+    # --- чтение новых строк ---
+    async def _load_watermarks(self, db: AsyncSession) -> Dict[str, int]:
+        rows = (await db.execute(select(Watermark.name, Watermark.last_id)
+                                 .where(Watermark.name.in_([_wm_name(t) for t in SOURCES])))).all()
+        wm = {name.split(":", 1)[1]: last for name, last in rows}
+        out = {}
+        for t in CLIENT_TABLES + (DNS,):
+            top = (await db.execute(select(func.max(t.c.id)))).scalar() or 0
+            w = wm.get(t.name, 0)
+            out[t.name] = 0 if top < w else w     # таблицу очистили мимо reset_source
+            self.backlog[t.name] = max(0, top - out[t.name])
+        return out
+
+    async def _new_rows(self, db: AsyncSession, table, after: int) -> Tuple[List, int]:
+        cols = [table.c.id, table.c.token, table.c.created_at,
+                table.c.resolver_ip if table is DNS else table.c.ip]
+        if table is TokenHit.__table__:
+            cols += [table.c.asn, table.c.as_name]
+        rows = (await db.execute(select(*cols).where(table.c.id > after)
+                                 .order_by(table.c.id).limit(self.batch))).all()
+        return [r for r in rows if r.token], (rows[-1].id if rows else after)
+
+    async def _other_side(self, db: AsyncSession, table, rows) -> Dict[str, List]:
+        # строки table с теми же токенами в окне [min - window, max + window]; индекс (token, created_at)
+        if not rows:
+            return {}
+        lo = min(r.created_at for r in rows) - self.window
+        hi = max(r.created_at for r in rows) + self.window
+        cols = [table.c.token, table.c.created_at, table.c.resolver_ip if table is DNS else table.c.ip]
+        if table is TokenHit.__table__:
+            cols += [table.c.asn, table.c.as_name]
+        res = (await db.execute(select(*cols).where(table.c.token.in_({r.token for r in rows}),
+                                                    table.c.created_at.between(lo, hi)))).all()
+        by_token: Dict[str, List] = {}
+        for r in res:
+            by_token.setdefault(r.token, []).append(r)
+        return by_token
+
+    def _pair(self, client, dns, out: Dict) -> None:
+        if abs(client.created_at - dns.created_at) > self.window:
+            return
+        key = (client.token, client.ip, dns.resolver_ip)
+        if key not in out:
+            out[key] = {"token": client.token, "client_ip": client.ip, "resolver_ip": dns.resolver_ip,
+                        "client_asn": getattr(client, "asn", None), "client_as_name": getattr(client, "as_name", None),
+                        "http_at": client.created_at, "dns_at": dns.created_at}
+
+    async def _collect(self) -> Tuple[Dict, Dict[str, int], bool]:
+        cands: Dict[Tuple, Dict] = {}
+        new_wm: Dict[str, int] = {}
+        full = False
+        async with ReadSessionLocal() as db:
+            wm = await self._load_watermarks(db)
+            for table in CLIENT_TABLES:
+                rows, new_wm[table.name] = await self._new_rows(db, table, wm[table.name])
+                full |= new_wm[table.name] - wm[table.name] >= self.batch
+                dns = await self._other_side(db, DNS, rows)
+                for c in rows:
+                    for d in dns.get(c.token, ()):
+                        self._pair(c, d, cands)
+            rows, new_wm[DNS.name] = await self._new_rows(db, DNS, wm[DNS.name])
+            full |= new_wm[DNS.name] - wm[DNS.name] >= self.batch
+            for table in CLIENT_TABLES:
+                clients = await self._other_side(db, table, rows)
+                for d in rows:
+                    for c in clients.get(d.token, ()):
+                        self._pair(c, d, cands)
+        changed = {t: v for t, v in new_wm.items() if v != wm[t]}
+        return cands, changed, full
+
+    # --- ASN и запись ---
+    async def _resolve(self, ips) -> Dict[str, Tuple[int, Optional[str]]]:
+        ips = list(ips)
+        res = await asyncio.gather(*(ip_to_asn(ip) for ip in ips), return_exceptions=True)
+        out = {}
+        for ip, r in zip(ips, res):
+            best = (r.get("best") or {}) if isinstance(r, dict) else {}
+            out[ip] = (best.get("asn") or 0, best.get("as_name"))
+        return out
+
+    async def step(self) -> bool:
+        """Один проход; -> True, если упёрлись в batch и есть ещё строки"""
+        t0 = time.perf_counter()
+        cands, changed, full = await self._collect()
+        if not cands and not changed:
+            return False
+        # ASN — до транзакции: whois не держит соединение писателя
+        need = {c["resolver_ip"] for c in cands.values()} | \
+               {c["client_ip"] for c in cands.values() if not c["client_asn"]}
+        asn = await self._resolve(need)
+        rows, names = [], {}
+        for c in cands.values():
+            if not c["client_asn"]:
+                c["client_asn"], c["client_as_name"] = asn[c["client_ip"]]
+            r_asn, r_name = asn[c["resolver_ip"]]
+            names[(c["token"], c["client_ip"], c["resolver_ip"])] = (c["client_as_name"], r_name)
+            rows.append({"token": c["token"], "client_ip": c["client_ip"], "client_asn": c["client_asn"],
+                         "resolver_ip": c["resolver_ip"], "resolver_asn": r_asn,
+                         "http_at": c["http_at"], "dns_at": c["dns_at"]})
+
+        async with SessionLocal() as db:
+            async with db.begin():
+                inserted = []
+                if rows:
+                    t = TokenPair.__table__
+                    stmt = (sqlite_insert(t).on_conflict_do_nothing(index_elements=["token", "client_ip", "resolver_ip"])
+                            .returning(t.c.token, t.c.client_ip, t.c.resolver_ip, t.c.client_asn, t.c.resolver_asn))
+                    inserted = (await db.execute(stmt, rows)).all()
+                deltas: Dict[Tuple[int, int], List] = {}
+                for tok, cip, rip, ca, ra in inserted:
+                    cn, rn = names[(tok, cip, rip)]
+                    d = deltas.setdefault((ca, ra), [0, cn, rn])
+                    d[0] += 1
+                if deltas:
+                    stmt = sqlite_insert(AsnPairStat)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[AsnPairStat.client_asn, AsnPairStat.resolver_asn],
+                        set_={"count": AsnPairStat.count + stmt.excluded.count,
+                              "client_as_name": func.coalesce(stmt.excluded.client_as_name, AsnPairStat.client_as_name),
+                              "resolver_as_name": func.coalesce(stmt.excluded.resolver_as_name, AsnPairStat.resolver_as_name)},
+                    )
+                    await db.execute(stmt, [{"client_asn": ca, "resolver_asn": ra, "count": n,
+                                             "client_as_name": cn, "resolver_as_name": rn}
+                                            for (ca, ra), (n, cn, rn) in deltas.items()])
+                if changed:
+                    stmt = sqlite_insert(Watermark)
+                    stmt = stmt.on_conflict_do_update(index_elements=[Watermark.name],
+                                                      set_={"last_id": stmt.excluded.last_id})
+                    await db.execute(stmt, [{"name": _wm_name(t), "last_id": v} for t, v in changed.items()])
+
+        self.watermarks.update(changed)
+        self.steps += 1; self.candidates += len(rows); self.pairs += len(inserted)
+        self.step_ms.append((time.perf_counter() - t0) * 1000)
+        return full
+
+    # --- цикл ---
+    async def _run(self) -> None:
+        while True:
+            more = False
+            try:
+                more = await self.step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+            if not more:
+                await asyncio.sleep(self.interval)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> Dict:
+        ms = sorted(self.step_ms)
+        return {
+            "running": self.running, "window": self.window.total_seconds(), "batch": self.batch,
+            "steps": self.steps, "candidates": self.candidates, "pairs": self.pairs, "errors": self.errors,
+            "last_error": self.last_error, "watermarks": self.watermarks, "backlog": self.backlog,
+            "step_ms_p50": round(ms[len(ms) // 2], 2) if ms else None,
+        }
+
+# --- чтение для /api/correlation ---
+def _pair_row(r) -> Dict:
+    return {"client_asn": r.client_asn or None, "client_as_name": r.client_as_name,
+            "resolver_asn": r.resolver_asn or None, "resolver_as_name": r.resolver_as_name, "count": r.count}
+
+async def read(db: AsyncSession, client_asn: Optional[int], resolver_asn: Optional[int], top: int) -> Dict:
+    s = AsnPairStat
+    cols = (s.client_asn, s.client_as_name, s.resolver_asn, s.resolver_as_name, s.count)
+    if client_asn is not None or resolver_asn is not None:
+        # срез матрицы: какие резолверы у пользователей AS X (или наоборот)
+        col, val = (s.client_asn, client_asn) if client_asn is not None else (s.resolver_asn, resolver_asn)
+        cond = col == (val or 0)
+        rows = (await db.execute(select(*cols).where(cond).order_by(s.count.desc()).limit(top))).all()
+        total = (await db.execute(select(func.coalesce(func.sum(s.count), 0)).where(cond))).scalar_one()
+        items = [dict(_pair_row(r), share=round(r.count / total, 4) if total else None) for r in rows]
+        key = "client_asn" if client_asn is not None else "resolver_asn"
+        return {key: val, "total": total, "items": items}
+
+    # верх матрицы: самые частые пары; строки — AS пользователей, столбцы — AS резолверов
+    rows = (await db.execute(select(*cols).order_by(s.count.desc()).limit(top))).all()
+    clients = list(dict.fromkeys(r.client_asn or None for r in rows))
+    resolvers = list(dict.fromkeys(r.resolver_asn or None for r in rows))
+    ci = {a: i for i, a in enumerate(clients)}; ri = {a: i for i, a in enumerate(resolvers)}
+    cells = [[0] * len(resolvers) for _ in clients]
+    for r in rows:
+        cells[ci[r.client_asn or None]][ri[r.resolver_asn or None]] = r.count
+    return {"pairs": [_pair_row(r) for r in rows],
+            "matrix": {"client_asns": clients, "resolver_asns": resolvers, "cells": cells}}
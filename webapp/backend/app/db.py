@@ -1,18 +1,95 @@
+import logging, os
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.orm import DeclarativeBase
 
-DATABASE_URL = "sqlite+aiosqlite:///./app.db"
+from .metrics import instrument_engine
 
-engine = create_async_engine(DATABASE_URL, echo=False, future=True)
+log = logging.getLogger("app.db")
+
+DB_PATH = os.environ.get("APP_DB_PATH", "./app.db")     # бенчмарк (bench/) подставляет временный файл
+DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH}"
+# только чтение: отдельный пул, писателей не блокирует (WAL)
+READ_DATABASE_URL = f"sqlite+aiosqlite:///file:{DB_PATH}?mode=ro&uri=true"
+READ_POOL_SIZE = 4
+
+# применяются к каждому новому соединению; journal_mode=WAL хранится в самом файле БД
+SQLITE_PRAGMAS = {
+    "synchronous":  "NORMAL",       # в WAL достаточно: fsync только на checkpoint
+    "cache_size":   "-65536",       # 64 МБ страничного кэша на соединение
+    "mmap_size":    "268435456",    # 256 МБ
+    "busy_timeout": "5000",         # мс ждать чужую блокировку вместо мгновенного SQLITE_BUSY
+    "temp_store":   "MEMORY",
+}
+
+# писатель — ровно одно соединение: запись в SQLite всё равно последовательная,
+# а так нет борьбы за блокировку между соединениями одного процесса
+# (по умолчанию aiosqlite работает через NullPool — соединение на каждую сессию)
+engine = create_async_engine(DATABASE_URL, echo=False, future=True,
+                             poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0)
 SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+read_engine = create_async_engine(READ_DATABASE_URL, echo=False, future=True,
+                                  poolclass=AsyncAdaptedQueuePool, pool_size=READ_POOL_SIZE, max_overflow=0)
+ReadSessionLocal = async_sessionmaker(read_engine, expire_on_commit=False, class_=AsyncSession)
+
+def _apply_pragmas(dbapi_conn, _record, write: bool):
+    cur = dbapi_conn.cursor()
+    if write:
+        cur.execute("PRAGMA journal_mode=WAL")
+    else:
+        cur.execute("PRAGMA query_only=1")
+    for k, v in SQLITE_PRAGMAS.items():
+        cur.execute(f"PRAGMA {k}={v}")
+    cur.close()
+
+event.listen(engine.sync_engine, "connect", lambda c, r: _apply_pragmas(c, r, True))
+event.listen(read_engine.sync_engine, "connect", lambda c, r: _apply_pragmas(c, r, False))
+# время операторов/транзакций и занятость пулов — в /metrics
+instrument_engine(engine, "write")
+instrument_engine(read_engine, "read")
+
 class Base(DeclarativeBase):
     pass
 
 async def init_db():
+    async with engine.connect() as conn:
+        # новая БД — сразу с auto_vacuum=INCREMENTAL (app/rollup.py). В WAL прагма действует только
+        # через VACUUM: на пустом файле он мгновенный, существующую БД переводит python -m app.rollup vacuum
+        if not (await conn.exec_driver_sql("SELECT count(*) FROM sqlite_master")).scalar():
+            await conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            await conn.exec_driver_sql("VACUUM")
     async with engine.begin() as conn:
         # создаём таблицы при старте
         await conn.run_sync(Base.metadata.create_all)
         await conn.exec_driver_sql(
             "CREATE UNIQUE INDEX IF NOT EXISTS uq_token_hits_ip ON token_hits (ip)"
-        )
\ No newline at end of file
+        )
+        # keyset-пагинация /api/items и /api/ping/last по (created_at, id) (app/paging.py): id — явный
+        # столбец индекса, иначе SQLite досортировывает «хвост» ORDER BY во временном B-дереве.
+        # Прежние индексы только по created_at этим покрываются; в БД, где таблица уже есть, create_all
+        # индекс не добавит — поэтому здесь
+        for table in ("items", "token_hits"):
+            await conn.exec_driver_sql(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_created_id ON {table} (created_at DESC, id DESC)"
+            )
+            await conn.exec_driver_sql(f"DROP INDEX IF EXISTS ix_{table}_created")
+        # корреляция по токену в окне времени (app/correlation.py): поиск пары — по индексу
+        for table in ("token_hits", "http_hits", "dns_hits"):
+            await conn.exec_driver_sql(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_token_created ON {table} (token, created_at)"
+            )
+
+async def check_pragmas() -> dict:
+    # самопроверка на старте: какие значения реально действуют у писателя и читателя
+    out = {}
+    for name, eng in (("write", engine), ("read", read_engine)):
+        async with eng.connect() as conn:
+            vals = {}
+            for k in ("journal_mode", *SQLITE_PRAGMAS):
+                vals[k] = (await conn.exec_driver_sql(f"PRAGMA {k}")).scalar()
+            vals["query_only"] = (await conn.exec_driver_sql("PRAGMA query_only")).scalar()
+        out[name] = vals
+        log.info("sqlite %s pragmas: %s", name, vals)
+    return out
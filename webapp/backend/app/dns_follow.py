@@ -0,0 +1,275 @@
+# app/dns_follow.py — хвост query.log BIND → dns_hits
+#
+# Читает лог с места, где остановился: (inode, offset) последней закоммиченной строки
+# лежит в DNS_FOLLOW_STATE и обновляется после каждой пачки. Ротация (rename + новый файл)
+# замечается по смене inode: старый файл дочитывается до конца, новый — с нуля; после
+# рестарта недочитанный ротированный файл ищется по inode среди query.log.*; copytruncate —
+# по уменьшению размера. В dns_hits попадают только имена в зоне BASE_DOMAIN,
+# вставка — пачками через общий писатель (app/ingest.py).
+#
+#   python -m app.dns_follow [query.log] [--from-start] [--once]
+import argparse, asyncio, glob, json, logging, os, re, time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from .models import DnsHit
+from .tokens import extract_token_from_host, in_base_domain
+
+log = logging.getLogger("app.dns_follow")
+
+READ_BLOCK = 1 << 20
+# 17-Oct-2025 13:15:23.123 queries: info: client @0x7f.. 1.2.3.4#5353 (a.b.ru): query: a.b.ru IN A +E(0)K (46.19.65.141)
+LINE_RE = re.compile(rb"^(\d{2}-\w{3}-\d{4} \d{2}:\d{2}:\d{2})(?:\.(\d{3}))?.*? client @\S+ ([0-9A-Fa-f.:]+)#\d+ .*?query: (\S+) ")
+MONTHS = {m: i for i, m in enumerate(("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+                                      "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1)}
+
+class _Clock:
+    # время BIND — локальное; strptime дорогой, поэтому кэшируем по секунде
+    def __init__(self):
+        self._key, self._base = None, None
+
+    def parse(self, stamp: bytes, ms: Optional[bytes]) -> Tuple[datetime, float]:
+        if stamp != self._key:
+            s = stamp.decode()
+            local = datetime(int(s[7:11]), MONTHS[s[3:6]], int(s[0:2]), int(s[12:14]), int(s[15:17]), int(s[18:20]))
+            self._key, self._base = stamp, local.astimezone(timezone.utc).replace(tzinfo=None)
+        dt = self._base.replace(microsecond=int(ms) * 1000) if ms else self._base
+        return dt, dt.replace(tzinfo=timezone.utc).timestamp()
+
+def parse_lines(data: bytes, clock: _Clock) -> Tuple[List[Dict], int, Optional[float]]:
+    # data — только целые строки; -> (строки dns_hits, всего строк, время последней строки)
+    rows, last_ts, n = [], None, 0
+    for line in data.splitlines():
+        n += 1
+        m = LINE_RE.match(line)
+        if m is None:
+            continue
+        stamp, ms, ip, qname = m.groups()
+        dt, last_ts = clock.parse(stamp, ms)
+        qname = qname.decode("ascii", "replace").rstrip(".")
+        if not in_base_domain(qname):
+            continue
+        rows.append({"token": extract_token_from_host(qname), "qname": qname[:255].lower(),
+                     "resolver_ip": ip.decode(), "created_at": dt})
+    return rows, n, last_ts
+
+class DnsFollower:
+    def __init__(self, path: str, state_path: str, ingest, batch: int = 500, poll: float = 0.5,
+                 from_start: bool = False):
+        self.path, self.state_path, self.ingest = path, state_path, ingest
+        self.batch, self.poll, self.from_start = batch, poll, from_start
+        self._f = None
+        self._ino: Optional[int] = None
+        self.offset = 0
+        self._clock = _Clock()
+        self._task: Optional[asyncio.Task] = None
+        self.lines = self.matched = self.inserted = self.rotations = self.errors = 0
+        self.last_line_ts: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._rate = deque(maxlen=20)       # (monotonic, lines) для lines/s
+
+    # --- чекпойнт ---
+    def _load_state(self) -> Dict:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self) -> None:
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"path": self.path, "inode": self._ino, "offset": self.offset,
+                       "last_line_ts": self.last_line_ts, "saved_at": time.time()}, f)
+        os.replace(tmp, self.state_path)
+
+    # --- файлы ---
+    def _open(self, path: str, offset: int) -> None:
+        if self._f:
+            self._f.close()
+        self._f = open(path, "rb")
+        self._ino = os.fstat(self._f.fileno()).st_ino
+        self.offset = min(offset, os.fstat(self._f.fileno()).st_size)
+        self._f.seek(self.offset)
+
+    def _find_rotated(self, ino: int) -> Optional[str]:
+        for p in sorted(glob.glob(glob.escape(self.path) + ".*")):
+            if p.endswith(".gz"):
+                continue
+            try:
+                if os.stat(p).st_ino == ino:
+                    return p
+            except OSError:
+                pass
+        return None
+
+    def _resume(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        st = self._load_state()
+        cur = os.stat(self.path)
+        if st.get("inode") == cur.st_ino:
+            self._open(self.path, st.get("offset", 0))
+            if cur.st_size < self.offset:     # copytruncate, пока нас не было
+                self._open(self.path, 0)
+        elif st.get("inode") and (old := self._find_rotated(st["inode"])):
+            log.info("dns_follow: дочитываем ротированный %s с %s", old, st.get("offset"))
+            self._open(old, st.get("offset", 0))
+        elif st:
+            self._open(self.path, 0)           # файл сменился, старого не нашли — новый с начала
+        else:
+            self._open(self.path, 0 if self.from_start else cur.st_size)
+        return True
+
+    def _read_chunk(self) -> Tuple[bytes, int]:
+        # до READ_BLOCK байт, обрезанных по последнему \n; хвост недописанной строки оставляем в файле
+        data = self._f.read(READ_BLOCK)
+        cut = data.rfind(b"\n") + 1
+        if not cut and len(data) == READ_BLOCK:
+            cut = len(data)                    # строка длиннее блока — это не запрос, пропускаем
+        if cut < len(data):
+            self._f.seek(self.offset + cut)
+        return data[:cut], cut
+
+    def _rotated(self) -> Optional[str]:
+        # None — тот же файл; "moved" — по пути уже новый файл; "truncated" — copytruncate
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None                        # между rename и созданием нового файла
+        if st.st_ino != self._ino:
+            return "moved"
+        if st.st_size < self.offset:
+            return "truncated"
+        return None
+
+    # --- цикл ---
+    async def step(self) -> int:
+        """Один проход: читает и пишет всё доступное; -> число прочитанных строк"""
+        if self._f is None and not await asyncio.to_thread(self._resume):
+            return 0
+        total = 0
+        pending: List[Dict] = []
+        while True:
+            data, size = await asyncio.to_thread(self._read_chunk)
+            if not size:
+                if pending:
+                    await self._commit(pending); pending = []
+                why = self._rotated()
+                if why is None:
+                    return total
+                if why == "moved":
+                    # BIND мог дописать в старый файл между нашим read и stat
+                    data, size = await asyncio.to_thread(self._read_chunk)
+                if not size:
+                    self.rotations += 1
+                    log.info("dns_follow: ротация (%s) %s", why, self.path)
+                    self._open(self.path, 0)
+                    self._save_state()
+                    continue
+            rows, n, ts = parse_lines(data, self._clock)
+            self.offset += size
+            self.lines += n; total += n
+            self.matched += len(rows)
+            if ts is not None:
+                self.last_line_ts = ts
+            self._rate.append((time.monotonic(), self.lines))
+            pending.extend(rows)
+            if len(pending) >= self.batch:
+                await self._commit(pending); pending = []
+            elif not rows and not pending:
+                self._save_state()
+
+    async def _commit(self, rows: List[Dict]) -> None:
+        # чекпойнт — только после коммита: при падении строки перечитаются, а не потеряются
+        for i in range(0, len(rows), self.batch):
+            self.inserted += await self.ingest.insert_many(DnsHit, rows[i:i + self.batch])
+        self._save_state()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                log.exception("dns_follow: ошибка")
+                if self._f:                     # перечитать с последнего чекпойнта
+                    self._f.close(); self._f = None
+            await asyncio.sleep(self.poll)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._f:
+            self._f.close(); self._f = None
+
+    def stats(self) -> Dict:
+        size = None
+        try:
+            size = os.path.getsize(self._f.name) if self._f else None
+        except OSError:
+            pass
+        lps = None
+        if len(self._rate) >= 2:
+            (t0, l0), (t1, l1) = self._rate[0], self._rate[-1]
+            lps = round((l1 - l0) / (t1 - t0), 1) if t1 > t0 else None
+        return {
+            "running": self.running, "path": self._f.name if self._f else self.path,
+            "inode": self._ino, "offset": self.offset,
+            "lag_bytes": (size - self.offset) if size is not None else None,
+            "lag_seconds": round(time.time() - self.last_line_ts, 3) if self.last_line_ts else None,
+            "lines": self.lines, "matched": self.matched, "inserted": self.inserted,
+            "lines_per_sec": lps, "rotations": self.rotations, "errors": self.errors,
+            "last_error": self.last_error,
+        }
+
+async def _main(args) -> None:
+    from .db import init_db
+    from .ingest import IngestWriter
+    from .settings import DNS_FOLLOW_STATE, DNS_FOLLOW_BATCH, DNS_FOLLOW_POLL, INGEST_FLUSH_INTERVAL, INGEST_MAX_ROWS
+    await init_db()
+    os.makedirs(os.path.dirname(DNS_FOLLOW_STATE) or ".", exist_ok=True)
+    ingest = IngestWriter(INGEST_FLUSH_INTERVAL, INGEST_MAX_ROWS)
+    await ingest.start()
+    f = DnsFollower(args.path, DNS_FOLLOW_STATE, ingest, DNS_FOLLOW_BATCH, DNS_FOLLOW_POLL, args.from_start)
+    try:
+        if args.once:
+            await f.step()
+        else:
+            await f.start()
+            while True:
+                await asyncio.sleep(10)
+                print(f.stats(), flush=True)
+    finally:
+        await f.stop()
+        await ingest.stop()
+        print(f.stats())
+
+if __name__ == "__main__":
+    from .settings import DNS_QUERY_LOG
+    ap = argparse.ArgumentParser(description="Хвост query.log BIND → dns_hits")
+    ap.add_argument("path", nargs="?", default=DNS_QUERY_LOG)
+    ap.add_argument("--from-start", action="store_true", help="без чекпойнта читать с начала файла, а не с конца")
+    ap.add_argument("--once", action="store_true", help="дочитать до конца и выйти")
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_main(ap.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,179 @@
+# app/enrich.py — фоновое обогащение token_hits ASN-данными (ENRICH_MODE = "background")
+#
+# /api/ping пишет строку с asn=NULL и сразу отвечает; IP попадает в ограниченную очередь,
+# пул воркеров разбирает её пачками, резолвит ASN (дубли по IP склеиваются) и
+# одним UPDATE-executemany проставляет asn/as_name/prefix.
+#
+# Очередь живёт в памяти, поэтому IP, не попавший в неё (put_timeout), оставшийся в ней при
+# остановке или не разрешившийся (whois недоступен), сам по себе остался бы с asn=NULL навсегда.
+# Их подбирает перескан: при старте и раз в rescan_interval строки token_hits с asn IS NULL
+# старше rescan_age снова ставятся в очередь — не больше rescan_batch и только в свободное место.
+import asyncio, time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select, update, bindparam
+
+from . import stats
+from .asn_lookup import ip_to_asn
+from .db import SessionLocal, ReadSessionLocal
+from .models import TokenHit
+
+class EnrichmentQueue:
+    def __init__(self, workers: int, maxsize: int, batch: int, put_timeout: float,
+                 on_commit: Optional[Callable[[], None]] = None,
+                 rescan_interval: float = 60.0, rescan_age: float = 30.0, rescan_batch: int = 500):
+        self.workers, self.maxsize, self.batch, self.put_timeout = workers, maxsize, batch, put_timeout
+        self.on_commit = on_commit          # вызывается после каждого коммита с обновлёнными строками
+        self.rescan_interval, self.rescan_batch = rescan_interval, rescan_batch
+        self.rescan_age = timedelta(seconds=rescan_age)     # моложе — скорее всего ещё в очереди
+        self.queue: Optional[asyncio.Queue] = None
+        self._pending: Set[str] = set()     # IP в очереди или в работе
+        self._tasks: List[asyncio.Task] = []
+        self._rescanner: Optional[asyncio.Task] = None
+        self._rescan_from = 0               # id, с которого продолжит следующий перескан
+        self.enqueued = self.deduped = self.dropped = self.rescanned = 0
+        self.processed = self.resolved = self.batches = self.errors = 0
+        self.lags = deque(maxlen=200)       # сек от постановки в очередь до записи в БД
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def is_pending(self, ip: str) -> bool:
+        return ip in self._pending
+
+    async def start(self) -> None:
+        self.queue = asyncio.Queue(self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float) -> None:
+        # даём дочистить очередь, затем гасим воркеров
+        if self.queue is not None:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self._rescanner is not None:
+            self._tasks.append(self._rescanner)
+            self._rescanner = None
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def start_rescan(self) -> None:
+        # при N воркерах — только у лидера: строки в БД общие, очереди — у каждого свои
+        if self.rescan_interval > 0 and self._rescanner is None:
+            self._rescanner = asyncio.create_task(self._rescan_loop())
+
+    async def _rescan_loop(self) -> None:
+        while True:
+            try:
+                await self.rescan()
+            except Exception:
+                self.errors += 1
+            await asyncio.sleep(self.rescan_interval)
+
+    async def rescan(self) -> int:
+        # -> сколько IP поставлено в очередь; по кругу по id, чтобы неразрешимые IP не заслоняли остальные
+        limit = min(self.rescan_batch, self.maxsize - self.queue.qsize())
+        if limit <= 0:
+            return 0
+        t = TokenHit.__table__
+        cutoff = datetime.utcnow() - self.rescan_age
+        async with ReadSessionLocal() as db:
+            rows = (await db.execute(
+                select(t.c.id, t.c.ip).where(t.c.asn.is_(None), t.c.id > self._rescan_from, t.c.created_at < cutoff)
+                .order_by(t.c.id).limit(limit)
+            )).all()
+        self._rescan_from = rows[-1].id if len(rows) == limit else 0
+        n = 0
+        for r in rows:
+            if r.ip in self._pending:
+                continue
+            try:
+                self.queue.put_nowait((r.ip, time.monotonic()))
+            except asyncio.QueueFull:
+                break
+            self._pending.add(r.ip)
+            n += 1
+        self.rescanned += n
+        return n
+
+    async def submit(self, ip: str) -> bool:
+        # True — IP в очереди (или уже был), False — очередь переполнена (backpressure не помог)
+        if ip in self._pending:
+            self.deduped += 1
+            return True
+        item = (ip, time.monotonic())
+        self._pending.add(ip)
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self.queue.put(item), self.put_timeout)
+            except asyncio.TimeoutError:
+                self._pending.discard(ip)
+                self.dropped += 1
+                return False
+        self.enqueued += 1
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            items = [await self.queue.get()]
+            while len(items) < self.batch and not self.queue.empty():
+                items.append(self.queue.get_nowait())
+            try:
+                await self._process(items)
+            except Exception:
+                self.errors += 1
+            finally:
+                for ip, _ in items:
+                    self._pending.discard(ip)
+                    self.queue.task_done()
+
+    async def _process(self, items: List[Tuple[str, float]]) -> None:
+        ips = list(dict.fromkeys(ip for ip, _ in items))
+        results = await asyncio.gather(*(ip_to_asn(ip) for ip in ips), return_exceptions=True)
+        rows = []
+        for ip, res in zip(ips, results):
+            best = (res.get("best") or {}) if isinstance(res, dict) else {}
+            if best.get("asn"):
+                rows.append({"b_ip": ip, "b_asn": best["asn"], "b_name": best.get("as_name"), "b_prefix": best.get("prefix")})
+        if rows:
+            t = TokenHit.__table__
+            stmt = (update(t)
+                    .where(t.c.ip == bindparam("b_ip"), t.c.asn.is_(None))
+                    .values(asn=bindparam("b_asn"), as_name=bindparam("b_name"), prefix=bindparam("b_prefix")))
+            async with SessionLocal() as db:
+                # какие строки реально сменят ASN (могли быть удалены /api/ping/clear) — для asn_stats
+                todo = set((await db.execute(
+                    select(t.c.ip).where(t.c.ip.in_([r["b_ip"] for r in rows]), t.c.asn.is_(None))
+                )).scalars().all())
+                await db.execute(stmt, rows)
+                await stats.apply_asn_moves(db, ((None, r["b_asn"], r["b_name"]) for r in rows if r["b_ip"] in todo))
+                await db.commit()
+            if todo and self.on_commit is not None:
+                self.on_commit()
+        now = time.monotonic()
+        self.batches += 1; self.processed += len(items); self.resolved += len(rows)
+        self.lags.extend(now - t0 for _, t0 in items)
+
+    def stats(self) -> Dict:
+        lags = sorted(self.lags)
+        return {
+            "running": self.running, "workers": self.workers,
+            "depth": self.queue.qsize() if self.queue is not None else 0,
+            "pending": len(self._pending), "maxsize": self.maxsize,
+            "enqueued": self.enqueued, "deduped": self.deduped, "dropped": self.dropped, "rescanned": self.rescanned,
+            "processed": self.processed, "resolved": self.resolved, "batches": self.batches, "errors": self.errors,
+            "lag_p50": round(lags[len(lags) // 2], 3) if lags else None,
+            "lag_max": round(lags[-1], 3) if lags else None,
+        }
@@ -0,0 +1,145 @@
+# app/ingest.py — единственный писатель для token_hits / http_hits / dns_hits (group commit)
+#
+# Запросы не коммитят сами: строка кладётся в буфер, писатель раз в INGEST_FLUSH_INTERVAL
+# (или при INGEST_MAX_ROWS строк) вставляет всё накопленное одной транзакцией — один fsync
+# на пачку вместо одного на запрос. Для token_hits — INSERT ... ON CONFLICT(ip) DO NOTHING
+# RETURNING ip, так что каждый вызывающий узнаёт, была ли его строка дублем.
+import asyncio, time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import stats
+from .db import SessionLocal
+from .models import TokenHit
+
+class IngestWriter:
+    def __init__(self, flush_interval: float, max_rows: int):
+        self.flush_interval, self.max_rows = flush_interval, max_rows
+        self._buf: List[Tuple[object, Dict, asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.transactions = self.rows = self.duplicates = self.errors = 0
+        self.commit_ms = deque(maxlen=500)
+        self.batch_rows = deque(maxlen=500)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self) -> None:
+        self._wakeup, self._full = asyncio.Event(), asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # не отменяем писателя посреди транзакции: просим дописать буфер и выйти
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set(); self._full.set()
+        await self._task
+        self._task = None
+
+    async def insert(self, model, values: Dict) -> bool:
+        # True — строка вставлена, False — дубль (для token_hits: IP уже есть)
+        fut = asyncio.get_running_loop().create_future()
+        self._buf.append((model.__table__, values, fut))
+        self._wakeup.set()
+        if len(self._buf) >= self.max_rows:
+            self._full.set()
+        return await fut
+
+    async def insert_many(self, model, rows: List[Dict]) -> int:
+        # пачка строк одного источника (app/dns_follow.py): ждём, пока закоммичены все
+        loop = asyncio.get_running_loop()
+        futs = []
+        for values in rows:
+            fut = loop.create_future()
+            self._buf.append((model.__table__, values, fut)); futs.append(fut)
+        if not futs:
+            return 0
+        self._wakeup.set()
+        if len(self._buf) >= self.max_rows:
+            self._full.set()
+        return sum(await asyncio.gather(*futs))
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # копим попутчиков: до flush_interval или до заполнения пачки
+            if not self._stopping:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush()
+            if self._stopping and not self._buf:
+                return
+
+    async def _flush(self) -> None:
+        batch, self._buf = self._buf[:self.max_rows], self._buf[self.max_rows:]
+        if not self._buf:
+            self._wakeup.clear()
+        if len(self._buf) < self.max_rows:
+            self._full.clear()
+        if not batch:
+            return
+
+        by_table: Dict[object, List[Tuple[Dict, asyncio.Future]]] = {}
+        for table, values, fut in batch:
+            by_table.setdefault(table, []).append((values, fut))
+
+        t0 = time.perf_counter()
+        results: List[Tuple[asyncio.Future, bool]] = []
+        try:
+            async with SessionLocal() as db:
+                async with db.begin():
+                    for table, items in by_table.items():
+                        results.extend(await self._insert_table(db, table, items))
+        except Exception as e:
+            self.errors += 1
+            for _, _, fut in batch:
+                if not fut.done(): fut.set_exception(e)
+            return
+        self.commit_ms.append((time.perf_counter() - t0) * 1000)
+        self.transactions += 1; self.rows += len(batch); self.batch_rows.append(len(batch))
+        for fut, inserted in results:
+            if not inserted: self.duplicates += 1
+            if not fut.done(): fut.set_result(inserted)
+
+    async def _insert_table(self, db, table, items) -> List[Tuple[asyncio.Future, bool]]:
+        if table is not TokenHit.__table__:
+            await db.execute(sqlite_insert(table), [v for v, _ in items])
+            return [(fut, True) for _, fut in items]
+        # один IP дважды в пачке: вставляем только первый, остальные — дубли
+        first: Dict[str, Dict] = {}
+        for v, _ in items:
+            first.setdefault(v["ip"], v)
+        stmt = (sqlite_insert(table)
+                .on_conflict_do_nothing(index_elements=["ip"])
+                .returning(table.c.ip))
+        res = await db.execute(stmt, list(first.values()))
+        inserted = set(res.scalars().all())
+        # агрегаты /api/ping/stats — в той же транзакции
+        await stats.apply_inserts(db, (first[ip] for ip in inserted))
+        out = []
+        for v, fut in items:
+            ok = v["ip"] in inserted and first.get(v["ip"]) is v
+            out.append((fut, ok))
+        return out
+
+    def stats(self) -> Dict:
+        ms = sorted(self.commit_ms)
+        def pct(p): return round(ms[min(len(ms) - 1, int(len(ms) * p))], 2) if ms else None
+        return {
+            "running": self.running, "flush_interval": self.flush_interval, "max_rows": self.max_rows,
+            "buffered": len(self._buf), "transactions": self.transactions, "rows": self.rows,
+            "duplicates": self.duplicates, "errors": self.errors,
+            "rows_per_txn": round(self.rows / self.transactions, 2) if self.transactions else None,
+            "recent_rows_per_txn": round(sum(self.batch_rows) / len(self.batch_rows), 2) if self.batch_rows else None,
+            "commit_ms_p50": pct(0.5), "commit_ms_p99": pct(0.99),
+        }
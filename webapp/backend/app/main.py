@@ -2,25 +2,106 @@ import re
 import asyncio
 import uuid
 from typing import AsyncGenerator, List, Optional
-import os, time, shutil, urllib.request, asyncio
+import os, time, shutil, urllib.request, asyncio, json, logging
+from datetime import datetime, timedelta, timezone
 
 from fastapi import FastAPI, Depends, HTTPException, Request, File
 from fastapi.responses import StreamingResponse, Response, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 from sqlalchemy import select, update, delete, func, desc
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .settings import BASE_DOMAIN, RIPE_URL, DATA_DIR
-from .db import SessionLocal, init_db
+from .settings import (BASE_DOMAIN, RIPE_URL, DATA_DIR, PING_ENRICH_BUDGET, ENRICH_MODE, ENRICH_WORKERS,
+                       ENRICH_QUEUE_MAX, ENRICH_BATCH, ENRICH_PUT_TIMEOUT, ENRICH_DRAIN_TIMEOUT,
+                       ENRICH_RESCAN_INTERVAL, ENRICH_RESCAN_AGE, ENRICH_RESCAN_BATCH,
+                       INGEST_FLUSH_INTERVAL, INGEST_MAX_ROWS, RESPONSE_CACHE_MAX_STALE,
+                       DNS_FOLLOW, DNS_QUERY_LOG, DNS_FOLLOW_STATE, DNS_FOLLOW_BATCH, DNS_FOLLOW_POLL,
+                       CORRELATION, CORRELATION_WINDOW, CORRELATION_INTERVAL, CORRELATION_BATCH,
+                       LIVE_RING_SIZE, LIVE_CLIENT_QUEUE, LIVE_STATS_INTERVAL, LIVE_KEEPALIVE,
+                       METRICS_ENABLED, PROFILER_ENABLED, PROFILER_INTERVAL, PROFILER_MAX_SECONDS,
+                       WORKERS, WORKERS_POLL, LEADER_RETRY, SHARED_ASN_PURGE, ROLLUP, ROLLUP_INTERVAL, ROLLUP_BATCH,
+                       ROLLUP_DELAY, ROLLUP_LOOKUPS, ROLLUP_ASN_GIVEUP,
+                       RETENTION_DAYS, RETENTION_HOURLY_DAYS, RETENTION_BATCH, RETENTION_PAUSE, VACUUM_PAGES)
+from .db import SessionLocal, ReadSessionLocal, init_db, check_pragmas
 from .models import HttpHit, DnsHit, Item, TokenHit
-from .asn_lookup import ip_to_asn
+from .asn_lookup import ip_to_asn, cache as asn_cache, cymru_batcher, local_table, cymru_host, radb_host
+from . import stats, metrics
+from .enrich import EnrichmentQueue
+from .ingest import IngestWriter
+from .dns_follow import DnsFollower
+from . import correlation
+from .correlation import Correlator
+from . import rollup
+from .rollup import RollupWorker
+from .response_cache import ResponseCache
+from .broadcast import Broadcaster
+from .paging import keyset_page, export_rows
+from .ripe_stats import RipeAsnStats
+from .ripe_download import RipeDownloader
+from .profiler import SamplingProfiler
+from . import workers
+
+log = logging.getLogger("app.main")
 
 RIPE_LOCAL = os.path.join(DATA_DIR, "delegated-ripencc-latest")
+ripe_asn_stats = RipeAsnStats(RIPE_LOCAL, DATA_DIR)
+ripe_downloader = RipeDownloader(RIPE_URL, RIPE_LOCAL)
 
 app = FastAPI(title="Async Demo: Progress + REST + SQLite")
 
+# несколько воркеров uvicorn (run.sh: WORKERS=N): записи в token_hits и очистку видят все процессы
+MULTI = WORKERS > 1
+hits_version = workers.SharedVersion(os.path.join(DATA_DIR, "hits.version")) if MULTI else None
+clear_version = workers.SharedVersion(os.path.join(DATA_DIR, "hits.cleared")) if MULTI else None
+leadership = workers.Leadership(DATA_DIR, LEADER_RETRY)
+
+# готовые JSON-ответы stats/last; версия растёт при каждой записи в token_hits
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_STALE, shared=hits_version)
+# живая лента: новые пинги и свежая статистика всем открытым дашбордам
+broadcaster = Broadcaster(LIVE_RING_SIZE, LIVE_CLIENT_QUEUE, first_seq=(os.getpid() << 32) if MULTI else 0)
+
+async def _live_stats() -> dict:
+    async with ReadSessionLocal() as db:
+        total, uniq, agg = await stats.read(db, 5)
+    return PingStatsOut(total_hits=int(total), unique_ips=int(uniq), pending=enrich_queue.pending_count,
+                        top=[StatRow(asn=a, as_name=n, count=int(c)) for a, n, c in agg]).model_dump()
+
+def hits_changed() -> None:
+    # любая запись/обогащение/очистка token_hits
+    response_cache.bump()
+    broadcaster.publish_coalesced("stats", _live_stats, LIVE_STATS_INTERVAL)
+
+enrich_queue = EnrichmentQueue(ENRICH_WORKERS, ENRICH_QUEUE_MAX, ENRICH_BATCH, ENRICH_PUT_TIMEOUT,
+                               on_commit=hits_changed, rescan_interval=ENRICH_RESCAN_INTERVAL,
+                               rescan_age=ENRICH_RESCAN_AGE, rescan_batch=ENRICH_RESCAN_BATCH)
+ingest = IngestWriter(INGEST_FLUSH_INTERVAL, INGEST_MAX_ROWS)
+dns_follower = DnsFollower(DNS_QUERY_LOG, DNS_FOLLOW_STATE, ingest, DNS_FOLLOW_BATCH, DNS_FOLLOW_POLL)
+correlator = Correlator(CORRELATION_WINDOW, CORRELATION_INTERVAL, CORRELATION_BATCH)
+rollup_worker = RollupWorker(ROLLUP_INTERVAL, ROLLUP_BATCH, ROLLUP_DELAY, RETENTION_DAYS, RETENTION_HOURLY_DAYS,
+                             RETENTION_BATCH, RETENTION_PAUSE, VACUUM_PAGES, guard_correlation=CORRELATION,
+                             lookups=ROLLUP_LOOKUPS, asn_giveup=ROLLUP_ASN_GIVEUP,
+                             enrich_running=lambda: enrich_queue.running)
+profiler = SamplingProfiler(PROFILER_MAX_SECONDS)
+_background: List[asyncio.Task] = []       # задачи многопроцессного режима (лидерство, лента из других воркеров)
+
+# кэши и очереди сами ведут счётчики — /metrics читает их stats() в момент выдачи
+metrics.register_cache("asn_cache", asn_cache.stats, ("hits", "prefix_hits", "negative_hits", "misses", "coalesced"))
+metrics.register_cache("response_cache", response_cache.stats, ("hits", "stale_hits", "misses", "not_modified"))
+metrics.register_cache("local_asn", local_table.stats, ("hits", "misses"))
+metrics.REGISTRY.gauge_func("whois_breaker_open", "1 while the host's circuit breaker rejects queries",
+                            lambda: {(h.host,): int(h.breaker.state == "open") for h in (cymru_host, radb_host)},
+                            ("host",))
+metrics.REGISTRY.gauge_func("whois_inflight", "whois queries holding a per-host slot",
+                            lambda: {(h.host,): h.inflight for h in (cymru_host, radb_host)}, ("host",))
+metrics.REGISTRY.gauge_func("enrich_pending", "IPs waiting for background ASN enrichment",
+                            lambda: enrich_queue.pending_count)
+metrics.REGISTRY.gauge_func("rollup_backlog", "Raw rows not yet folded into hit_rollups",
+                            lambda: {(t,): n for t, n in rollup_worker.backlog.items()}, ("table",))
+metrics.REGISTRY.gauge_func("live_subscribers", "Open /api/ping/stream connections",
+                            lambda: broadcaster.stats()["subscribers"])
+
 # Разрешим CORS
 app.add_middleware(
     CORSMiddleware,
@@ -28,12 +109,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+# латентность по шаблону маршрута и запросы в работе (снаружи CORS — меряем весь ответ)
+if METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware, routes=app.routes)
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     async with SessionLocal() as session:
         yield session
 
+# сессия на read-only движке — для GET-эндпоинтов, не занимает соединение писателя
+async def get_read_db() -> AsyncGenerator[AsyncSession, None]:
+    async with ReadSessionLocal() as session:
+        yield session
+
 def _file_age_seconds(path: str) -> float:
     return time.time() - os.path.getmtime(path)
 
@@ -69,6 +159,7 @@ class PingOut(BaseModel):
     as_name: str | None = None
     prefix: str | None = None
     duplicate: bool = False
+    pending: bool = False   # ASN ещё определяется в фоне (ENRICH_MODE = "background")
 
 class PingRow(BaseModel):
     when: str
@@ -88,14 +179,103 @@ class PingStatsOut(BaseModel):
     total_hits: int
     unique_ips: int
     top: list[StatRow]
+    pending: int = 0        # IP, ждущих фонового обогащения
+
+_ping_rows = TypeAdapter(list[PingRow])
 
 # -----------------------------
 # Инициализация БД при старте
 # -----------------------------
+async def _prepare_db() -> None:
+    await init_db()
+    await check_pragmas()
+    async with SessionLocal() as db:
+        await stats.ensure(db)
+    if asn_cache.shared is not None:
+        asn_cache.shared.purge()
+
+async def _start_singletons() -> None:
+    # коррелятор, хвост query.log, свёртки, перескан asn IS NULL и чистка общего кэша ASN — по одному
+    # на всё приложение; при N воркерах — у лидера
+    if MULTI:
+        await leadership.wait()
+    if ENRICH_MODE == "background":
+        await enrich_queue.start_rescan()
+    if asn_cache.shared is not None:
+        _background.append(asyncio.create_task(asn_cache.shared.purge_loop(SHARED_ASN_PURGE)))
+    if DNS_FOLLOW:
+        await dns_follower.start()
+    if CORRELATION:
+        await correlator.start()
+    if ROLLUP:
+        await rollup_worker.start()
+
+async def _follow_workers() -> None:
+    # лента SSE при N воркерах: пинг мог записать любой процесс, поэтому hit-события публикует
+    # этот цикл — новые строки token_hits по id, когда меняется общая версия
+    seen, cleared = hits_version.value(), clear_version.value()
+    async with ReadSessionLocal() as db:
+        last = (await db.execute(select(func.max(TokenHit.id)))).scalar() or 0
+    t = TokenHit.__table__
+    while True:
+        await asyncio.sleep(WORKERS_POLL)
+        v, c = hits_version.value(), clear_version.value()
+        if v == seen and c == cleared:
+            continue
+        try:
+            async with ReadSessionLocal() as db:
+                if c != cleared:
+                    # /api/ping/clear в каком-то воркере; id после очистки начинаются заново
+                    cleared, last = c, 0
+                    broadcaster.publish("clear", {"deleted": None})
+                rows = (await db.execute(
+                    select(t.c.id, t.c.created_at, t.c.token, t.c.ip, t.c.asn, t.c.as_name, t.c.prefix, t.c.user_agent)
+                    .where(t.c.id > last).order_by(t.c.id).limit(LIVE_RING_SIZE)
+                )).all()
+        except Exception:
+            log.exception("worker feed poll failed")
+            continue
+        seen = v
+        for r in rows:
+            broadcaster.publish("hit", PingRow(when=r.created_at.isoformat(timespec="seconds"), token=r.token,
+                                               ip=r.ip, asn=r.asn, as_name=r.as_name, prefix=r.prefix,
+                                               user_agent=r.user_agent).model_dump())
+            last = r.id
+        broadcaster.publish_coalesced("stats", _live_stats, LIVE_STATS_INTERVAL)
+
 @app.on_event("startup")
 async def on_startup():
-    await init_db()
+    if MULTI:
+        # схему, прагмы и счётчики готовит ровно один воркер; остальные ждут здесь же
+        await workers.init_once(DATA_DIR, _prepare_db)
+    else:
+        await _prepare_db()
     os.makedirs(DATA_DIR, exist_ok=True)
+    # снапшот pfx2as строится в потоке; если файла нет — работаем только через whois
+    await local_table.reload()
+    await ingest.start()
+    if ENRICH_MODE == "background":
+        await enrich_queue.start()
+    if MULTI:
+        _background.append(asyncio.create_task(_start_singletons()))
+        _background.append(asyncio.create_task(_follow_workers()))
+    else:
+        await _start_singletons()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    for task in _background:
+        task.cancel()
+    await asyncio.gather(*_background, return_exceptions=True)
+    await broadcaster.stop()
+    await rollup_worker.stop()
+    await correlator.stop()
+    await dns_follower.stop()
+    leadership.release()
+    if enrich_queue.running:
+        await enrich_queue.stop(ENRICH_DRAIN_TIMEOUT)
+    await ingest.stop()
+    await radb_host.close()
 
 # -----------------------------
 # Статика (демо страница)
@@ -120,17 +300,26 @@ async def create_item(payload: ItemIn, db: AsyncSession = Depends(get_db)):
         created_at=item.created_at.isoformat()
     )
 
+# GET /api/items?limit=N&cursor=... — страница по (created_at, id), курсор следующей — в X-Next-Cursor
 @app.get("/api/items", response_model=List[ItemOut])
-async def list_items(db: AsyncSession = Depends(get_db)):
-    res = await db.execute(select(Item).order_by(Item.id.desc()))
-    items = res.scalars().all()
+async def list_items(response: Response, db: AsyncSession = Depends(get_read_db),
+                     limit: int = 100, cursor: Optional[str] = None):
+    if not 1 <= limit <= 1000:
+        raise HTTPException(422, "limit must be in 1..1000")
+    t = Item.__table__
+    try:
+        rows, nxt = await keyset_page(db, t, (t.c.id, t.c.title, t.c.description, t.c.created_at), limit, cursor)
+    except ValueError:
+        raise HTTPException(400, "bad cursor")
+    if nxt:
+        response.headers["X-Next-Cursor"] = nxt
     return [
         ItemOut(
             id=i.id,
             title=i.title,
             description=i.description,
             created_at=i.created_at.isoformat()
-        ) for i in items
+        ) for i in rows
     ]
 
 @app.put("/api/items/{item_id}", response_model=ItemOut)
@@ -190,22 +379,33 @@ async def delete_item(item_id: int, db: AsyncSession = Depends(get_db)):
 
 @app.post("/api/ripe/ensure")
 async def ripe_ensure(force: bool = False, max_age_hours: int = 24):
-    os.makedirs(DATA_DIR, exist_ok=True)
-    need = force or (not os.path.exists(RIPE_LOCAL)) or (_file_age_seconds(RIPE_LOCAL) > max_age_hours * 3600)
-
-    downloaded = False
-    if need:
-        tmp = RIPE_LOCAL + ".tmp"
-        def _download():
-            with urllib.request.urlopen(RIPE_URL) as resp, open(tmp, "wb") as out:
-                shutil.copyfileobj(resp, out)
-            os.replace(tmp, RIPE_LOCAL)
-        await asyncio.to_thread(_download)
-        downloaded = True
-
-    size  = os.path.getsize(RIPE_LOCAL) if os.path.exists(RIPE_LOCAL) else 0
-    mtime = os.path.getmtime(RIPE_LOCAL) if os.path.exists(RIPE_LOCAL) else None
-    return {"downloaded": downloaded, "size": size, "mtime": mtime}
+    # условный запрос + докачка + одна передача на всех (app/ripe_download.py)
+    try:
+        res = await ripe_downloader.ensure(force, max_age_hours)
+    except Exception as e:
+        raise HTTPException(502, f"RIPE download failed: {e}")
+    if res["downloaded"]:
+        # агрегаты для графика пересчитаем сразу, не дожидаясь первого запроса
+        ripe_asn_stats.schedule()
+    return res
+
+# GET /api/ripe/progress — состояние текущей/последней загрузки (байты, скорость)
+@app.get("/api/ripe/progress")
+async def ripe_progress():
+    return dict(ripe_downloader.progress, active=ripe_downloader.active)
+
+# GET /api/ripe/progress/stream — то же через SSE, пока идёт загрузка
+@app.get("/api/ripe/progress/stream")
+async def ripe_progress_stream(interval: float = 0.5):
+    interval = min(max(interval, 0.1), 5.0)
+    async def gen():
+        while True:
+            data = dict(ripe_downloader.progress, active=ripe_downloader.active)
+            yield f"data: {json.dumps(data)}\n\n"
+            if not data["active"]:
+                return
+            await asyncio.sleep(interval)
+    return StreamingResponse(gen(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 # Отдаём кэшированный файл
 @app.get("/api/ripe/file")
@@ -215,86 +415,298 @@ async def ripe_file():
     # FileResponse отдаёт Content-Length → фронту будет что показывать в прогрессе
     return FileResponse(RIPE_LOCAL, media_type="text/plain", filename="delegated-ripencc-latest")
 
+async def enrich_asn(ip: str) -> tuple:
+    # (asn, as_name, prefix); не дольше PING_ENRICH_BUDGET — сам whois при этом
+    # доработает в фоне и попадёт в кэш (ожидание в кэше обёрнуто в shield)
+    try:
+        res = await asyncio.wait_for(ip_to_asn(ip), PING_ENRICH_BUDGET)
+        best = res.get("best") or {}
+        return best.get("asn"), best.get("as_name"), best.get("prefix")
+    except Exception:
+        return None, None, None
+
+# GET /api/ripe/asn-stats — готовые агрегаты выделения ASN (несколько КБ вместо всего файла)
+@app.get("/api/ripe/asn-stats")
+async def ripe_asn_stats_get(cc: str = "RU"):
+    if not re.fullmatch(r"[A-Za-z]{2}", cc):
+        raise HTTPException(400, "cc must be a two-letter country code")
+    res = await ripe_asn_stats.get(cc.upper())
+    if res is None:
+        raise HTTPException(404, "RIPE file not found; POST /api/ripe/ensure first")
+    return res
+
 # POST /api/ping
 @app.post("/api/ping", response_model=PingOut)
-async def ping(payload: PingIn, request: Request, db: AsyncSession = Depends(get_db)):
+async def ping(payload: PingIn, request: Request, db: AsyncSession = Depends(get_read_db)):
     ip = get_client_ip(request)
     ua = request.headers.get("user-agent", "")[:255]
 
-    # быстрый софт-чек (а хард-чек — уникальный индекс)
-    exists = await db.execute(select(TokenHit.id).where(TokenHit.ip == ip).limit(1))
-    if exists.scalar_one_or_none() is not None:
-        # ASN всё равно попробуем определить и показать пользователю актуальные данные
-        asn = as_name = prefix = None
-        try:
-            res = await ip_to_asn(ip)
-            best = res.get("best") or {}
-            asn, as_name, prefix = best.get("asn"), best.get("as_name"), best.get("prefix")
-        except Exception:
-            pass
-        return PingOut(token=payload.token, ip=ip, asn=asn, as_name=as_name, prefix=prefix, duplicate=True)
-
-    # обогащение ASN
+    # обогащение ASN (в фоновом режиме — после записи, через очередь)
     asn = as_name = prefix = None
-    try:
-        res = await ip_to_asn(ip)
-        best = res.get("best") or {}
-        asn, as_name, prefix = best.get("asn"), best.get("as_name"), best.get("prefix")
-    except Exception:
-        pass
-
-    # запись; ловим IntegrityError, если два запроса пришли одновременно
-    try:
-        db.add(TokenHit(token=payload.token, ip=ip, asn=asn, as_name=as_name, prefix=prefix, user_agent=ua))
-        await db.commit()
-        return PingOut(token=payload.token, ip=ip, asn=asn, as_name=as_name, prefix=prefix, duplicate=False)
-    except IntegrityError:
-        # второй запрос промахнулся в уникальный индекс — считаем дубликатом
-        await db.rollback()
-        return PingOut(token=payload.token, ip=ip, asn=asn, as_name=as_name, prefix=prefix, duplicate=True)
+    if not enrich_queue.running:
+        asn, as_name, prefix = await enrich_asn(ip)
+
+    # запись через групповой коммит; дубль по IP ловит ON CONFLICT(ip) DO NOTHING.
+    # created_at ставим сами: лента публикует то же время, что лежит в строке (и в курсоре /api/ping/last);
+    # метка и постановка в буфер — без await между ними, поэтому порядок created_at совпадает с порядком id
+    created_at = datetime.utcnow()
+    inserted = await ingest.insert(TokenHit, {
+        "token": payload.token, "ip": ip, "asn": asn, "as_name": as_name, "prefix": prefix, "user_agent": ua,
+        "created_at": created_at,
+    })
+    if inserted:
+        if not MULTI:       # при N воркерах ленту ведёт _follow_workers
+            broadcaster.publish("hit", PingRow(when=created_at.isoformat(timespec="seconds"), token=payload.token,
+                                               ip=ip, asn=asn, as_name=as_name, prefix=prefix,
+                                               user_agent=ua).model_dump())
+        hits_changed()
+        pending = enrich_queue.running and await enrich_queue.submit(ip)
+        return PingOut(token=payload.token, ip=ip, asn=asn, as_name=as_name, prefix=prefix, duplicate=False, pending=pending)
+
+    if enrich_queue.running:
+        # в фоновом режиме отдаём то, что уже записано (или ещё определяется)
+        row = (await db.execute(
+            select(TokenHit.asn, TokenHit.as_name, TokenHit.prefix).where(TokenHit.ip == ip).limit(1)
+        )).first()
+        if row is not None:
+            asn, as_name, prefix = row
+    return PingOut(token=payload.token, ip=ip, asn=asn, as_name=as_name, prefix=prefix, duplicate=True,
+                   pending=enrich_queue.is_pending(ip))
 
 # GET /api/ping/stats — всего, уникальные IP и ТОП-5 ASN
 @app.get("/api/ping/stats", response_model=PingStatsOut)
-async def ping_stats(db: AsyncSession = Depends(get_db), top: int = 5):
-    total = (await db.execute(select(func.count(TokenHit.id)))).scalar_one()
-    uniq  = (await db.execute(select(func.count(func.distinct(TokenHit.ip))))).scalar_one()
-
-    agg = await db.execute(
-        select(TokenHit.asn, TokenHit.as_name, func.count().label("cnt"))
-        .group_by(TokenHit.asn, TokenHit.as_name)
-        .order_by(desc("cnt"))
-        .limit(top)
-    )
-    top_rows = [StatRow(asn=a, as_name=n, count=int(c)) for a, n, c in agg.all()]
-    return PingStatsOut(total_hits=int(total), unique_ips=int(uniq), top=top_rows)
+async def ping_stats(request: Request, db: AsyncSession = Depends(get_read_db), top: int = 5):
+    # материализованные счётчики (app/stats.py), без прохода по token_hits
+    async def build() -> bytes:
+        total, uniq, agg = await stats.read(db, top)
+        top_rows = [StatRow(asn=a, as_name=n, count=int(c)) for a, n, c in agg]
+        out = PingStatsOut(total_hits=int(total), unique_ips=int(uniq), top=top_rows)
+        return out.model_dump_json(exclude={"pending"}).encode()
+    # pending меняется без записи в token_hits (очередь, перескан) — не в кэше, а при каждом ответе
+    return await response_cache.respond(request, ("stats", top), build,
+                                        live=lambda: {"pending": enrich_queue.pending_count})
+
+# GET /api/ping/stats/check — сверка счётчиков с token_hits (полный проход, для обслуживания)
+@app.get("/api/ping/stats/check")
+async def ping_stats_check(db: AsyncSession = Depends(get_read_db)):
+    return await stats.check(db)
+
+# POST /api/ping/stats/rebuild — пересчитать счётчики из token_hits
+@app.post("/api/ping/stats/rebuild")
+async def ping_stats_rebuild(db: AsyncSession = Depends(get_db)):
+    await stats.rebuild(db)
+    await db.commit()
+    hits_changed()
+    return await stats.check(db)
 
-# GET /api/ping/last — последние N пингов (список “пользователей”)
+# GET /api/ping/last — последние N пингов (список “пользователей”);
+# дальше — ?cursor= из заголовка X-Next-Cursor (keyset по (created_at, id), индекс ix_token_hits_created_id)
 @app.get("/api/ping/last", response_model=list[PingRow])
-async def ping_last(db: AsyncSession = Depends(get_db), limit: int = 100):
-    q = await db.execute(select(TokenHit).order_by(TokenHit.created_at.desc()).limit(limit))
-    rows = q.scalars().all()
-    return [
-        PingRow(
-            when=r.created_at.isoformat(timespec="seconds"),
-            token=r.token, ip=r.ip, asn=r.asn, as_name=r.as_name, prefix=r.prefix,
-            user_agent=r.user_agent
-        )
-        for r in rows
-    ]
+async def ping_last(request: Request, db: AsyncSession = Depends(get_read_db), limit: int = 100,
+                    cursor: Optional[str] = None):
+    if not 1 <= limit <= 1000:
+        raise HTTPException(422, "limit must be in 1..1000")
+    async def build():
+        t = TokenHit.__table__
+        try:
+            rows, nxt = await keyset_page(db, t, (t.c.id, t.c.created_at, t.c.token, t.c.ip, t.c.asn,
+                                                  t.c.as_name, t.c.prefix, t.c.user_agent), limit, cursor)
+        except ValueError:
+            raise HTTPException(400, "bad cursor")
+        body = _ping_rows.dump_json([
+            PingRow(
+                when=r.created_at.isoformat(timespec="seconds"),
+                token=r.token, ip=r.ip, asn=r.asn, as_name=r.as_name, prefix=r.prefix,
+                user_agent=r.user_agent
+            )
+            for r in rows
+        ])
+        return body, ({"X-Next-Cursor": nxt} if nxt else {})
+    return await response_cache.respond(request, ("last", limit, cursor), build)
+
+# GET /api/export/{table}?format=ndjson|csv — потоковая выгрузка всей таблицы пачками
+EXPORT_TABLES = {"token_hits": TokenHit.__table__, "items": Item.__table__}
+
+@app.get("/api/export/{table}")
+async def export_table(table: str, format: str = "ndjson"):
+    if table not in EXPORT_TABLES:
+        raise HTTPException(404, f"unknown table; one of: {', '.join(EXPORT_TABLES)}")
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(422, "format must be ndjson or csv")
+    media = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(export_rows(ReadSessionLocal, EXPORT_TABLES[table], format), media_type=media,
+                             headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'})
+
+# GET /api/ping/stream — SSE: события hit (новый пинг), stats (не чаще LIVE_STATS_INTERVAL),
+# clear; при переподключении EventSource сам шлёт Last-Event-ID и получает пропущенное
+@app.get("/api/ping/stream")
+async def ping_stream(request: Request, last_id: Optional[int] = None):
+    hdr = request.headers.get("last-event-id")
+    if hdr and hdr.isdigit():
+        last_id = int(hdr)
+    return StreamingResponse(broadcaster.stream(last_id, LIVE_KEEPALIVE), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# GET /api/live/stats — подписчики и события живой ленты
+@app.get("/api/live/stats")
+async def live_stats():
+    return broadcaster.stats()
+
+# GET /api/cache/stats — попадания кэша ответов
+@app.get("/api/cache/stats")
+async def response_cache_stats():
+    return response_cache.stats()
+
+# GET /metrics — всё то же и гистограммы (HTTP, whois, SQLite) в текстовом формате Prometheus
+@app.get("/metrics", include_in_schema=False)
+async def metrics_get():
+    if not METRICS_ENABLED:
+        raise HTTPException(404, "metrics disabled")
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+# POST /api/profile/start — семплирующий профилировщик (поток event loop'а; all_threads — все потоки)
+@app.post("/api/profile/start")
+async def profile_start(interval: float = PROFILER_INTERVAL, duration: Optional[float] = None,
+                        all_threads: bool = False):
+    if not PROFILER_ENABLED:
+        raise HTTPException(404, "profiler disabled")
+    if not 0.001 <= interval <= 1.0:
+        raise HTTPException(422, "interval must be in 0.001..1.0")
+    try:
+        return profiler.start(interval, duration, all_threads)
+    except RuntimeError as e:
+        raise HTTPException(409, str(e))
+
+# POST /api/profile/stop — остановить и отдать свёрнутые стеки (flamegraph.pl / speedscope)
+@app.post("/api/profile/stop")
+async def profile_stop():
+    return Response(await asyncio.to_thread(profiler.stop), media_type="text/plain")
+
+# GET /api/profile — состояние; /api/profile/folded — стеки без остановки
+@app.get("/api/profile")
+async def profile_status():
+    return profiler.stats()
+
+@app.get("/api/profile/folded")
+async def profile_folded():
+    return Response(profiler.folded(), media_type="text/plain")
+
+# GET /api/asn/cache — счётчики кэша IP→ASN
+@app.get("/api/asn/cache")
+async def asn_cache_stats():
+    return asn_cache.stats()
+
+# GET /api/asn/cymru — сколько IP уходило в каждом bulk-запросе к Team Cymru
+@app.get("/api/asn/cymru")
+async def asn_cymru_stats():
+    return cymru_batcher.stats()
+
+# GET /api/asn/whois — соединения с whois по хостам: занятость, переиспользование, предохранитель
+@app.get("/api/asn/whois")
+async def asn_whois_stats():
+    return {"cymru": cymru_host.stats(), "radb": radb_host.stats()}
+
+# GET /api/workers — этот процесс в многопроцессном режиме: лидер ли он, общий кэш ASN, общая версия
+@app.get("/api/workers")
+async def workers_info():
+    return {"workers": WORKERS, "pid": os.getpid(), "leader": leadership.is_leader if MULTI else True,
+            "hits_version": hits_version.value() if MULTI else response_cache.version,
+            "shared_asn_cache": asn_cache.shared.stats() if asn_cache.shared is not None else None}
+
+# GET /api/enrich/stats — глубина очереди фонового обогащения и задержка записи ASN
+@app.get("/api/enrich/stats")
+async def enrich_stats():
+    return dict(enrich_queue.stats(), mode=ENRICH_MODE)
+
+# GET /api/ingest/stats — строк на транзакцию и задержка коммита группового писателя
+@app.get("/api/ingest/stats")
+async def ingest_stats():
+    return ingest.stats()
+
+# GET /api/correlation — матрица AS пользователей × AS резолверов (из asn_pair_stats)
+#   ?client_asn=X — какие AS резолверов у пользователей AS X; ?resolver_asn=Y — наоборот
+@app.get("/api/correlation")
+async def correlation_matrix(db: AsyncSession = Depends(get_read_db), client_asn: Optional[int] = None,
+                             resolver_asn: Optional[int] = None, top: int = 20):
+    if not 1 <= top <= 500:
+        raise HTTPException(422, "top must be in 1..500")
+    return await correlation.read(db, client_asn, resolver_asn, top)
+
+# GET /api/correlation/status — водяные знаки, отставание и производительность коррелятора
+@app.get("/api/correlation/status")
+async def correlation_status():
+    return correlator.stats()
+
+# GET /api/stats/history — ряд по часам/суткам из hit_rollups (сырые таблицы не читаются);
+#   kind: ping (новые IP в token_hits) | http | dns; ?asn= — только этот ASN (0 — не определён)
+@app.get("/api/stats/history")
+async def stats_history(db: AsyncSession = Depends(get_read_db), period: str = "day", kind: str = "ping",
+                        asn: Optional[int] = None, since: Optional[datetime] = None, until: Optional[datetime] = None):
+    since, until = _history_range(period, kind, since, until)
+    return {"period": period, "kind": kind, "asn": asn, "since": since.isoformat(), "until": until.isoformat(),
+            "series": await rollup.history(db, period, kind, asn, since, until)}
+
+# GET /api/stats/top — ТОП ASN за период из hit_rollups
+@app.get("/api/stats/top")
+async def stats_top(db: AsyncSession = Depends(get_read_db), period: str = "day", kind: str = "ping",
+                    since: Optional[datetime] = None, until: Optional[datetime] = None, top: int = 10):
+    if not 1 <= top <= 500:
+        raise HTTPException(422, "top must be in 1..500")
+    since, until = _history_range(period, kind, since, until)
+    return {"period": period, "kind": kind, "since": since.isoformat(), "until": until.isoformat(),
+            "top": await rollup.top(db, period, kind, since, until, top)}
+
+def _history_range(period: str, kind: str, since: Optional[datetime], until: Optional[datetime]):
+    if period not in rollup.PERIODS:
+        raise HTTPException(422, f"period must be one of: {', '.join(rollup.PERIODS)}")
+    if kind not in rollup.KINDS.values():
+        raise HTTPException(422, f"kind must be one of: {', '.join(rollup.KINDS.values())}")
+    # по умолчанию — последние 48 часов или 30 суток; время в UTC, как created_at
+    until = _naive_utc(until) if until else datetime.utcnow()
+    since = _naive_utc(since) if since else until - (timedelta(hours=48) if period == "hour" else timedelta(days=30))
+    return since, until
+
+def _naive_utc(ts: datetime) -> datetime:
+    return ts.astimezone(timezone.utc).replace(tzinfo=None) if ts.tzinfo else ts
+
+# GET /api/rollup/status — водяные знаки и отставание свёрток, удалено по сроку хранения, incremental_vacuum
+@app.get("/api/rollup/status")
+async def rollup_status():
+    return rollup_worker.stats()
+
+# GET /api/dns/follow — хвост query.log: offset, отставание, строк/с
+@app.get("/api/dns/follow")
+async def dns_follow_stats():
+    return dns_follower.stats()
+
+# GET /api/asn/local — состояние локального снапшота pfx2as
+@app.get("/api/asn/local")
+async def asn_local_info():
+    return local_table.stats()
+
+# POST /api/asn/local/reload — перечитать снапшот (новый строится в потоке, подмена атомарная)
+@app.post("/api/asn/local/reload")
+async def asn_local_reload():
+    info = await local_table.reload()
+    if info.get("error"):
+        raise HTTPException(404, info["error"])
+    return info
 
 @app.post("/api/ping/clear")
 async def ping_clear(db: AsyncSession = Depends(get_db)):
     before = (await db.execute(select(func.count(TokenHit.id)))).scalar_one()
     await db.execute(delete(TokenHit))
+    await stats.reset(db)
+    await correlation.reset_source(db, TokenHit.__tablename__)
+    await rollup.reset_kind(db, TokenHit.__tablename__)
     await db.commit()
+    if MULTI:
+        clear_version.bump()        # событие clear всем воркерам разошлёт _follow_workers
+    else:
+        broadcaster.publish("clear", {"deleted": int(before)})
+    hits_changed()
     return {"deleted": int(before)}
 
 def get_client_ip(request: Request) -> str:
     xff = request.headers.get("x-forwarded-for")
     return xff.split(",")[0].strip() if xff else request.client.host
-
-def extract_token_from_host(host: str) -> str | None:
-    host = host.split(":")[0].lower()
-    if host.endswith("." + BASE_DOMAIN):
-        return host[:-(len(BASE_DOMAIN)+1)].split(".")[0] or None
-    return None
@@ -0,0 +1,267 @@
+# app/metrics.py — метрики в текстовом формате Prometheus (GET /metrics), без внешних зависимостей
+#
+# Счётчики, gauge и гистограммы с метками живут в одном процессе (REGISTRY) и меняются только
+# из потока event loop'а. Значения, которые уже считают сами компоненты (кэши, очереди), не
+# дублируются: они регистрируются функцией и читаются в момент выдачи /metrics.
+import bisect, time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from starlette.routing import Match
+
+# секунды: от быстрых SELECT по индексу до whois на грани TIMEOUT
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, value: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in self._values.items()]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, value: float = 1) -> None:
+        self.inc(*labels, value=-value)
+
+    def set(self, *labels, value: float) -> None:
+        self._values[labels] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, list] = {}    # метки -> [счётчики по корзинам..., sum, count]
+
+    def observe(self, *labels, value: float) -> None:
+        s = self._series.get(labels)
+        if s is None:
+            s = self._series[labels] = [0] * (len(self.buckets) + 2)
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            s[i] += 1
+        s[-2] += value; s[-1] += 1
+
+    def render(self) -> List[str]:
+        out = []
+        for k, s in self._series.items():
+            acc = 0
+            for le, n in zip(self.buckets, s):
+                acc += n
+                le = 'le="%s"' % _num(le)
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, k, le)} {acc}")
+            le = 'le="+Inf"'
+            out.append(f"{self.name}_bucket{_labels(self.labelnames, k, le)} {s[-1]}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, k)} {_num(round(s[-2], 6))}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, k)} {s[-1]}")
+        return out
+
+class _Func(_Metric):
+    # значение читается при выдаче: fn() -> число | None | {кортеж меток: число}
+    def __init__(self, kind: str, name: str, help: str, fn: Callable, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.kind, self.fn = kind, fn
+
+    def render(self) -> List[str]:
+        try:
+            v = self.fn()
+        except Exception:
+            return []
+        items = v.items() if isinstance(v, dict) else [((), v)]
+        return [f"{self.name}{_labels(self.labelnames, k)} {_num(x)}" for k, x in items if x is not None]
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _add(self, m: _Metric):
+        if m.name in self._metrics:
+            raise ValueError(f"metric {m.name} already registered")
+        self._metrics[m.name] = m
+        return m
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def gauge_func(self, name: str, help: str, fn: Callable, labelnames: Sequence[str] = ()) -> None:
+        self._add(_Func("gauge", name, help, fn, labelnames))
+
+    def counter_func(self, name: str, help: str, fn: Callable, labelnames: Sequence[str] = ()) -> None:
+        self._add(_Func("counter", name, help, fn, labelnames))
+
+    def render(self) -> bytes:
+        lines: List[str] = []
+        for m in self._metrics.values():
+            body = m.render()
+            if body:
+                lines += m.header() + body
+        return ("\n".join(lines) + "\n").encode()
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- HTTP (MetricsMiddleware) ---
+http_requests = REGISTRY.counter("http_requests_total", "HTTP requests by route template and status",
+                                 ("method", "route", "status"))
+http_latency = REGISTRY.histogram("http_request_duration_seconds", "Time to the last body byte (SSE: stream lifetime)",
+                                  ("method", "route"))
+http_inflight = REGISTRY.gauge("http_requests_in_flight", "Requests currently being served", ("method", "route"))
+
+# --- whois (app/whois_pool.py) ---
+whois_requests = REGISTRY.counter("whois_requests_total", "whois queries by host and outcome (ok, timeout, error, cancelled, rejected)",
+                                  ("host", "result"))
+whois_connect = REGISTRY.histogram("whois_connect_seconds", "TCP connect to whois host", ("host",))
+whois_read = REGISTRY.histogram("whois_read_seconds", "Query write + response read (until close, or one framed IRRd reply)", ("host",))
+whois_bytes = REGISTRY.counter("whois_response_bytes_total", "Bytes received from whois host", ("host",))
+
+# --- SQLite (instrument_engine) ---
+db_statements = REGISTRY.histogram("db_statement_seconds", "SQL statement execution incl. waiting for SQLite locks",
+                                   ("engine", "verb"))
+db_transactions = REGISTRY.histogram("db_transaction_seconds", "ORM session transaction from BEGIN to commit/rollback/close",
+                                     ("engine", "outcome"))
+db_commits = REGISTRY.histogram("db_commit_seconds", "ORM session commit (flush + COMMIT)", ("engine",))
+
+class MetricsMiddleware:
+    """
+    Чистый ASGI-middleware: латентность до последнего байта тела и число запросов в работе.
+    Метка route — шаблон пути (/api/items/{item_id}), а не сам путь, чтобы не плодить серии.
+    """
+
+    def __init__(self, app, routes: list):
+        self.app, self.routes = app, routes
+
+    def _route(self, scope) -> str:
+        partial = None
+        for r in self.routes:
+            match, _ = r.matches(scope)
+            if match == Match.FULL:
+                return r.path
+            if match == Match.PARTIAL and partial is None:
+                partial = r.path
+        return partial or "<unmatched>"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method, route = scope["method"], self._route(scope)
+        status = 500
+        async def send_wrapper(msg):
+            nonlocal status
+            if msg["type"] == "http.response.start":
+                status = msg["status"]
+            await send(msg)
+        http_inflight.inc(method, route)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_inflight.dec(method, route)
+            http_latency.observe(method, route, value=time.perf_counter() - t0)
+            http_requests.inc(method, route, str(status))
+
+_engine_names: Dict[object, str] = {}
+
+def instrument_engine(async_engine, name: str) -> None:
+    # время каждого SQL-оператора (в SQLite сюда входит и ожидание busy_timeout),
+    # плюс занятые соединения пула — для писателя с pool_size=1 это «очередь за записью»
+    sync = async_engine.sync_engine
+    _engine_names[sync] = name
+
+    def before(conn, cursor, statement, params, context, executemany):
+        conn.info.setdefault("_metrics_t0", []).append(time.perf_counter())
+
+    def after(conn, cursor, statement, params, context, executemany):
+        stack = conn.info.get("_metrics_t0")
+        if stack:
+            verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "?"
+            db_statements.observe(name, verb, value=time.perf_counter() - stack.pop())
+
+    def error(ctx):
+        stack = ctx.connection.info.get("_metrics_t0") if ctx.connection is not None else None
+        if stack:
+            stack.pop()
+
+    event.listen(sync, "before_cursor_execute", before)
+    event.listen(sync, "after_cursor_execute", after)
+    event.listen(sync, "handle_error", error)
+
+REGISTRY.gauge_func("db_pool_checked_out", "Connections checked out of the engine pool (writer: pool_size=1)",
+                    lambda: {(n,): e.pool.checkedout() for e, n in _engine_names.items()}, ("engine",))
+
+@event.listens_for(Session, "after_begin")
+def _after_begin(session, transaction, connection):
+    if "_metrics_begin" not in session.info:
+        session.info["_metrics_begin"] = time.perf_counter()
+        session.info["_metrics_engine"] = _engine_names.get(connection.engine, "other")
+
+@event.listens_for(Session, "before_commit")
+def _before_commit(session):
+    session.info["_metrics_commit"] = time.perf_counter()
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    t0 = session.info.pop("_metrics_commit", None)
+    if t0 is not None:
+        db_commits.observe(session.info.get("_metrics_engine", "other"), value=time.perf_counter() - t0)
+    session.info["_metrics_outcome"] = "commit"
+
+@event.listens_for(Session, "after_transaction_end")
+def _after_transaction_end(session, transaction):
+    # корневая транзакция сессии закончилась: коммит, откат или закрытие сессии (GET-эндпоинты)
+    if transaction.parent is not None:
+        return
+    t0 = session.info.pop("_metrics_begin", None)
+    outcome = session.info.pop("_metrics_outcome", "rollback")
+    session.info.pop("_metrics_commit", None)
+    if t0 is not None:
+        db_transactions.observe(session.info.get("_metrics_engine", "other"), outcome,
+                                value=time.perf_counter() - t0)
+
+def register_cache(name: str, stats: Callable[[], Dict], results: Iterable[str]) -> None:
+    # счётчики попаданий берутся из stats() самого кэша; hit_ratio — как он его считает
+    results = tuple(results)
+    def counts():
+        st = stats()
+        return {(r,): st.get(r) for r in results}
+    REGISTRY.counter_func(f"{name}_lookups_total", f"{name} lookups by result", counts, ("result",))
+    REGISTRY.gauge_func(f"{name}_hit_ratio", f"{name} hit ratio since start", lambda: stats().get("hit_ratio"))
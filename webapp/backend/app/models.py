@@ -44,4 +44,64 @@ class TokenHit(Base):
     user_agent: Mapped[str | None] = mapped_column(String(255), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
-Index("ix_token_hits_created", TokenHit.created_at.desc())
+# keyset-пагинация /api/ping/last: ORDER BY created_at DESC, id DESC целиком по индексу (app/paging.py)
+Index("ix_token_hits_created_id", TokenHit.created_at.desc(), TokenHit.id.desc())
+
+# --- материализованные агрегаты по token_hits (app/stats.py) ---
+class AsnStat(Base):
+    __tablename__ = "asn_stats"
+    asn: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)  # 0 — ASN не определён
+    as_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+
+Index("ix_asn_stats_count", AsnStat.count.desc())
+
+class HitCounter(Base):
+    __tablename__ = "hit_counters"
+    name: Mapped[str] = mapped_column(String(40), primary_key=True)   # имя таблицы, напр. "token_hits"
+    total: Mapped[int] = mapped_column(Integer, default=0)
+    unique_ips: Mapped[int] = mapped_column(Integer, default=0)
+
+# --- корреляция HTTP ↔ DNS по токену (app/correlation.py) ---
+class TokenPair(Base):
+    __tablename__ = "token_pairs"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    token: Mapped[str] = mapped_column(String(80))
+    client_ip: Mapped[str] = mapped_column(String(45))
+    client_asn: Mapped[int] = mapped_column(Integer, default=0)      # 0 — ASN не определён
+    resolver_ip: Mapped[str] = mapped_column(String(45))
+    resolver_asn: Mapped[int] = mapped_column(Integer, default=0)
+    http_at: Mapped[datetime] = mapped_column(DateTime)
+    dns_at: Mapped[datetime] = mapped_column(DateTime)
+
+Index("uq_token_pairs", TokenPair.token, TokenPair.client_ip, TokenPair.resolver_ip, unique=True)
+
+class AsnPairStat(Base):
+    __tablename__ = "asn_pair_stats"
+    client_asn: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    resolver_asn: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    client_as_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    resolver_as_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+
+Index("ix_asn_pair_stats_client", AsnPairStat.client_asn, AsnPairStat.count.desc())
+Index("ix_asn_pair_stats_resolver", AsnPairStat.resolver_asn, AsnPairStat.count.desc())
+Index("ix_asn_pair_stats_count", AsnPairStat.count.desc())
+
+# --- водяные знаки фоновых задач: до какого id строки уже обработаны ---
+class Watermark(Base):
+    __tablename__ = "watermarks"
+    name: Mapped[str] = mapped_column(String(40), primary_key=True)
+    last_id: Mapped[int] = mapped_column(Integer, default=0)
+
+# --- почасовые и суточные свёртки token_hits / http_hits / dns_hits (app/rollup.py) ---
+class HitRollup(Base):
+    __tablename__ = "hit_rollups"
+    period: Mapped[str] = mapped_column(String(4), primary_key=True)       # "hour" | "day"
+    kind: Mapped[str] = mapped_column(String(8), primary_key=True)         # "ping" | "http" | "dns"
+    bucket: Mapped[datetime] = mapped_column(DateTime, primary_key=True)   # начало часа/суток, UTC
+    asn: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)  # 0 — ASN не определён
+    as_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+
+Index("ix_hit_rollups_asn", HitRollup.period, HitRollup.asn, HitRollup.bucket)
@@ -0,0 +1,74 @@
+# app/paging.py — keyset-пагинация и потоковый экспорт таблиц
+#
+# Страницы идут по (created_at, id) по убыванию: следующая страница — строки «старше» курсора,
+# WHERE (created_at, id) < (:c, :id) ORDER BY created_at DESC, id DESC LIMIT n. Это проход
+# по индексу ix_<table>_created_id (created_at DESC, id DESC) без сортировки и без OFFSET —
+# страница стоит одинаково на любой глубине. Индекс только по created_at не годится: неявный
+# rowid в нём SQLite для ORDER BY не использует и досортировывает во временном B-дереве. Курсор — непрозрачная строка base64url.
+#
+# Экспорт читает Core-select'ами пачками по id, каждая пачка — в своей короткой сессии
+# (не держим снимок WAL на всё время выгрузки); в памяти — одна пачка независимо от размера таблицы.
+import base64, csv, io, json
+from datetime import datetime
+from typing import AsyncIterator, Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Table, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+EXPORT_BATCH = 1000
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    # ValueError — курсор битый (вызывающий отвечает 400)
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception as e:
+        raise ValueError("bad cursor") from e
+
+async def keyset_page(db: AsyncSession, table: Table, cols: Sequence, limit: int,
+                      cursor: Optional[str] = None) -> Tuple[List, Optional[str]]:
+    """-> (строки, курсор следующей страницы или None); cols должны включать id и created_at"""
+    q = select(*cols).order_by(table.c.created_at.desc(), table.c.id.desc()).limit(limit + 1)
+    if cursor:
+        ts, row_id = decode_cursor(cursor)
+        q = q.where(tuple_(table.c.created_at, table.c.id) < tuple_(ts, row_id))
+    rows = (await db.execute(q)).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    nxt = encode_cursor(rows[-1].created_at, rows[-1].id) if more else None
+    return rows, nxt
+
+def _cell(v):
+    return v.isoformat() if isinstance(v, datetime) else v
+
+async def export_rows(session_factory: Callable[[], AsyncSession], table: Table, fmt: str,
+                      batch: int = EXPORT_BATCH) -> AsyncIterator[bytes]:
+    cols = list(table.c)
+    names = [c.name for c in cols]
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    if fmt == "csv":
+        w.writerow(names)
+    last = 0
+    while True:
+        async with session_factory() as db:
+            rows = (await db.execute(select(*cols).where(table.c.id > last)
+                                     .order_by(table.c.id).limit(batch))).all()
+        if not rows:
+            break
+        last = rows[-1].id
+        if fmt == "csv":
+            w.writerows([_cell(v) for v in r] for r in rows)
+        else:
+            buf.writelines(json.dumps(dict(zip(names, map(_cell, r))), ensure_ascii=False) + "\n" for r in rows)
+        yield buf.getvalue().encode()
+        buf.seek(0); buf.truncate()
+        if len(rows) < batch:
+            break
+    if buf.tell():
+        yield buf.getvalue().encode()
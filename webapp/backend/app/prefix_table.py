@@ -0,0 +1,156 @@
+# app/prefix_table.py — локальный IP→(prefix, ASN, AS name) по снапшоту pfx2as
+#
+# Формат файла (CAIDA RouteViews pfx2as, можно .gz):
+#   1.0.0.0<TAB>24<TAB>13335
+# а также "1.0.0.0/24 13335 [AS name]". MOAS вида "123_456" / "123,456" — берём первый ASN.
+#
+# Вложенные префиксы при сборке "сплющиваются" в непересекающиеся отрезки
+# [start, end] → самый специфичный префикс, поэтому поиск — один bisect без обхода дерева.
+import asyncio, gzip, ipaddress, os, socket, sys, time
+from array import array
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+
+Record = Tuple[str, Optional[int], Optional[str]]   # (prefix, asn, as_name)
+
+def _open(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+def _parse_line(line: str):
+    # → (version, start, end, prefix, asn, as_name); ipaddress тут слишком медленный для ~1M строк
+    parts = line.split()
+    if len(parts) < 2 or line.startswith("#"):
+        return None
+    if "/" in parts[0]:
+        (addr, plen), rest = parts[0].split("/", 1), parts[1:]
+    else:
+        if len(parts) < 3: return None
+        addr, plen, rest = parts[0], parts[1], parts[2:]
+    plen = int(plen)
+    if ":" in addr:
+        ver, bits, x = 6, 128, int.from_bytes(socket.inet_pton(socket.AF_INET6, addr), "big")
+    else:
+        ver, bits, x = 4, 32, int.from_bytes(socket.inet_aton(addr), "big")
+    if not 0 <= plen <= bits:
+        return None
+    host = (1 << (bits - plen)) - 1
+    start = x & ~host
+    prefix = f"{addr}/{plen}" if start == x else str(ipaddress.ip_network(f"{addr}/{plen}", strict=False))
+    asn_s = rest[0].replace(",", "_").split("_")[0]
+    asn = int(asn_s) if asn_s.isdigit() else None
+    return ver, start, start | host, prefix, asn, " ".join(rest[1:]) or None
+
+def _flatten(items: List[Tuple[int, int, int]]):
+    # items: (start, end, record_idx) → непересекающиеся отрезки с самым специфичным record_idx
+    starts, ends, idx = [], [], []
+    def emit(a, b, r):
+        if starts and idx[-1] == r and ends[-1] + 1 == a:
+            ends[-1] = b
+        else:
+            starts.append(a); ends.append(b); idx.append(r)
+    stack: List[Tuple[int, int]] = []   # (end, record_idx)
+    pos = 0
+    for s, e, r in sorted(items, key=lambda t: (t[0], -t[1])):
+        while stack and stack[-1][0] < s:
+            end, rr = stack.pop()
+            if pos <= end:
+                emit(pos, end, rr); pos = end + 1
+        if stack and pos < s:
+            emit(pos, s - 1, stack[-1][1])
+        stack.append((e, r)); pos = s
+    while stack:
+        end, rr = stack.pop()
+        if pos <= end:
+            emit(pos, end, rr); pos = end + 1
+    return starts, ends, idx
+
+class PrefixTable:
+    """
+    Неизменяемый снапшот. starts — обычный list (bisect по list идёт в C без упаковки int),
+    ends/idx — компактные array; для IPv6 ends остаётся list (128 бит в array не лезут).
+    """
+
+    def __init__(self, records: List[Record], v4, v6):
+        self.records = records
+        self.v4 = (v4[0], array("I", v4[1]), array("I", v4[2]))
+        self.v6 = (v6[0], v6[1], array("I", v6[2]))
+        self.segments = len(v4[0]) + len(v6[0])
+
+    @classmethod
+    def from_file(cls, path: str) -> "PrefixTable":
+        records: List[Record] = []
+        v4: List[Tuple[int, int, int]] = []
+        v6: List[Tuple[int, int, int]] = []
+        with _open(path) as f:
+            for line in f:
+                try:
+                    p = _parse_line(line)
+                except (ValueError, OSError):
+                    continue
+                if p is None:
+                    continue
+                ver, start, end, prefix, asn, name = p
+                (v4 if ver == 4 else v6).append((start, end, len(records)))
+                records.append((prefix, asn, name))
+        return cls(records, _flatten(v4), _flatten(v6))
+
+    def lookup(self, ip: str) -> Optional[Record]:
+        if ":" in ip:
+            x = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big"); starts, ends, idx = self.v6
+        else:
+            x = int.from_bytes(socket.inet_aton(ip), "big"); starts, ends, idx = self.v4
+        i = bisect_right(starts, x) - 1
+        if i >= 0 and x <= ends[i]:
+            return self.records[idx[i]]
+        return None
+
+    def memory_bytes(self) -> int:
+        n = sys.getsizeof(self.records)
+        for rec in self.records:
+            n += sys.getsizeof(rec) + sys.getsizeof(rec[0]) + (sys.getsizeof(rec[2]) if rec[2] else 0)
+        for a in self.v4 + self.v6: n += sys.getsizeof(a)
+        for lst in (self.v4[0], self.v6[0], self.v6[1]):
+            n += sum(sys.getsizeof(x) for x in lst)
+        return n
+
+class LocalAsnResolver:
+    """Держит текущий снапшот; reload() строит новый в потоке и подменяет ссылку одним присваиванием."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.table: Optional[PrefixTable] = None
+        self.info: Dict = {"loaded": False}
+        self.hits = self.misses = 0
+        self._lock = asyncio.Lock()
+
+    def lookup(self, ip: str) -> Optional[Record]:
+        t = self.table
+        if t is None:
+            return None
+        rec = t.lookup(ip)
+        if rec is None: self.misses += 1
+        else: self.hits += 1
+        return rec
+
+    async def reload(self, path: Optional[str] = None) -> Dict:
+        path = path or self.path
+        async with self._lock:
+            if not os.path.exists(path):
+                return dict(self.info, error=f"{path} not found")
+            def _build():
+                t0 = time.perf_counter()
+                t = PrefixTable.from_file(path)
+                return t, time.perf_counter() - t0, t.memory_bytes()
+            table, build_s, mem = await asyncio.to_thread(_build)
+            self.table, self.path = table, path
+            self.info = {
+                "loaded": True, "path": path, "file_mtime": os.path.getmtime(path),
+                "loaded_at": time.time(), "build_seconds": round(build_s, 3),
+                "prefixes": len(table.records), "segments": table.segments, "memory_bytes": mem,
+            }
+            return self.info
+
+    def stats(self) -> Dict:
+        return dict(self.info, hits=self.hits, misses=self.misses)
@@ -0,0 +1,86 @@
+# app/profiler.py — семплирующий профилировщик, включаемый на лету (/api/profile/*)
+#
+# Отдельный поток раз в interval секунд снимает стеки через sys._current_frames() — код
+# приложения не трогается, накладные расходы только пока профилировщик включён. Стеки
+# копятся в «свёрнутом» виде (func;func;func count) — формат flamegraph.pl и speedscope.
+# По умолчанию снимается только поток event loop'а; all_threads добавляет пулы (aiosqlite,
+# to_thread), где видно время самого SQLite.
+import os, sys, threading, time
+from collections import Counter
+from typing import Dict, Optional
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    def __init__(self, max_seconds: float):
+        self.max_seconds = max_seconds
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stacks: Counter = Counter()
+        self._names: Dict[object, str] = {}      # code-объект -> подпись, чтобы не форматировать каждый семпл
+        self.interval = 0.0
+        self.all_threads = False
+        self.started = self.stopped = None
+        self.samples = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float, duration: Optional[float] = None, all_threads: bool = False) -> Dict:
+        # вызывается из потока event loop'а — его и профилируем
+        if self.running:
+            raise RuntimeError("profiler already running")
+        self.interval, self.all_threads = interval, all_threads
+        self._stacks, self.samples = Counter(), 0
+        self.started, self.stopped = time.time(), None
+        self._stop.clear()
+        target = None if all_threads else threading.get_ident()
+        limit = min(duration or self.max_seconds, self.max_seconds)
+        self._thread = threading.Thread(target=self._run, args=(target, limit), name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self.stats()
+
+    def stop(self) -> str:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.folded()
+
+    def _run(self, target: Optional[int], limit: float) -> None:
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        deadline = time.monotonic() + limit
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            for tid, frame in sys._current_frames().items():
+                if tid == me or (target is not None and tid != target):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    name = self._names.get(code)
+                    if name is None:
+                        name = self._names[code] = _frame_name(code)
+                    stack.append(name)
+                    frame = frame.f_back
+                if target is None:
+                    if tid not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    stack.append(names.get(tid, str(tid)))
+                self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+        self.stopped = time.time()
+
+    def folded(self) -> str:
+        # копия на уровне C атомарна под GIL — можно читать, не останавливая семплирование
+        stacks = dict.copy(self._stacks)
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(stacks.items(), key=lambda kv: -kv[1]))
+
+    def stats(self) -> Dict:
+        return {
+            "running": self.running, "interval": self.interval, "all_threads": self.all_threads,
+            "started": self.started, "stopped": self.stopped, "samples": self.samples,
+            "stacks": len(self._stacks), "max_seconds": self.max_seconds,
+        }
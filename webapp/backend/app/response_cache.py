@@ -0,0 +1,105 @@
+# app/response_cache.py — кэш готовых JSON-ответов для часто опрашиваемых GET (stats, last)
+#
+# Ключ — эндпоинт + параметры. Любая запись в token_hits вызывает bump(): версия растёт,
+# и записи старой версии больше не отдаются — кроме окна max_stale секунд, в котором
+# под плотной записью можно отдавать чуть устаревший ответ вместо пересчёта на каждый опрос.
+# Отдаём байты с ETag; клиент с If-None-Match получает 304 без тела.
+#
+# Поля, которые меняются без bump() (например, длина очереди обогащения), в кэш не кладём:
+# live() отдаёт их при каждом ответе, они дописываются в закэшированный JSON-объект и входят в ETag.
+import asyncio, hashlib, json, time
+from typing import Awaitable, Callable, Dict, Hashable, NamedTuple, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+class Entry(NamedTuple):
+    version: int
+    created: float
+    body: bytes
+    etag: str
+    headers: Dict[str, str]
+
+class ResponseCache:
+    def __init__(self, max_stale: float = 0.0, max_entries: int = 256, shared=None):
+        self.max_stale, self.max_entries = max_stale, max_entries
+        self.version = 0
+        # workers.SharedVersion: записи из других процессов uvicorn тоже сбрасывают кэш
+        self.shared = shared
+        self._shared_seen = shared.value() if shared is not None else None
+        self._entries: Dict[Hashable, Entry] = {}
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self.hits = self.misses = self.not_modified = self.stale_hits = 0
+
+    def bump(self) -> None:
+        self.version += 1
+        if self.shared is not None:
+            self._shared_seen = self.shared.bump()
+
+    def _sync(self) -> None:
+        v = self.shared.value()
+        if v != self._shared_seen:
+            self._shared_seen = v
+            self.version += 1
+
+    def _fresh(self, key: Hashable) -> Optional[Entry]:
+        e = self._entries.get(key)
+        if e is None:
+            return None
+        if e.version == self.version:
+            return e
+        if time.monotonic() - e.created <= self.max_stale:
+            self.stale_hits += 1
+            return e
+        return None
+
+    async def respond(self, request: Request, key: Hashable, build: Callable[[], Awaitable],
+                      live: Optional[Callable[[], Dict]] = None) -> Response:
+        # build() -> bytes или (bytes, доп. заголовки), например X-Next-Cursor; live() — см. шапку
+        if self.shared is not None:
+            self._sync()
+        e = self._fresh(key)
+        if e is not None:
+            self.hits += 1
+        else:
+            # одновременные промахи по одному ключу строят ответ один раз
+            lock = self._locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                e = self._fresh(key)
+                if e is None:
+                    self.misses += 1
+                    version = self.version
+                    body, extra = await build(), {}
+                    if isinstance(body, tuple):
+                        body, extra = body
+                    # ETag — по содержимому: после bump() неизменившийся ответ всё ещё даёт 304
+                    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+                    e = Entry(version, time.monotonic(), body, etag, extra)
+                    self._entries.pop(key, None)
+                    self._entries[key] = e
+                    while len(self._entries) > self.max_entries:
+                        old = next(iter(self._entries))
+                        del self._entries[old]; self._locks.pop(old, None)
+                else:
+                    self.hits += 1
+
+        body, etag = e.body, e.etag
+        if live is not None:
+            tail = json.dumps(live(), separators=(",", ":"))
+            body = body[:-1] + (b"," if len(body) > 2 else b"") + tail[1:].encode()
+            etag = f'{etag[:-1]}-{hashlib.blake2b(tail.encode(), digest_size=4).hexdigest()}"'
+        headers = {**e.headers, "ETag": etag, "Cache-Control": "no-cache"}
+        inm = request.headers.get("if-none-match")
+        if inm and etag in [t.strip() for t in inm.split(",")]:
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "version": self.version, "entries": len(self._entries), "max_stale": self.max_stale,
+            "hits": self.hits, "misses": self.misses, "stale_hits": self.stale_hits,
+            "not_modified": self.not_modified,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+        }
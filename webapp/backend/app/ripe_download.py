@@ -0,0 +1,140 @@
+# app/ripe_download.py — скачивание delegated-ripencc-latest для /api/ripe/ensure
+#
+#  * условный запрос: If-None-Match / If-Modified-Since по сохранённым ETag / Last-Modified,
+#    неизменившийся файл стоит одного ответа 304 без тела;
+#  * докачка: недокачанный .part продолжается через Range + If-Range
+#    (если файл на сервере сменился, сервер отдаст 200 и начнём заново);
+#  * single-flight: одновременные ensure() ждут одну и ту же передачу (между воркерами — flock);
+#  * прогресс (байты, скорость) — в self.progress, его отдают /api/ripe/progress[/stream].
+import asyncio, fcntl, json, os, time, urllib.error, urllib.request
+from email.utils import formatdate
+from typing import Dict, Optional
+
+CHUNK = 256 * 1024
+
+class RipeDownloader:
+    def __init__(self, url: str, path: str, timeout: float = 60.0):
+        self.url, self.path, self.timeout = url, path, timeout
+        self.part = path + ".part"
+        self.meta_path = path + ".meta.json"        # валидаторы готового файла
+        self.part_meta_path = self.part + ".json"   # валидаторы недокачанного
+        self._task: Optional[asyncio.Future] = None
+        self.progress: Dict = {"state": "idle"}
+
+    # --- служебное ---
+    @staticmethod
+    def _read_json(path: str) -> Dict:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write_json(path: str, data: Dict) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    def _file_info(self) -> Dict:
+        exists = os.path.exists(self.path)
+        return {"size": os.path.getsize(self.path) if exists else 0,
+                "mtime": os.path.getmtime(self.path) if exists else None}
+
+    # --- вход ---
+    async def ensure(self, force: bool = False, max_age_hours: float = 24) -> Dict:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        need = force or (not os.path.exists(self.path)) or \
+            (time.time() - os.path.getmtime(self.path) > max_age_hours * 3600)
+        if not need:
+            return dict(self._file_info(), downloaded=False, not_modified=False, resumed_from=0)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(asyncio.to_thread(self._fetch, force))
+        # shield: отмена одного клиента не рвёт общую передачу
+        res = await asyncio.shield(self._task)
+        return dict(self._file_info(), **res)
+
+    # --- в потоке ---
+    def _fetch(self, force: bool) -> Dict:
+        p = self.progress = {"state": "connecting", "bytes": 0, "total": None, "rate_bps": 0.0,
+                             "resumed_from": 0, "started_at": time.time(), "finished_at": None, "error": None}
+        # single-flight между воркерами uvicorn: второй процесс ждёт и получит 304 на свежий файл
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            return self._fetch_once(force, p, allow_resume=True)
+        except Exception as e:
+            p.update(state="error", error=f"{type(e).__name__}: {e}", finished_at=time.time())
+            raise
+        finally:
+            os.close(fd)            # снимает и flock
+
+    def _fetch_once(self, force: bool, p: Dict, allow_resume: bool) -> Dict:
+        headers = {}
+        meta = self._read_json(self.meta_path)
+        if not force and os.path.exists(self.path):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            headers["If-Modified-Since"] = meta.get("last_modified") or \
+                formatdate(os.path.getmtime(self.path), usegmt=True)
+
+        offset = 0
+        part_meta = self._read_json(self.part_meta_path)
+        validator = part_meta.get("etag") or part_meta.get("last_modified")
+        if allow_resume and os.path.exists(self.part) and validator:
+            offset = os.path.getsize(self.part)
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+                headers["If-Range"] = validator
+
+        req = urllib.request.Request(self.url, headers=headers)
+        try:
+            resp = urllib.request.urlopen(req, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                os.utime(self.path)     # файл актуален — сбрасываем возраст
+                p.update(state="done", finished_at=time.time())
+                return {"downloaded": False, "not_modified": True, "resumed_from": 0}
+            if e.code == 416 and offset:
+                # .part уже не соответствует серверу — качаем с нуля
+                self._drop_part()
+                return self._fetch_once(force, p, allow_resume=False)
+            raise
+
+        with resp:
+            resumed = resp.status == 206 and offset > 0
+            if not resumed:
+                offset = 0
+            length = resp.headers.get("Content-Length")
+            p.update(state="downloading", resumed_from=offset,
+                     total=(offset + int(length)) if length and length.isdigit() else None)
+            new_meta = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+            self._write_json(self.part_meta_path, new_meta)
+
+            t0, got = time.monotonic(), 0
+            with open(self.part, "ab" if resumed else "wb") as out:
+                while True:
+                    chunk = resp.read(CHUNK)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    got += len(chunk)
+                    dt = time.monotonic() - t0
+                    p.update(bytes=offset + got, rate_bps=round(got / dt, 1) if dt > 0 else 0.0)
+
+        if p["total"] is not None and p["bytes"] < p["total"]:
+            raise IOError(f"short read: {p['bytes']} of {p['total']} bytes (will resume)")
+        os.replace(self.part, self.path)
+        self._write_json(self.meta_path, new_meta)
+        try: os.remove(self.part_meta_path)
+        except OSError: pass
+        p.update(state="done", finished_at=time.time())
+        return {"downloaded": True, "not_modified": False, "resumed_from": offset}
+
+    def _drop_part(self) -> None:
+        for f in (self.part, self.part_meta_path):
+            try: os.remove(f)
+            except OSError: pass
+
+    @property
+    def active(self) -> bool:
+        return self._task is not None and not self._task.done()
@@ -0,0 +1,102 @@
+# app/ripe_stats.py — агрегаты по ASN из delegated-ripencc-latest, считаются на сервере
+#
+# Файл читается построчно (без загрузки целиком), берутся записи asn для страны cc
+# со статусом allocated/assigned и суммируются по дате, месяцу, году и LIR
+# (opaque-id — 8-я колонка, есть только в extended-формате). Результат (несколько КБ)
+# сохраняется рядом с файлом и пересчитывается только при смене mtime исходника.
+import asyncio, json, os
+from collections import Counter
+from typing import Dict, Optional
+
+TOP_LIRS = 20
+
+def parse_delegated(path: str, cc: str = "RU") -> Dict:
+    per_day: Counter = Counter()
+    per_lir: Counter = Counter()
+    records = 0
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for ln in f:
+            if not ln or ln[0] == "#":
+                continue
+            parts = ln.rstrip("\r\n").split("|")
+            if len(parts) < 7 or parts[2] != "asn" or parts[1] != cc:
+                continue
+            if parts[6].lower() not in ("allocated", "assigned"):
+                continue
+            date = parts[5]
+            if len(date) != 8 or not date.isdigit() or not parts[4].isdigit():
+                continue
+            count = int(parts[4])
+            per_day[date] += count
+            if len(parts) > 7 and parts[7]:
+                per_lir[parts[7]] += count
+            records += 1
+
+    per_year: Counter = Counter()
+    per_month: Counter = Counter()
+    for d, cnt in per_day.items():
+        per_year[d[:4]] += cnt
+        per_month[d[:6]] += cnt
+    years = sorted(per_year)
+    cum, cumulative = 0, []
+    for y in years:
+        cum += per_year[y]; cumulative.append(cum)
+    return {
+        "cc": cc, "records": records, "total": cum,
+        "years": years, "perYear": [per_year[y] for y in years], "cumulative": cumulative,
+        "perMonth": dict(sorted(per_month.items())),
+        "firstDate": min(per_day) if per_day else None, "lastDate": max(per_day) if per_day else None,
+        "lirs": len(per_lir), "topLirs": [{"id": k, "count": v} for k, v in per_lir.most_common(TOP_LIRS)],
+    }
+
+class RipeAsnStats:
+    def __init__(self, source: str, data_dir: str):
+        self.source, self.data_dir = source, data_dir
+        self._mem: Dict[str, Dict] = {}     # cc -> последний результат
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def _cache_path(self, cc: str) -> str:
+        return os.path.join(self.data_dir, f"ripe-asn-stats-{cc}.json")
+
+    def _load(self, cc: str, mtime: float) -> Optional[Dict]:
+        r = self._mem.get(cc)
+        if r and r["sourceMtime"] == mtime:
+            return r
+        try:
+            with open(self._cache_path(cc), "r", encoding="utf-8") as f:
+                r = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if r.get("sourceMtime") != mtime:
+            return None
+        self._mem[cc] = r
+        return r
+
+    def _build(self, cc: str, mtime: float) -> Dict:
+        r = parse_delegated(self.source, cc)
+        r["sourceMtime"], r["sourceSize"] = mtime, os.path.getsize(self.source)
+        path = self._cache_path(cc)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(r, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        return r
+
+    async def get(self, cc: str = "RU") -> Optional[Dict]:
+        # None — исходного файла нет
+        if not os.path.exists(self.source):
+            return None
+        mtime = os.path.getmtime(self.source)
+        r = self._load(cc, mtime)
+        if r is not None:
+            return r
+        async with self._lock:
+            r = self._load(cc, mtime)
+            if r is None:
+                r = await asyncio.to_thread(self._build, cc, mtime)
+                self._mem[cc] = r
+            return r
+
+    def schedule(self, cc: str = "RU") -> None:
+        # фоновый пересчёт после скачивания нового файла
+        self._task = asyncio.ensure_future(self.get(cc))
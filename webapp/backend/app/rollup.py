@@ -0,0 +1,340 @@
+# app/rollup.py — свёртки token_hits / http_hits / dns_hits по часам и суткам, срок хранения сырых строк
+#
+# Фоновая задача идёт по новым строкам каждой таблицы (водяной знак "rollup:<table>" в watermarks)
+# и одной транзакцией прибавляет счётчики в hit_rollups (период × вид × начало часа/суток × ASN)
+# и двигает водяной знак — каждая строка учитывается ровно один раз. ASN у token_hits свой,
+# для http_hits (IP клиента) и dns_hits (IP резолвера) — через ip_to_asn (кэш, pfx2as, whois),
+# не больше ROLLUP_LOOKUPS одновременно. Если whois не ответил, строка ждёт следующего прохода
+# (водяной знак на ней останавливается); после ROLLUP_ASN_GIVEUP она сворачивается с ASN 0.
+# Строки моложе ROLLUP_DELAY ждут: фоновое обогащение могло ещё не проставить asn. Строку token_hits
+# с asn NULL старше ROLLUP_DELAY ждём, только пока работает фоновое обогащение (его перескан
+# дозаполняет NULL); в режиме inline её никто не обновит — сворачиваем сразу с ASN 0.
+#
+# Срок хранения: строки http_hits / dns_hits старше RETENTION_DAYS[table] удаляются пачками по
+# RETENTION_BATCH (своя короткая транзакция на пачку — групповой писатель вклинивается между
+# ними), и только уже свёрнутые и уже пройденные коррелятором. token_hits не удаляется: его
+# уникальный индекс по ip — это и есть защита от дублей и счётчик уникальных IP. Последняя строка
+# таблицы не удаляется никогда: иначе id начнутся заново и водяные знаки пропустят новые строки.
+# Освободившиеся страницы возвращаются ФС через PRAGMA incremental_vacuum (новую БД init_db()
+# создаёт с auto_vacuum=INCREMENTAL; созданную раньше нужно один раз перестроить:
+# python -m app.rollup vacuum).
+#
+# /api/stats/history и /api/stats/top читают только hit_rollups.
+import asyncio, sys, time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, delete, func, literal_column, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import correlation
+from .asn_lookup import ip_to_asn
+from .db import SessionLocal, ReadSessionLocal
+from .models import DnsHit, HitRollup, HttpHit, TokenHit, Watermark
+
+TOKEN, DNS = TokenHit.__table__, DnsHit.__table__
+TABLES = (TOKEN, HttpHit.__table__, DNS)
+KINDS = {TOKEN.name: "ping", HttpHit.__tablename__: "http", DNS.name: "dns"}
+PERIODS = ("hour", "day")
+
+def _wm_name(table: str) -> str:
+    return f"rollup:{table}"
+
+def bucket(ts: datetime, period: str) -> datetime:
+    ts = ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0) if period == "day" else ts
+
+async def reset_kind(db: AsyncSession, table: str) -> None:
+    # таблицу очистили целиком (/api/ping/clear): её свёртки тоже, id начнутся заново; вызывающий коммитит
+    await db.execute(delete(HitRollup).where(HitRollup.kind == KINDS[table]))
+    stmt = sqlite_insert(Watermark).values(name=_wm_name(table), last_id=0)
+    await db.execute(stmt.on_conflict_do_update(index_elements=[Watermark.name], set_={"last_id": 0}))
+
+def _failed(res) -> bool:
+    # «ASN нет» — ответ; ошибка/таймаут источника или недождавшаяся гонка — нет
+    if not isinstance(res, dict):
+        return True
+    if res.get("best"):
+        return False
+    timings = res.get("timings") or {}
+    return bool(res.get("partial")) or any(k.endswith("_error") for k in timings)
+
+class RollupWorker:
+    def __init__(self, interval: float, batch: int, delay: float, retention: Dict[str, int], hourly_days: int,
+                 delete_batch: int, pause: float, vacuum_pages: int, guard_correlation: bool,
+                 lookups: int = 8, asn_giveup: float = 86400,
+                 enrich_running: Optional[Callable[[], bool]] = None):
+        if retention.get(TOKEN.name):
+            raise ValueError("RETENTION_DAYS['token_hits'] must be 0: its unique ip index is the dedup guarantee")
+        self.interval, self.batch, self.delay = interval, batch, timedelta(seconds=delay)
+        self.retention, self.hourly_days = retention, hourly_days
+        self.delete_batch, self.pause, self.vacuum_pages = delete_batch, pause, vacuum_pages
+        self.guard_correlation = guard_correlation     # не удалять строки, которые коррелятор ещё не прошёл
+        self.asn_giveup = timedelta(seconds=asn_giveup)
+        self.enrich_running = enrich_running           # есть ли кому дописать asn в token_hits
+        self._lookups = asyncio.Semaphore(lookups)     # whois — через общие лимиты пула, но без лавины
+        self.lookup_failures = 0
+        self._task: Optional[asyncio.Task] = None
+        self.steps = self.errors = 0
+        self.last_error: Optional[str] = None
+        self.step_ms = deque(maxlen=200)
+        self.watermarks: Dict[str, int] = {}
+        self.backlog: Dict[str, int] = {}
+        self.folded = dict.fromkeys(KINDS, 0)
+        self.deleted = dict.fromkeys((*(t for t in KINDS if t != TOKEN.name), HitRollup.__tablename__), 0)
+        self.vacuumed_pages = 0
+        self.auto_vacuum = self.freelist = None
+
+    # --- свёртка ---
+    async def _lookup(self, ip: str) -> Optional[Tuple[int, Optional[str]]]:
+        # -> (asn, as_name) или None, если whois не ответил
+        async with self._lookups:
+            try:
+                res = await ip_to_asn(ip)
+            except Exception:
+                res = None
+        if _failed(res):
+            return None
+        best = res.get("best") or {}
+        return best.get("asn") or 0, best.get("as_name")
+
+    async def _fold(self, table) -> bool:
+        """-> True, если упёрлись в batch и готовые строки, возможно, ещё есть"""
+        name = table.name
+        cutoff = datetime.utcnow() - self.delay
+        ip_col = table.c.resolver_ip if table is DNS else table.c.ip
+        cols = [table.c.id, table.c.created_at, ip_col.label("ip")]
+        if table is TOKEN:
+            cols += [table.c.asn, table.c.as_name]
+        async with ReadSessionLocal() as db:
+            stored = (await db.execute(select(Watermark.last_id).where(Watermark.name == _wm_name(name)))).scalar()
+            top = (await db.execute(select(func.max(table.c.id)))).scalar() or 0
+            wm = stored or 0
+            if top < wm:
+                wm = 0                                  # таблицу очистили мимо reset_kind
+            self.watermarks[name], self.backlog[name] = wm, top - wm
+            rows = (await db.execute(select(*cols).where(table.c.id > wm)
+                                     .order_by(table.c.id).limit(self.batch))).all()
+        # водяной знак сплошной: останавливаемся на первой слишком свежей строке
+        ready = []
+        for r in rows:
+            if r.created_at >= cutoff:
+                break
+            ready.append(r)
+        if not ready:
+            return False
+
+        # ASN — до транзакции: whois не держит соединение писателя. token_hits ждёт обогащения (asn NULL),
+        # http_hits / dns_hits — ответа whois; на первой такой строке водяной знак останавливается
+        if table is TOKEN:
+            wait = self.enrich_running is not None and self.enrich_running()
+            asn = {r.id: (r.asn, r.as_name) if r.asn is not None else (None if wait else (0, None)) for r in ready}
+        else:
+            ips = list(dict.fromkeys(r.ip for r in ready))
+            by_ip = dict(zip(ips, await asyncio.gather(*(self._lookup(ip) for ip in ips))))
+            asn = {r.id: by_ip[r.ip] for r in ready}
+        giveup = datetime.utcnow() - self.asn_giveup
+        for i, r in enumerate(ready):
+            if asn[r.id] is None:
+                if r.created_at >= giveup:
+                    self.lookup_failures += 1
+                    ready = ready[:i]               # повторим в следующий проход
+                    break
+                asn[r.id] = (0, None)               # так и не определился — «ASN неизвестен»
+        if not ready:
+            return False
+        deltas: Dict[Tuple, List] = {}
+        for r in ready:
+            a, n = asn[r.id]
+            for p in PERIODS:
+                d = deltas.setdefault((p, bucket(r.created_at, p), a), [0, None])
+                d[0] += 1
+                d[1] = n or d[1]
+        new_wm = ready[-1].id
+
+        async with SessionLocal() as db:
+            # водяной знак двигаем, только если его никто не сбросил с момента чтения (очистка таблицы)
+            stmt = sqlite_insert(Watermark).values(name=_wm_name(name), last_id=new_wm)
+            stmt = stmt.on_conflict_do_update(index_elements=[Watermark.name], set_={"last_id": new_wm},
+                                              where=Watermark.last_id == (stored or 0))
+            if (await db.execute(stmt)).rowcount != 1:
+                await db.rollback()
+                return True
+            stmt = sqlite_insert(HitRollup)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[HitRollup.period, HitRollup.kind, HitRollup.bucket, HitRollup.asn],
+                set_={"count": HitRollup.count + stmt.excluded.count,
+                      "as_name": func.coalesce(stmt.excluded.as_name, HitRollup.as_name)},
+            )
+            await db.execute(stmt, [{"period": p, "kind": KINDS[name], "bucket": b, "asn": a, "count": c, "as_name": n}
+                                    for (p, b, a), (c, n) in deltas.items()])
+            await db.commit()
+
+        self.watermarks[name] = new_wm
+        self.backlog[name] = max(0, top - new_wm)
+        self.folded[name] += len(ready)
+        return len(ready) == self.batch
+
+    # --- срок хранения (http_hits, dns_hits) ---
+    async def _delete_batches(self, table, where, key) -> int:
+        # DELETE … WHERE key IN (SELECT key … LIMIT n): в SQLite без SQLITE_ENABLE_UPDATE_DELETE_LIMIT иначе нельзя
+        sub = select(key).select_from(table).where(*where).limit(self.delete_batch)
+        total = 0
+        while True:
+            async with SessionLocal() as db:
+                n = (await db.execute(delete(table).where(key.in_(sub)))).rowcount
+                await db.commit()
+            total += n
+            if n < self.delete_batch:
+                return total
+            await asyncio.sleep(self.pause)
+
+    async def _retire(self, table, days: int) -> int:
+        names = [_wm_name(table.name)]
+        if self.guard_correlation and table.name in correlation.SOURCES:
+            names.append(correlation._wm_name(table.name))
+        async with ReadSessionLocal() as db:
+            wms = dict((await db.execute(select(Watermark.name, Watermark.last_id)
+                                         .where(Watermark.name.in_(names)))).all())
+            top = (await db.execute(select(func.max(table.c.id)))).scalar() or 0
+        hi = min([wms.get(n, 0) for n in names] + [top - 1])
+        if hi <= 0:
+            return 0
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        # без ORDER BY: планировщик идёт по индексу ix_<table>_created, а не по всей таблице
+        n = await self._delete_batches(table, (table.c.created_at < cutoff, table.c.id <= hi), table.c.id)
+        self.deleted[table.name] += n
+        return n
+
+    async def _vacuum(self) -> int:
+        # пустые страницы после удалений — обратно ФС, небольшими шагами (каждый — короткая запись)
+        freed, last = 0, None
+        while True:
+            async with SessionLocal() as db:
+                self.auto_vacuum = (await db.execute(text("PRAGMA auto_vacuum"))).scalar()
+                self.freelist = (await db.execute(text("PRAGMA freelist_count"))).scalar()
+                # 2 — INCREMENTAL; freelist не уменьшился (страницы держит читатель WAL) — до следующего прохода
+                if self.auto_vacuum != 2 or not self.freelist or (last is not None and self.freelist >= last):
+                    if freed:
+                        await db.execute(text("PRAGMA wal_checkpoint(PASSIVE)"))
+                    return freed
+                # pysqlite делает у прагмы один sqlite3_step (= одна страница); executescript гонит её до конца
+                raw = await (await db.connection()).get_raw_connection()
+                await raw.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)});")
+                left = (await db.execute(text("PRAGMA freelist_count"))).scalar()
+            step = max(0, self.freelist - left)
+            last = self.freelist
+            freed += step
+            self.vacuumed_pages += step
+            await asyncio.sleep(self.pause)
+
+    async def retain(self) -> Dict[str, int]:
+        out = {}
+        for table in TABLES:
+            days = self.retention.get(table.name, 0)
+            if days > 0:
+                out[table.name] = await self._retire(table, days)
+        if self.hourly_days > 0:
+            cutoff = bucket(datetime.utcnow() - timedelta(days=self.hourly_days), "hour")
+            t = HitRollup.__table__
+            n = await self._delete_batches(t, (t.c.period == "hour", t.c.bucket < cutoff), literal_column("rowid"))
+            self.deleted[t.name] += n
+            out[t.name] = n
+        out["vacuumed_pages"] = await self._vacuum()
+        return out
+
+    async def step(self) -> bool:
+        """Один проход; -> True, если хоть в одной таблице упёрлись в batch"""
+        t0 = time.perf_counter()
+        more = False
+        for table in TABLES:
+            more |= await self._fold(table)
+        if not more:
+            await self.retain()
+        self.steps += 1
+        self.step_ms.append((time.perf_counter() - t0) * 1000)
+        return more
+
+    # --- цикл ---
+    async def _run(self) -> None:
+        while True:
+            more = False
+            try:
+                more = await self.step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+            if not more:
+                await asyncio.sleep(self.interval)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> Dict:
+        ms = sorted(self.step_ms)
+        return {
+            "running": self.running, "batch": self.batch, "delay": self.delay.total_seconds(),
+            "retention_days": self.retention, "hourly_days": self.hourly_days,
+            "steps": self.steps, "errors": self.errors, "last_error": self.last_error,
+            "lookup_failures": self.lookup_failures,
+            "watermarks": self.watermarks, "backlog": self.backlog, "folded": self.folded, "deleted": self.deleted,
+            "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(self.auto_vacuum, self.auto_vacuum),
+            "freelist_pages": self.freelist, "vacuumed_pages": self.vacuumed_pages,
+            "step_ms_p50": round(ms[len(ms) // 2], 2) if ms else None,
+        }
+
+# --- чтение для /api/stats/history и /api/stats/top ---
+async def history(db: AsyncSession, period: str, kind: str, asn: Optional[int],
+                  since: datetime, until: datetime) -> List[Dict]:
+    r = HitRollup
+    q = (select(r.bucket, func.sum(r.count).label("count"))
+         .where(r.period == period, r.kind == kind, r.bucket >= bucket(since, period), r.bucket <= until))
+    if asn is not None:
+        q = q.where(r.asn == (asn or 0))
+    rows = await db.execute(q.group_by(r.bucket).order_by(r.bucket))
+    return [{"bucket": b.isoformat(), "count": int(c)} for b, c in rows.all()]
+
+async def top(db: AsyncSession, period: str, kind: str, since: datetime, until: datetime, limit: int) -> List[Dict]:
+    r = HitRollup
+    total = func.sum(r.count).label("count")
+    rows = await db.execute(
+        select(r.asn, func.max(r.as_name), total)
+        .where(r.period == period, r.kind == kind, r.bucket >= bucket(since, period), r.bucket <= until)
+        .group_by(r.asn).order_by(total.desc()).limit(limit)
+    )
+    return [{"asn": a or None, "as_name": n, "count": int(c)} for a, n, c in rows.all()]
+
+async def _vacuum_full() -> None:
+    # разовый перевод старой БД на auto_vacuum=INCREMENTAL: в WAL прагма вступает в силу только через VACUUM
+    from .db import engine, init_db
+    await init_db()
+    async with engine.connect() as conn:
+        before = (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar()
+        await conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        await conn.exec_driver_sql("VACUUM")
+        after = (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar()
+    print({"auto_vacuum_before": before, "auto_vacuum_after": after})
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != "vacuum":
+        print("Использование: python -m app.rollup vacuum   (остановите приложение: VACUUM перестраивает файл)")
+        sys.exit(2)
+    asyncio.run(_vacuum_full())
@@ -1,3 +1,99 @@
+import os
+
 BASE_DOMAIN = "ns-testing-rr.ru"
 RIPE_URL   = "https://ftp.ripe.net/pub/stats/ripencc/delegated-ripencc-latest"
-DATA_DIR   = "data"
\ No newline at end of file
+DATA_DIR   = os.environ.get("APP_DATA_DIR", "data")    # бенчмарк (bench/) подставляет временный каталог
+
+# --- несколько процессов uvicorn (app/workers.py) ---
+WORKERS          = int(os.environ.get("APP_WORKERS", "1"))   # выставляет run.sh (WORKERS=N); >1 — общее состояние через файлы
+SHARED_ASN_CACHE = DATA_DIR + "/asn_shared.db"                # общий для воркеров кэш IP→ASN (только при WORKERS > 1)
+SHARED_ASN_PURGE = 300.0   # сек: как часто лидер удаляет из него просроченные записи
+WORKERS_POLL     = 0.2     # сек: как часто воркер смотрит, не писали ли token_hits другие процессы (лента SSE)
+LEADER_RETRY     = 5.0     # сек: как часто не-лидер пробует забрать фоновые задачи (коррелятор, хвост query.log)
+
+# --- кэш IP→ASN (asn_lookup) ---
+ASN_CACHE_SIZE    = 10000   # записей (LRU)
+ASN_CACHE_TTL     = 6 * 3600
+ASN_CACHE_NEG_TTL = 60      # неудачные lookup'ы (нет ASN / ошибка) и неполные (race: источник не успел) живут недолго
+
+# --- пакетирование запросов к Team Cymru ---
+CYMRU_BATCH_WINDOW = 0.02   # сек: сколько ждём попутчиков перед отправкой bulk-запроса
+CYMRU_BATCH_MAX    = 100    # IP в одном bulk-запросе
+
+# --- локальный снапшот pfx2as (prefix_table), консультируется до whois ---
+LOCAL_ASN_SNAPSHOT = DATA_DIR + "/pfx2as.txt"   # можно .gz (CAIDA routeviews-rv2-*.pfx2as.gz)
+
+# --- режим опроса источников ASN ---
+ASN_RESOLVE_MODE  = "sequential"  # "sequential": Cymru, потом RADB; "race": оба сразу в общем бюджете
+ASN_RACE_BUDGET   = 3.0           # сек: общий бюджет режима race
+CYMRU_DEADLINE    = 2.5           # сек: собственный дедлайн каждого источника
+RADB_DEADLINE     = 3.0
+PING_ENRICH_BUDGET = 3.5          # сек: жёсткий потолок обогащения ASN в /api/ping
+
+# --- соединения с whois (app/whois_pool.py) ---
+WHOIS_CYMRU_CONNS      = 4       # одновременных bulk-сессий к Team Cymru
+WHOIS_RADB_CONNS       = 2       # соединений к RADB
+RADB_PERSISTENT        = True    # постоянные соединения ("!!" + "!r<prefix>,l"); False — соединение на запрос
+RADB_PIPELINE          = 8       # запросов в полёте на одном соединении RADB
+RADB_IDLE_TIMEOUT      = 60.0    # сек: простаивающее соединение не переиспользуем
+WHOIS_BREAKER_FAILURES = 5       # ошибок подряд → хост «разомкнут», запросы падают сразу
+WHOIS_BREAKER_COOLDOWN = 15.0    # сек до пробного запроса
+
+# --- обогащение ASN: "inline" (как раньше, в запросе) или "background" (очередь + воркеры, app/enrich.py) ---
+ENRICH_MODE          = "inline"
+ENRICH_WORKERS       = 4
+ENRICH_QUEUE_MAX     = 1000   # переполнение → /api/ping ждёт место до ENRICH_PUT_TIMEOUT
+ENRICH_BATCH         = 50     # IP за один проход воркера (один UPDATE-executemany)
+ENRICH_PUT_TIMEOUT   = 1.0
+ENRICH_DRAIN_TIMEOUT = 10.0   # сколько ждём дочистки очереди при остановке
+ENRICH_RESCAN_INTERVAL = 60.0 # сек: строки с asn IS NULL (потерянные очередью, whois не ответил) — снова в очередь; 0 — выкл.
+ENRICH_RESCAN_AGE      = 30.0 # сек: более свежие строки не трогаем — они ещё в очереди
+ENRICH_RESCAN_BATCH    = 500  # IP за один перескан
+
+# --- групповой коммит вставок (app/ingest.py) ---
+INGEST_FLUSH_INTERVAL = 0.005   # сек: сколько копим строки перед транзакцией
+INGEST_MAX_ROWS       = 500     # строк в одной транзакции
+
+# --- кэш ответов /api/ping/stats и /api/ping/last (app/response_cache.py) ---
+RESPONSE_CACHE_MAX_STALE = 0.0   # сек: сколько можно отдавать ответ, устаревший из-за новых записей
+
+# --- хвост query.log BIND → dns_hits (app/dns_follow.py) ---
+DNS_FOLLOW       = False                          # запускать вместе с приложением
+DNS_QUERY_LOG    = "/var/log/named/query.log"
+DNS_FOLLOW_STATE = DATA_DIR + "/dns_follow.json"  # чекпойнт: inode + offset последней закоммиченной строки
+DNS_FOLLOW_BATCH = 500                            # строк dns_hits на одну вставку
+DNS_FOLLOW_POLL  = 0.5                            # сек между проверками конца файла
+
+# --- корреляция HTTP ↔ DNS по токену (app/correlation.py) ---
+CORRELATION          = True
+CORRELATION_WINDOW   = 300     # сек: максимум между HTTP-хитом и DNS-запросом одного токена
+CORRELATION_INTERVAL = 2.0     # сек между проходами, когда новых строк нет
+CORRELATION_BATCH    = 500     # новых строк каждой таблицы за проход
+
+# --- свёртки по часам/суткам и срок хранения сырых строк (app/rollup.py) ---
+ROLLUP                = True
+ROLLUP_INTERVAL       = 30.0    # сек между проходами, когда новых строк нет
+ROLLUP_BATCH          = 2000    # строк каждой таблицы за проход
+ROLLUP_DELAY          = 300     # сек: более свежие строки не сворачиваем — фоновое обогащение ASN успевает дописать asn
+ROLLUP_LOOKUPS        = 8       # одновременных ip_to_asn для http_hits/dns_hits
+ROLLUP_ASN_GIVEUP     = 86400   # сек: строку, для которой whois всё ещё не отвечает, сворачиваем с ASN 0
+                                # (token_hits ждёт asn только при ENRICH_MODE = "background")
+# сырые строки старше удаляются; 0 — хранить всё. token_hits — только 0: уникальный индекс по ip
+# и есть защита от дублей (RollupWorker откажется стартовать с другим значением)
+RETENTION_DAYS        = {"token_hits": 0, "http_hits": 30, "dns_hits": 30}
+RETENTION_HOURLY_DAYS = 90      # почасовые свёртки старше удаляются (суточные хранятся всегда); 0 — хранить всё
+RETENTION_BATCH       = 500     # строк в одном DELETE: короткие транзакции, писатель между ними не ждёт
+RETENTION_PAUSE       = 0.05    # сек между пачками удаления и шагами incremental_vacuum
+VACUUM_PAGES          = 1000    # страниц за один PRAGMA incremental_vacuum
+
+# --- живая лента дашборда, SSE /api/ping/stream (app/broadcast.py) ---
+LIVE_RING_SIZE      = 1000   # последних событий для догонки по Last-Event-ID
+LIVE_CLIENT_QUEUE   = 256    # событий в очереди одного клиента; переполнение → отключение
+LIVE_STATS_INTERVAL = 1.0    # сек: не чаще одного события stats (один запрос к БД на всех)
+LIVE_KEEPALIVE      = 15.0   # сек: комментарий-пинг в тишине
+
+# --- метрики GET /metrics и семплирующий профилировщик /api/profile/* (app/metrics.py, app/profiler.py) ---
+METRICS_ENABLED      = True
+PROFILER_ENABLED     = True    # разрешить включать профилировщик на лету
+PROFILER_INTERVAL    = 0.005   # сек между семплами по умолчанию
+PROFILER_MAX_SECONDS = 120     # дольше не семплирует, даже если забыли остановить
@@ -0,0 +1,134 @@
+# app/stats.py — счётчики token_hits, которые обновляются в той же транзакции, что и сами строки
+#
+#   asn_stats(asn, as_name, count) — число строк по ASN (asn = 0 — ASN не определён)
+#   hit_counters("token_hits")     — всего строк и уникальных IP
+#
+# /api/ping/stats читает только их: O(top) вместо трёх проходов по token_hits.
+# Сверка/пересчёт с сырой таблицей:  python -m app.stats check | rebuild
+import asyncio, sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, delete, func, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import AsnStat, HitCounter, TokenHit
+
+COUNTER = "token_hits"
+NO_ASN = 0
+
+def _key(asn: Optional[int]) -> int:
+    return asn or NO_ASN
+
+async def _bump_asns(db: AsyncSession, deltas: Dict[int, Tuple[int, Optional[str]]]) -> None:
+    # deltas: asn -> (прирост, as_name)
+    if not deltas:
+        return
+    stmt = sqlite_insert(AsnStat)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[AsnStat.asn],
+        set_={"count": AsnStat.count + stmt.excluded.count,
+              "as_name": func.coalesce(stmt.excluded.as_name, AsnStat.as_name)},
+    )
+    await db.execute(stmt, [{"asn": a, "as_name": n, "count": c} for a, (c, n) in deltas.items()])
+
+async def _bump_counter(db: AsyncSession, total: int, unique_ips: int) -> None:
+    stmt = sqlite_insert(HitCounter).values(name=COUNTER, total=total, unique_ips=unique_ips)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[HitCounter.name],
+        set_={"total": HitCounter.total + stmt.excluded.total,
+              "unique_ips": HitCounter.unique_ips + stmt.excluded.unique_ips},
+    )
+    await db.execute(stmt)
+
+async def apply_inserts(db: AsyncSession, rows: Iterable[Dict]) -> None:
+    # rows — только реально вставленные строки token_hits; IP уникален, значит каждая — новый IP
+    deltas: Dict[int, Tuple[int, Optional[str]]] = {}
+    n = 0
+    for r in rows:
+        k = _key(r.get("asn"))
+        c, name = deltas.get(k, (0, None))
+        deltas[k] = (c + 1, r.get("as_name") or name)
+        n += 1
+    if n:
+        await _bump_asns(db, deltas)
+        await _bump_counter(db, n, n)
+
+async def apply_asn_moves(db: AsyncSession, moves: Iterable[Tuple[Optional[int], Optional[int], Optional[str]]]) -> None:
+    # строка сменила ASN (фоновое обогащение): (старый asn, новый asn, as_name)
+    deltas: Dict[int, Tuple[int, Optional[str]]] = {}
+    for old, new, name in moves:
+        c, n = deltas.get(_key(old), (0, None)); deltas[_key(old)] = (c - 1, n)
+        c, n = deltas.get(_key(new), (0, None)); deltas[_key(new)] = (c + 1, name or n)
+    await _bump_asns(db, {k: v for k, v in deltas.items() if v[0]})
+
+async def reset(db: AsyncSession) -> None:
+    await db.execute(delete(AsnStat))
+    await db.execute(delete(HitCounter).where(HitCounter.name == COUNTER))
+
+async def rebuild(db: AsyncSession) -> None:
+    # полный пересчёт из token_hits (вызывающий коммитит)
+    await reset(db)
+    await db.execute(text(
+        "INSERT INTO asn_stats (asn, as_name, count) "
+        "SELECT COALESCE(asn, 0), MAX(as_name), COUNT(*) FROM token_hits GROUP BY COALESCE(asn, 0)"
+    ))
+    await db.execute(text(
+        "INSERT INTO hit_counters (name, total, unique_ips) "
+        "SELECT :name, COUNT(id), COUNT(DISTINCT ip) FROM token_hits"
+    ), {"name": COUNTER})
+
+async def ensure(db: AsyncSession) -> bool:
+    # первый запуск на старой БД: счётчиков ещё нет — строим из сырых данных
+    exists = (await db.execute(select(HitCounter.name).where(HitCounter.name == COUNTER))).first()
+    if exists is None:
+        await rebuild(db)
+        await db.commit()
+        return True
+    return False
+
+async def read(db: AsyncSession, top: int) -> Tuple[int, int, List[Tuple[Optional[int], Optional[str], int]]]:
+    c = (await db.execute(select(HitCounter.total, HitCounter.unique_ips).where(HitCounter.name == COUNTER))).first()
+    total, uniq = (c.total, c.unique_ips) if c else (0, 0)
+    rows = await db.execute(
+        select(AsnStat.asn, AsnStat.as_name, AsnStat.count)
+        .where(AsnStat.count > 0)
+        .order_by(AsnStat.count.desc())
+        .limit(top)
+    )
+    return total, uniq, [(a or None, n, cnt) for a, n, cnt in rows.all()]
+
+async def check(db: AsyncSession) -> Dict:
+    # сравнение материализованных счётчиков с сырой таблицей (O(table), для обслуживания)
+    c = (await db.execute(select(HitCounter.total, HitCounter.unique_ips).where(HitCounter.name == COUNTER))).first()
+    raw_total = (await db.execute(select(func.count(TokenHit.id)))).scalar_one()
+    raw_uniq = (await db.execute(select(func.count(func.distinct(TokenHit.ip))))).scalar_one()
+    raw = dict((await db.execute(text(
+        "SELECT COALESCE(asn, 0), COUNT(*) FROM token_hits GROUP BY COALESCE(asn, 0)"
+    ))).all())
+    mat = {a: cnt for a, cnt in (await db.execute(select(AsnStat.asn, AsnStat.count))).all() if cnt}
+    mismatched = sorted(a for a in set(raw) | set(mat) if raw.get(a, 0) != mat.get(a, 0))
+    ok = c is not None and c.total == raw_total and c.unique_ips == raw_uniq and not mismatched
+    return {
+        "ok": ok,
+        "total": {"counter": c.total if c else None, "raw": raw_total},
+        "unique_ips": {"counter": c.unique_ips if c else None, "raw": raw_uniq},
+        "mismatched_asns": [a or None for a in mismatched],
+    }
+
+async def _main(cmd: str) -> int:
+    from .db import SessionLocal, init_db
+    await init_db()
+    async with SessionLocal() as db:
+        if cmd == "rebuild":
+            await rebuild(db)
+            await db.commit()
+        res = await check(db)
+    print(res)
+    return 0 if res["ok"] else 1
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in ("check", "rebuild"):
+        print("Использование: python -m app.stats check|rebuild")
+        sys.exit(2)
+    sys.exit(asyncio.run(_main(sys.argv[1])))
@@ -0,0 +1,12 @@
+# app/tokens.py — токен из имени в зоне BASE_DOMAIN: общий для HTTP (Host) и DNS (qname из query.log)
+from .settings import BASE_DOMAIN
+
+def extract_token_from_host(host: str) -> str | None:
+    host = host.split(":")[0].lower().rstrip(".")
+    if host.endswith("." + BASE_DOMAIN):
+        return host[:-(len(BASE_DOMAIN)+1)].split(".")[0] or None
+    return None
+
+def in_base_domain(name: str) -> bool:
+    name = name.lower().rstrip(".")
+    return name == BASE_DOMAIN or name.endswith("." + BASE_DOMAIN)
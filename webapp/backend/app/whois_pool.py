@@ -0,0 +1,323 @@
+# app/whois_pool.py — соединения с whois-хостами: лимит одновременных запросов, постоянные
+# соединения RADB с конвейером запросов и «предохранитель» для мёртвого апстрима
+#
+# Team Cymru в bulk-режиме сам закрывает соединение после end, поэтому для него остаётся
+# соединение на запрос, но не больше max_conns одновременно. RADB (IRRd) умеет постоянное
+# соединение: после "!!" запросы "!r<prefix>,l" идут один за другим по одному сокету, а ответы
+# приходят в том же порядке и размечены длиной (A<n>\n<данные>C\n | C | D | F <ошибка>) —
+# конец ответа не нужно ждать по закрытию. Несколько запросов можно отправить, не дожидаясь
+# ответов (pipeline), ответы раздаются ожидающим по очереди.
+#
+# После failures ошибок подряд хост «размыкается»: запросы сразу падают с WhoisUnavailable,
+# вместо того чтобы ждать TIMEOUT. Через cooldown секунд пропускается один пробный запрос:
+# успех — снова работаем, ошибка — ещё cooldown. Отправленный запрос доживает до своего
+# TIMEOUT, даже если вызывающий ушёл раньше (дедлайн источника короче TIMEOUT, проигравший
+# в race): иначе зависший хост, которого никто не ждёт дольше дедлайна, никогда не копил бы
+# ошибок. Предохранитель считает исход самого запроса, а не терпение вызывающего.
+import asyncio, ipaddress, time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from . import metrics
+
+class WhoisUnavailable(ConnectionError):
+    pass
+
+class CircuitBreaker:
+    def __init__(self, failures: int, cooldown: float):
+        self.failures, self.cooldown = failures, cooldown
+        self.state = "closed"           # closed → open → half_open → closed | open
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.opens = self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"    # ровно один пробный запрос
+            return True
+        self.rejected += 1
+        return False
+
+    def success(self) -> None:
+        self.state, self.consecutive = "closed", 0
+
+    def failure(self) -> None:
+        self.consecutive += 1
+        if self.state == "half_open" or (self.state == "closed" and self.consecutive >= self.failures):
+            self.state, self.opened_at = "open", time.monotonic()
+            self.opens += 1
+
+    def release(self) -> None:
+        # пробный запрос отменён, а не провалился: следующий вызов снова попробует
+        if self.state == "half_open":
+            self.state, self.opened_at = "open", time.monotonic() - self.cooldown
+
+def _outcome(e: BaseException) -> str:
+    if isinstance(e, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(e, asyncio.CancelledError):
+        return "cancelled"      # проигравший в режиме race или истёкший бюджет пинга
+    if isinstance(e, WhoisUnavailable):
+        return "rejected"
+    return "error"
+
+class WhoisHost:
+    """
+    Соединение на запрос (ответ — всё до закрытия сервером), не больше max_conns одновременно.
+    """
+
+    def __init__(self, host: str, port: int, max_conns: int, timeout: float,
+                 breaker_failures: int, breaker_cooldown: float):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.max_conns = max_conns
+        self.breaker = CircuitBreaker(breaker_failures, breaker_cooldown)
+        self._sem = asyncio.Semaphore(self.limit)
+        self.queries = self.errors = self.connects = 0
+        self.inflight = self.waiting = 0
+
+    @property
+    def limit(self) -> int:
+        return self.max_conns
+
+    async def query(self, q: str) -> str:
+        if not self.breaker.allow():
+            metrics.whois_requests.inc(self.host, "rejected")
+            raise WhoisUnavailable(f"{self.host}: circuit open")
+        self.waiting += 1
+        try:
+            await self._sem.acquire()
+        except asyncio.CancelledError:
+            self.breaker.release()          # запрос так и не ушёл
+            raise
+        finally:
+            self.waiting -= 1
+        self.inflight += 1
+        task = asyncio.ensure_future(self._query(q))
+        task.add_done_callback(self._finished)
+        # shield: отмена вызывающего не прерывает запрос — его исход всё равно достанется предохранителю
+        return await asyncio.shield(task)
+
+    def _finished(self, task: asyncio.Future) -> None:
+        self.inflight -= 1
+        self._sem.release()
+        if task.cancelled():                # остановка цикла
+            self.breaker.release()
+        elif task.exception() is not None:
+            self.errors += 1
+            self.breaker.failure()
+        else:
+            self.queries += 1
+            self.breaker.success()
+
+    async def _query(self, q: str) -> str:
+        # connect и чтение меряются отдельно (/metrics): долгий connect — сеть/апстрим, долгое чтение — сам whois
+        t0 = time.perf_counter()
+        try:
+            r, w = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        except BaseException as e:
+            metrics.whois_requests.inc(self.host, _outcome(e))
+            raise
+        self.connects += 1
+        t1 = time.perf_counter()
+        metrics.whois_connect.observe(self.host, value=t1 - t0)
+        try:
+            w.write(q.encode()); await w.drain()
+            data = await asyncio.wait_for(r.read(-1), self.timeout)
+            metrics.whois_requests.inc(self.host, "ok")
+            metrics.whois_bytes.inc(self.host, value=len(data))
+            return data.decode(errors="replace")
+        except BaseException as e:
+            metrics.whois_requests.inc(self.host, _outcome(e))
+            raise
+        finally:
+            metrics.whois_read.observe(self.host, value=time.perf_counter() - t1)
+            try: w.close(); await w.wait_closed()
+            except Exception: pass
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict:
+        return {
+            "host": f"{self.host}:{self.port}", "max_conns": self.max_conns, "limit": self.limit,
+            "inflight": self.inflight, "waiting": self.waiting,
+            "queries": self.queries, "errors": self.errors, "connects": self.connects,
+            "breaker": self.breaker.state, "consecutive_failures": self.breaker.consecutive,
+            "breaker_opens": self.breaker.opens, "rejected": self.breaker.rejected,
+        }
+
+class _IrrdConn:
+    # одно постоянное соединение в режиме "!!"; ответы разбирает фоновый читатель
+    def __init__(self, host: str, r: asyncio.StreamReader, w: asyncio.StreamWriter):
+        self.host, self.r, self.w = host, r, w
+        self.waiters: Deque[Tuple[asyncio.Future, float]] = deque()     # (future, когда отправлен)
+        self.alive = True
+        self.last_used = time.monotonic()
+        self.reader = asyncio.ensure_future(self._read_loop())
+
+    async def _read_frame(self) -> str:
+        line = await self.r.readline()
+        if not line:
+            raise ConnectionError("whois closed connection")
+        tag = line[:1]
+        if tag == b"A":
+            data = await self.r.readexactly(int(line[1:]))
+            end = await self.r.readline()
+            if not end.startswith(b"C"):
+                raise ConnectionError(f"bad IRRd frame end: {end[:40]!r}")
+            return data.decode(errors="replace")
+        if tag in (b"C", b"D"):         # успешно, но пусто / ключ не найден
+            return ""
+        if tag == b"F":
+            raise LookupError(line[1:].decode(errors="replace").strip() or "IRRd error")
+        raise ConnectionError(f"unexpected IRRd reply: {line[:40]!r}")
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                try:
+                    res, err = await self._read_frame(), None
+                except LookupError as e:
+                    res, err = None, e          # ошибка одного запроса, соединение живо
+                if not self.waiters:
+                    raise ConnectionError("unsolicited IRRd reply")
+                fut, _ = self.waiters.popleft()
+                if not fut.done():          # отменённый запрос остаётся в очереди до своего ответа
+                    fut.set_exception(err) if err else fut.set_result(res)
+        except asyncio.CancelledError:
+            self._fail(ConnectionError("connection closed"))
+            raise
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, e: BaseException) -> None:
+        self.alive = False
+        while self.waiters:
+            fut, _ = self.waiters.popleft()
+            if not fut.done():
+                fut.set_exception(e if isinstance(e, Exception) else ConnectionError(str(e)))
+        try: self.w.close()
+        except Exception: pass
+
+    async def query(self, q: str, timeout: float) -> str:
+        fut = asyncio.get_running_loop().create_future()
+        # вызывающего могли отменить, а ошибка соединения придёт позже — не оставлять её «never retrieved»
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.last_used = time.monotonic()
+        self.waiters.append((fut, self.last_used))
+        self.w.write(q.encode())
+        try:
+            await self.w.drain()
+            # shield: место в очереди держим до ответа — иначе следующий ответ достанется не тому
+            return await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except asyncio.TimeoutError:
+            # ответ застрял — за ним в очереди стоят остальные; соединение больше не годится
+            self.close()
+            raise
+        except asyncio.CancelledError:
+            fut.cancel()                    # ответ, когда придёт, читатель пропустит
+            raise
+        finally:
+            self.last_used = time.monotonic()
+
+    def stale(self, now: float, timeout: float) -> bool:
+        # старейший запрос в полёте ждёт дольше timeout — сервер завис, новые за ним не ставим
+        return bool(self.waiters) and now - self.waiters[0][1] > timeout
+
+    def close(self) -> None:
+        if self.alive:
+            self.reader.cancel()
+            self._fail(ConnectionError("connection closed"))
+
+class IrrdHost(WhoisHost):
+    """
+    RADB/IRRd: до max_conns постоянных соединений, на каждом до pipeline запросов в полёте.
+    Новое соединение открывается, только когда все живые заняты до предела.
+    """
+
+    def __init__(self, host: str, port: int, max_conns: int, timeout: float,
+                 breaker_failures: int, breaker_cooldown: float, pipeline: int, idle_timeout: float):
+        self.pipeline, self.idle_timeout = pipeline, idle_timeout
+        super().__init__(host, port, max_conns, timeout, breaker_failures, breaker_cooldown)
+        self._conns: List[_IrrdConn] = []
+        self._connecting: Optional[asyncio.Future] = None
+        self.reused = 0
+
+    @property
+    def limit(self) -> int:
+        # семафор ограничивает запросы в полёте: столько влезает во все конвейеры
+        return self.max_conns * self.pipeline
+
+    async def lookup(self, ip: str) -> str:
+        ip = ipaddress.ip_address(ip)
+        return await self.query(f"!r{ip}/{ip.max_prefixlen},l\n")
+
+    async def _query(self, q: str) -> str:
+        conn, fresh = await self._conn()
+        if not fresh:
+            self.reused += 1
+        t0 = time.perf_counter()
+        try:
+            data = await conn.query(q, self.timeout)
+            metrics.whois_requests.inc(self.host, "ok")
+            metrics.whois_bytes.inc(self.host, value=len(data))
+            return data
+        except LookupError:
+            metrics.whois_requests.inc(self.host, "error")
+            return ""                       # F-ответ на конкретный запрос: считаем «нет данных»
+        except BaseException as e:
+            metrics.whois_requests.inc(self.host, _outcome(e))
+            raise
+        finally:
+            metrics.whois_read.observe(self.host, value=time.perf_counter() - t0)
+
+    async def _conn(self):
+        # -> (соединение, только что открыто?)
+        fresh = False
+        while True:
+            now = time.monotonic()
+            live = []
+            for c in self._conns:
+                if c.alive and not c.waiters and now - c.last_used > self.idle_timeout:
+                    c.close()               # простаивало дольше, чем держит сервер
+                elif c.alive and c.stale(now, self.timeout):
+                    c.close()
+                if c.alive:
+                    live.append(c)
+            self._conns = live
+            best = min(live, key=lambda c: len(c.waiters), default=None)
+            if best is not None and (len(best.waiters) < self.pipeline or len(live) >= self.max_conns):
+                return best, fresh
+            if self._connecting is None:
+                self._connecting = asyncio.ensure_future(self._open())
+                self._connecting.add_done_callback(self._opened)
+            await asyncio.shield(self._connecting)
+            fresh = True
+
+    def _opened(self, fut: asyncio.Future) -> None:
+        self._connecting = None
+        if not fut.cancelled() and fut.exception() is None:
+            self._conns.append(fut.result())
+
+    async def _open(self) -> _IrrdConn:
+        t0 = time.perf_counter()
+        r, w = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        w.write(b"!!\n")                    # постоянное соединение; сервер ничего не отвечает
+        await w.drain()
+        self.connects += 1
+        metrics.whois_connect.observe(self.host, value=time.perf_counter() - t0)
+        return _IrrdConn(self.host, r, w)
+
+    async def close(self) -> None:
+        for c in self._conns:
+            c.close()
+        readers = [c.reader for c in self._conns]
+        self._conns = []
+        if readers:
+            await asyncio.gather(*readers, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        return dict(super().stats(), pipeline=self.pipeline, conns=len([c for c in self._conns if c.alive]),
+                    reused=self.reused, queued=sum(len(c.waiters) for c in self._conns))
@@ -0,0 +1,107 @@
+# app/workers.py — несколько процессов uvicorn (--workers N, run.sh: WORKERS=N)
+#
+# Воркеры не делят память, поэтому всё, что должно быть общим, идёт через файлы в DATA_DIR:
+#   * init.lock + init.done — init_db() и прочая подготовка БД выполняются ровно одним воркером
+#     на запуск; остальные ждут на блокировке и стартуют, только когда схема готова;
+#   * leader.lock — фоновые задачи, которые нельзя запускать дважды (коррелятор, хвост query.log),
+#     работают в одном воркере; если он умер, блокировку подхватывает другой;
+#   * hits.version — 8 байт в mmap: любая запись в token_hits меняет значение, и кэши ответов
+#     /api/ping/stats|last в других воркерах понимают, что устарели.
+# Кэш IP→ASN общий через SQLite-файл (asn_cache.SharedAsnStore).
+import asyncio, fcntl, mmap, os, struct
+from typing import Awaitable, Callable, Optional
+
+def run_id() -> str:
+    # воркеры одного запуска — дети одного мастера uvicorn; starttime отличает переиспользованный pid
+    ppid = os.getppid()
+    try:
+        with open(f"/proc/{ppid}/stat") as f:
+            start = f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        start = "?"
+    return f"{ppid}:{start}"
+
+def _lock(path: str, block: bool) -> Optional[int]:
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | (0 if block else fcntl.LOCK_NB))
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+async def init_once(data_dir: str, init: Callable[[], Awaitable]) -> bool:
+    # -> True, если подготовку выполнил этот воркер. Блокировка берётся в потоке: ждущий
+    # воркер не принимает запросы (uvicorn начинает их принимать после startup), но и не висит в event loop
+    os.makedirs(data_dir, exist_ok=True)
+    marker = os.path.join(data_dir, "init.done")
+    fd = await asyncio.to_thread(_lock, os.path.join(data_dir, "init.lock"), True)
+    try:
+        rid = run_id()
+        try:
+            with open(marker) as f:
+                if f.read().strip() == rid:
+                    return False
+        except OSError:
+            pass
+        await init()
+        with open(marker, "w") as f:
+            f.write(rid)
+        return True
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+class Leadership:
+    """Один воркер из N держит leader.lock до своего выхода; остальные периодически пробуют."""
+
+    def __init__(self, data_dir: str, retry: float = 5.0):
+        self.path = os.path.join(data_dir, "leader.lock")
+        self.retry = retry
+        self._fd: Optional[int] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is None:
+            self._fd = _lock(self.path, False)
+        return self._fd is not None
+
+    async def wait(self) -> None:
+        while not self.try_acquire():
+            await asyncio.sleep(self.retry)
+
+    def release(self) -> None:
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+class SharedVersion:
+    """
+    Общая для процессов «версия» данных. Значение не счётчик, а уникальная метка
+    (pid, номер записи в этом процессе): читателю важно только «изменилось ли с прошлого раза»,
+    а одновременные bump() из разных процессов не могут записать одно и то же.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < 8:
+                os.ftruncate(fd, 8)
+            self._mm = mmap.mmap(fd, 8)
+        finally:
+            os.close(fd)
+        self._seq = 0
+
+    def bump(self) -> int:
+        self._seq += 1
+        v = (os.getpid() << 40) | (self._seq & ((1 << 40) - 1))
+        struct.pack_into("<Q", self._mm, 0, v)
+        return v
+
+    def value(self) -> int:
+        return struct.unpack_from("<Q", self._mm, 0)[0]
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Локальный фейковый whois (TCP) для бенчмарков: отвечает и как Team Cymru
+(bulk begin/verbose/.../end), и как RADB (один IP → блоки route/origin, а также
+постоянный режим IRRd "!!" с запросами "!r<prefix>,l").
+ASN и префикс выводятся из самого IP (детерминированно), так что повторные
+прогоны дают одинаковые ответы.
+
+    python3 -m bench.fake_whois --port 4343 --latency 0.05 --fail-rate 0.02
+
+Приложение направляется на него переменными окружения
+CYMRU_HOST/CYMRU_PORT и RADB_HOST/RADB_PORT (см. app/asn_lookup.py).
+"""
+import argparse
+import asyncio
+import ipaddress
+import random
+import zlib
+
+CYMRU_HEADER = "Bulk mode; whois.cymru.com [2025-10-17 13:15:23 +0000]\n"
+CYMRU_COLUMNS = "AS      | IP               | BGP Prefix          | CC | Registry | Allocated  | AS Name\n"
+
+
+def fake_route(ip: str):
+    # (asn, prefix): /24 для v4, /48 для v6; ~5% адресов «без маршрута»
+    addr = ipaddress.ip_address(ip)
+    h = zlib.crc32(addr.packed)
+    if h % 20 == 0:
+        return None, None
+    net = ipaddress.ip_network(f"{addr}/{24 if addr.version == 4 else 48}", strict=False)
+    return 64512 + h % 1000, str(net)
+
+
+def cymru_answer(ips) -> str:
+    out = [CYMRU_HEADER, CYMRU_COLUMNS]
+    for ip in ips:
+        try:
+            asn, prefix = fake_route(ip)
+        except ValueError:
+            out.append(f"Error: no ASN or IP match on line {ip}\n")
+            continue
+        if asn is None:
+            out.append(f"NA      | {ip:16} | NA                  |    | other    |            | NA\n")
+        else:
+            out.append(f"{asn:<7} | {ip:16} | {prefix:19} | RU | ripencc  | 2010-01-01 | FAKE-AS{asn}, RU\n")
+    return "".join(out)
+
+
+def radb_answer(ip: str) -> str:
+    try:
+        asn, prefix = fake_route(ip)
+    except ValueError:
+        return "%  No entries found for the selected source(s).\n"
+    if asn is None:
+        return "%  No entries found for the selected source(s).\n"
+    kind = "route6" if ":" in prefix else "route"
+    # покрывающий менее специфичный блок — разбор должен выбрать самый длинный префикс
+    wide = ipaddress.ip_network(prefix).supernet(new_prefix=16 if kind == "route" else 32)
+    return (f"{kind}:          {wide}\ndescr:          FAKE-WIDE\norigin:         AS{asn + 1}\nsource:         RADB\n\n"
+            f"{kind}:          {prefix}\ndescr:          FAKE\norigin:         AS{asn}\nsource:         RADB\n")
+
+
+def irrd_answer(query: str) -> str:
+    # IRRd: "!r<prefix>[,opt]" → A<длина>\n<объекты>C\n, D\n — не найдено, F — ошибка
+    if not query.startswith("!r"):
+        return "F Unrecognized command\n"
+    ip = query[2:].split(",", 1)[0].split("/", 1)[0]
+    try:
+        asn, _ = fake_route(ip)
+    except ValueError:
+        return "F Invalid prefix\n"
+    if asn is None:
+        return "D\n"
+    data = radb_answer(ip).encode()
+    return f"A{len(data)}\n{data.decode()}C\n"
+
+
+class FakeWhois:
+    """
+    latency — задержка перед ответом (сек, ± jitter доля), fail_rate — доля запросов,
+    на которые сервер рвёт соединение без ответа ("drop") или молчит до таймаута клиента ("hang").
+    Кроме одноразовых запросов Cymru/RADB понимает постоянный режим IRRd: "!!", затем "!r…" по одному сокету.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.2, fail_rate: float = 0.0,
+                 fail_mode: str = "drop", seed: int = 1):
+        self.latency, self.jitter = latency, jitter
+        self.fail_rate, self.fail_mode = fail_rate, fail_mode
+        self._rnd = random.Random(seed)
+        self.connections = self.cymru_queries = self.cymru_ips = self.radb_queries = self.failures = 0
+        self.irrd_queries = self.open_conns = self.max_open_conns = 0
+
+    async def _answer(self, reader, writer, answer: str) -> bool:
+        # False — «отказ»: соединение надо закрыть, ничего не ответив
+        if self.latency:
+            await asyncio.sleep(self.latency * (1 + self._rnd.uniform(-self.jitter, self.jitter)))
+        if self.fail_rate and self._rnd.random() < self.fail_rate:
+            self.failures += 1
+            if self.fail_mode == "hang":
+                await reader.read()     # до закрытия клиентом
+            return False
+        writer.write(answer.encode()); await writer.drain()
+        return True
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self.open_conns += 1
+        self.max_open_conns = max(self.max_open_conns, self.open_conns)
+        try:
+            first = (await reader.readline()).decode(errors="replace").strip()
+            if first.lower() == "begin":
+                ips = []
+                while True:
+                    ln = (await reader.readline()).decode(errors="replace").strip()
+                    if not ln or ln.lower() == "end":
+                        break
+                    if ln.lower() not in ("verbose", "noasname", "asname", "prefix", "countrycode"):
+                        ips.append(ln)
+                self.cymru_queries += 1; self.cymru_ips += len(ips)
+                await self._answer(reader, writer, cymru_answer(ips))
+            elif first == "!!":
+                # постоянное соединение: запросы по одному на строку, ответы по порядку
+                while True:
+                    q = (await reader.readline()).decode(errors="replace").strip()
+                    if not q or q == "!q":
+                        break
+                    self.irrd_queries += 1
+                    if not await self._answer(reader, writer, irrd_answer(q)):
+                        break
+            elif first.startswith("!"):
+                self.irrd_queries += 1
+                await self._answer(reader, writer, irrd_answer(first))
+            else:
+                self.radb_queries += 1
+                await self._answer(reader, writer, radb_answer(first))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.open_conns -= 1
+            try: writer.close(); await writer.wait_closed()
+            except (Exception, asyncio.CancelledError): pass     # остановка цикла посреди закрытия — не шумим
+
+    def stats(self) -> dict:
+        return {"connections": self.connections, "max_open_conns": self.max_open_conns,
+                "cymru_queries": self.cymru_queries, "cymru_ips": self.cymru_ips, "radb_queries": self.radb_queries,
+                "irrd_queries": self.irrd_queries, "failures": self.failures}
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.handle, host, port, backlog=1024)
+
+
+async def _serve(args) -> None:
+    fake = FakeWhois(args.latency, args.jitter, args.fail_rate, args.fail_mode, args.seed)
+    server = await fake.start(args.host, args.port)
+    port = server.sockets[0].getsockname()[1]
+    print(f"fake whois listening on {args.host}:{port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=4343)
+    ap.add_argument("--latency", type=float, default=0.0, help="сек до ответа")
+    ap.add_argument("--jitter", type=float, default=0.2, help="разброс задержки, доля от --latency")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="доля запросов без ответа")
+    ap.add_argument("--fail-mode", choices=("drop", "hang"), default="drop")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный прогон бэкенда: поднимает app.main:app (uvicorn, отдельный процесс) на временном
+SQLite-файле и фейковый whois (bench/fake_whois.py) вместо Team Cymru / RADB, затем гоняет
+сценарии с заданной конкурентностью и пишет req/s, p50/p95/p99 и размер БД в JSON.
+
+    cd webapp/backend
+    python3 -m bench.load                                   # ping, stats, items по 10 s, 32 клиента
+    python3 -m bench.load -c 64 -d 30 --whois-latency 0.1 --whois-fail-rate 0.05 --out run.json
+    python3 -m bench.load --scenarios ping --baseline run.json   # сравнить с прошлым прогоном
+    python3 -m bench.load -w 4 --baseline run.json           # 4 воркера uvicorn против одного
+
+Клиент — минимальный HTTP/1.1 с keep-alive на asyncio (без внешних зависимостей),
+у каждого воркера своё соединение. IP клиента для /api/ping задаётся X-Forwarded-For
+из пула --ips адресов, поэтому часть пингов — дубли, как в реальной нагрузке.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("ping", "stats", "items")
+
+
+# -----------------------------
+# HTTP-клиент
+# -----------------------------
+class HttpConn:
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self._r = self._w = None
+
+    async def request(self, method: str, path: str, body=None, headers=None):
+        # -> (status, bytes); соединение переоткрывается после ошибки или Connection: close
+        if self._w is None:
+            self._r, self._w = await asyncio.open_connection(self.host, self.port)
+        data = b"" if body is None else json.dumps(body).encode()
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(data)}"]
+        if body is not None:
+            head.append("Content-Type: application/json")
+        head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        try:
+            self._w.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+            await self._w.drain()
+            return await self._read_response(method)
+        except BaseException:
+            self.close()
+            raise
+
+    async def _read_response(self, method: str):
+        status_line = await self._r.readline()
+        if not status_line:
+            raise ConnectionError("server closed connection")
+        version, status = status_line.split()[:2]
+        status = int(status)
+        hdrs = {}
+        while True:
+            ln = await self._r.readline()
+            if ln in (b"\r\n", b"\n", b""):
+                break
+            k, _, v = ln.decode("latin-1").partition(":")
+            hdrs[k.strip().lower()] = v.strip()
+        if method == "HEAD" or status in (204, 304):
+            body = b""
+        elif hdrs.get("transfer-encoding", "").lower() == "chunked":
+            parts = []
+            while True:
+                size = int((await self._r.readline()).split(b";")[0], 16)
+                chunk = await self._r.readexactly(size + 2)
+                if size == 0:
+                    break
+                parts.append(chunk[:-2])
+            body = b"".join(parts)
+        else:
+            body = await self._r.readexactly(int(hdrs.get("content-length", 0)))
+        conn_hdr = hdrs.get("connection", "").lower()
+        if conn_hdr == "close" or (version == b"HTTP/1.0" and conn_hdr != "keep-alive"):
+            self.close()
+        return status, body
+
+    def close(self) -> None:
+        if self._w is not None:
+            self._w.close()
+        self._r = self._w = None
+
+
+# -----------------------------
+# Замеры
+# -----------------------------
+class Recorder:
+    def __init__(self):
+        self.lat = defaultdict(list)       # операция -> мс
+        self.status = defaultdict(Counter)  # операция -> код ответа / имя исключения
+        self.errors = self.conn_errors = 0
+
+    async def call(self, conn: HttpConn, op: str, method: str, path: str, body=None, headers=None, ok=(200,)):
+        t0 = time.perf_counter()
+        try:
+            status, data = await conn.request(method, path, body, headers)
+        except Exception as e:
+            self.errors += 1; self.conn_errors += 1
+            self.status[op][type(e).__name__] += 1
+            return None
+        self.lat[op].append((time.perf_counter() - t0) * 1000)
+        self.status[op][status] += 1
+        if status not in ok:
+            self.errors += 1
+            return None
+        return data
+
+
+def percentiles(ms):
+    if not ms:
+        return {"p50": None, "p95": None, "p99": None, "max": None, "mean": None}
+    s = sorted(ms)
+    pct = lambda q: round(s[min(len(s) - 1, int(q * len(s)))], 2)
+    return {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99), "max": round(s[-1], 2),
+            "mean": round(sum(s) / len(s), 2)}
+
+
+def summarize(rec: Recorder, elapsed: float) -> dict:
+    every = [x for v in rec.lat.values() for x in v]
+    out = {"requests": len(every) + rec.conn_errors, "errors": rec.errors, "seconds": round(elapsed, 2),
+           "rps": round(len(every) / elapsed, 1) if elapsed else None, "latency_ms": percentiles(every)}
+    if len(rec.lat) > 1:
+        out["ops"] = {op: dict(percentiles(ms), requests=len(ms), status=dict(rec.status[op]))
+                      for op, ms in sorted(rec.lat.items())}
+    else:
+        out["status"] = {str(k): v for op in rec.status.values() for k, v in op.items()}
+    return out
+
+
+# -----------------------------
+# Сценарии: одна итерация воркера
+# -----------------------------
+def make_ip_pool(n: int, seed: int):
+    rnd = random.Random(seed)
+    return [f"{rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}"
+            for _ in range(n)]
+
+
+async def step_ping(conn, rec, rnd, ctx):
+    ip = rnd.choice(ctx["ips"])
+    await rec.call(conn, "ping", "POST", "/api/ping", {"token": f"b{rnd.getrandbits(40):x}"},
+                   {"X-Forwarded-For": ip})
+
+
+async def step_stats(conn, rec, rnd, ctx):
+    await rec.call(conn, "stats", "GET", "/api/ping/stats")
+
+
+async def step_items(conn, rec, rnd, ctx):
+    # полный цикл CRUD: create → list → patch → put → delete
+    data = await rec.call(conn, "create", "POST", "/api/items",
+                          {"title": f"bench {rnd.getrandbits(32):x}", "description": "x" * 64}, ok=(201,))
+    if data is None:
+        return
+    item_id = json.loads(data)["id"]
+    await rec.call(conn, "list", "GET", "/api/items?limit=50")
+    await rec.call(conn, "patch", "PATCH", f"/api/items/{item_id}", {"description": "patched"})
+    await rec.call(conn, "put", "PUT", f"/api/items/{item_id}", {"title": "bench put", "description": None})
+    await rec.call(conn, "delete", "DELETE", f"/api/items/{item_id}", ok=(204,))
+
+
+STEPS = {"ping": step_ping, "stats": step_stats, "items": step_items}
+
+
+async def run_scenario(name: str, port: int, concurrency: int, duration: float, ctx: dict, seed: int) -> dict:
+    rec = Recorder()
+    stop_at = time.perf_counter() + duration
+    step = STEPS[name]
+
+    async def worker(i: int):
+        conn, rnd = HttpConn("127.0.0.1", port), random.Random(seed * 1000 + i)
+        try:
+            while time.perf_counter() < stop_at:
+                await step(conn, rec, rnd, ctx)
+        finally:
+            conn.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return summarize(rec, time.perf_counter() - t0)
+
+
+# -----------------------------
+# Процессы: фейковый whois и uvicorn
+# -----------------------------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_http(port: int, path: str, timeout: float, proc: subprocess.Popen) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        conn = HttpConn("127.0.0.1", port)
+        try:
+            status, _ = await conn.request("GET", path)
+            if status == 200:
+                return
+        except OSError:
+            pass
+        finally:
+            conn.close()
+        await asyncio.sleep(0.1)
+    raise TimeoutError(f"server on :{port} not ready in {timeout}s")
+
+
+async def wait_port(port: int, timeout: float, proc: subprocess.Popen) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"fake whois exited with code {proc.returncode}")
+        try:
+            _, w = await asyncio.open_connection("127.0.0.1", port)
+            w.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise TimeoutError(f"fake whois on :{port} not ready in {timeout}s")
+
+
+def stop_proc(proc: subprocess.Popen) -> None:
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill(); proc.wait()
+
+
+def db_size(path: str) -> dict:
+    sizes = {suffix or "db": os.path.getsize(path + suffix)
+             for suffix in ("", "-wal", "-shm") if os.path.exists(path + suffix)}
+    return dict(sizes, total=sum(sizes.values()))
+
+
+async def server_stats(port: int) -> dict:
+    # счётчики самого приложения — по ним видно, где осело время (батчи Cymru, групповой коммит, кэш)
+    out = {}
+    conn = HttpConn("127.0.0.1", port)
+    try:
+        for key, path in (("ingest", "/api/ingest/stats"), ("asn_cache", "/api/asn/cache"),
+                          ("cymru", "/api/asn/cymru"), ("response_cache", "/api/cache/stats"),
+                          ("ping_stats", "/api/ping/stats?top=1")):
+            status, data = await conn.request("GET", path)
+            out[key] = json.loads(data) if status == 200 else {"status": status}
+    except Exception as e:
+        out["error"] = repr(e)
+    finally:
+        conn.close()
+    return out
+
+
+def git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare(base: dict, cur: dict) -> None:
+    print(f"\n{'сценарий':10} {'req/s':>18} {'p50 ms':>18} {'p99 ms':>18}")
+    fmt = lambda a, b: f"{a!s:>7} → {b!s:<7}" + (f" {100 * (b - a) / a:+.0f}%" if a and b else "")
+    for name, res in cur["scenarios"].items():
+        old = base.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        print(f"{name:10} {fmt(old['rps'], res['rps']):>18} "
+              f"{fmt(old['latency_ms']['p50'], res['latency_ms']['p50']):>18} "
+              f"{fmt(old['latency_ms']['p99'], res['latency_ms']['p99']):>18}")
+
+
+async def run(args) -> dict:
+    tmpdir = tempfile.mkdtemp(prefix="bench-")
+    db_path = os.path.join(tmpdir, "app.db")
+    whois_port, app_port = free_port(), free_port()
+    env = dict(os.environ, PYTHONUNBUFFERED="1", APP_DB_PATH=db_path, APP_DATA_DIR=os.path.join(tmpdir, "data"),
+               APP_WORKERS=str(args.workers), CYMRU_HOST="127.0.0.1", CYMRU_PORT=str(whois_port),
+               RADB_HOST="127.0.0.1", RADB_PORT=str(whois_port))
+    log = open(os.path.join(tmpdir, "server.log"), "wb")
+    whois = subprocess.Popen([sys.executable, "-m", "bench.fake_whois", "--port", str(whois_port),
+                              "--latency", str(args.whois_latency), "--fail-rate", str(args.whois_fail_rate),
+                              "--fail-mode", args.whois_fail_mode], cwd=BACKEND_DIR, stdout=log, stderr=log)
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+                               "--port", str(app_port), "--workers", str(args.workers),
+                               "--log-level", "warning", "--no-access-log"],
+                              cwd=BACKEND_DIR, env=env, stdout=log, stderr=log)
+    result = {
+        "meta": {"started": time.strftime("%Y-%m-%dT%H:%M:%S"), "git": git_rev(), "python": platform.python_version(),
+                 "platform": platform.platform(), "cpus": os.cpu_count(),
+                 "args": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "keep")}},
+        "scenarios": {},
+    }
+    try:
+        await wait_port(whois_port, 10, whois)
+        await wait_http(app_port, "/api/ping/stats", 30, server)
+        ctx = {"ips": make_ip_pool(args.ips, args.seed)}
+        for name in args.scenarios:
+            if args.warmup:
+                await run_scenario(name, app_port, args.concurrency, args.warmup, ctx, args.seed + 1)
+            res = await run_scenario(name, app_port, args.concurrency, args.duration, ctx, args.seed)
+            result["scenarios"][name] = res
+            lat = res["latency_ms"]
+            print(f"{name:8} {res['rps']:>9} req/s   p50 {lat['p50']} ms   p95 {lat['p95']} ms   "
+                  f"p99 {lat['p99']} ms   errors {res['errors']}", flush=True)
+        result["server"] = await server_stats(app_port)
+        result["db"] = db_size(db_path)
+        print(f"БД: {result['db']['total'] / 2**20:.2f} МБ ({db_path})")
+    except Exception:
+        log.flush()
+        with open(log.name, "rb") as f:
+            sys.stderr.write(f.read()[-4000:].decode(errors="replace"))
+        raise
+    finally:
+        stop_proc(server)
+        stop_proc(whois)
+        log.close()
+        if args.keep:
+            print(f"файлы прогона: {tmpdir}")
+        else:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-c", "--concurrency", type=int, default=32, help="одновременных клиентов")
+    ap.add_argument("-d", "--duration", type=float, default=10.0, help="сек на сценарий")
+    ap.add_argument("--warmup", type=float, default=2.0, help="сек прогрева перед замером (0 — без)")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS), help="через запятую: " + ", ".join(SCENARIOS))
+    ap.add_argument("-w", "--workers", type=int, default=1, help="процессов uvicorn (как WORKERS в run.sh)")
+    ap.add_argument("--ips", type=int, default=5000, help="размер пула IP клиентов для /api/ping")
+    ap.add_argument("--whois-latency", type=float, default=0.02, help="сек ответа фейкового whois")
+    ap.add_argument("--whois-fail-rate", type=float, default=0.0)
+    ap.add_argument("--whois-fail-mode", choices=("drop", "hang"), default="drop")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default="bench-result.json", help="куда записать JSON результата")
+    ap.add_argument("--baseline", help="JSON прошлого прогона: вывести разницу")
+    ap.add_argument("--keep", action="store_true", help="не удалять временную БД и лог сервера")
+    args = ap.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    bad = set(args.scenarios) - set(SCENARIOS)
+    if bad:
+        ap.error(f"unknown scenarios: {', '.join(sorted(bad))}")
+
+    result = asyncio.run(run(args))
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"результат: {args.out}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main()
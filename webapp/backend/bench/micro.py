@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарки пути IP→ASN без сети: разбор ответов Team Cymru / RADB
+(_parse_cymru, _parse_radb) и полный cymru_one / radb_one против фейкового whois
+в том же процессе (bench/fake_whois.py, без задержки).
+
+    cd webapp/backend
+    python3 -m bench.micro                      # результат — в bench-micro.json
+    python3 -m bench.micro --batch 100 --rounds 2000 --out micro.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import time
+
+from .fake_whois import FakeWhois, cymru_answer, fake_route, radb_answer
+
+
+def bench(fn, rounds: int, items: int = 1) -> dict:
+    # лучшая из пяти серий: меньше шума от планировщика
+    best = None
+    for _ in range(5):
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return {"rounds": rounds, "us_per_call": round(best / rounds * 1e6, 2),
+            "items_per_sec": round(rounds * items / best)}
+
+
+async def abench(coro_fn, rounds: int, concurrency: int) -> dict:
+    lat = []
+
+    async def one():
+        t0 = time.perf_counter()
+        await coro_fn()
+        lat.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    for i in range(0, rounds, concurrency):
+        await asyncio.gather(*(one() for _ in range(min(concurrency, rounds - i))))
+    dt = time.perf_counter() - t0
+    lat.sort()
+    return {"rounds": rounds, "concurrency": concurrency, "per_sec": round(rounds / dt),
+            "p50_ms": round(lat[len(lat) // 2], 3), "p99_ms": round(lat[int(0.99 * (len(lat) - 1))], 3)}
+
+
+def report(name: str, res: dict) -> None:
+    print(f"{name:26} " + "   ".join(f"{k} {v}" for k, v in res.items()), flush=True)
+
+
+async def run(args) -> dict:
+    fake = FakeWhois()
+    server = await fake.start()
+    port = server.sockets[0].getsockname()[1]
+    # адреса whois читаются при импорте app.asn_lookup
+    os.environ.update(CYMRU_HOST="127.0.0.1", CYMRU_PORT=str(port), RADB_HOST="127.0.0.1", RADB_PORT=str(port))
+    from app import asn_lookup
+
+    rnd = random.Random(args.seed)
+    ips = [f"{rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}"
+           for _ in range(max(args.batch, 1000))]
+    cymru_raw = cymru_answer(ips[:args.batch])
+    radb_raw = radb_answer(next(ip for ip in ips if fake_route(ip)[0]))
+    assert len(asn_lookup._parse_cymru(cymru_raw)) == args.batch
+    assert asn_lookup._parse_radb(radb_raw)["prefix"].endswith("/24")
+
+    out = {}
+    out["parse_cymru"] = bench(lambda: asn_lookup._parse_cymru(cymru_raw), max(args.rounds // 10, 1), args.batch)
+    report(f"_parse_cymru ({args.batch} IP)", out["parse_cymru"])
+    out["parse_radb"] = bench(lambda: asn_lookup._parse_radb(radb_raw), args.rounds)
+    report("_parse_radb", out["parse_radb"])
+
+    it = iter(range(10 ** 9))
+    next_ip = lambda: ips[next(it) % len(ips)]
+    async with server:
+        out["cymru_one"] = await abench(lambda: asn_lookup.cymru_one(next_ip()), args.rounds, args.concurrency)
+        out["cymru_one"]["batcher"] = asn_lookup.cymru_batcher.stats()["avg_batch"]
+        report("cymru_one", out["cymru_one"])
+        out["radb_one"] = await abench(lambda: asn_lookup.radb_one(next_ip()), args.rounds, args.concurrency)
+        report("radb_one", out["radb_one"])
+        out["radb_one"]["whois"] = asn_lookup.radb_host.stats()
+        await asn_lookup.radb_host.close()     # постоянные соединения RADB — закрыть до остановки сервера
+    out["fake_whois"] = fake.stats()
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=2000)
+    ap.add_argument("--batch", type=int, default=100, help="IP в одном ответе Cymru для разбора")
+    ap.add_argument("--concurrency", type=int, default=50, help="одновременных cymru_one / radb_one")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default="bench-micro.json")
+    args = ap.parse_args()
+    res = asyncio.run(run(args))
+    res = {"meta": {"started": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                    "args": {k: v for k, v in vars(args).items() if k != "out"}},
+           "results": res}
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(res, f, ensure_ascii=False, indent=2)
+    print(f"результат: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
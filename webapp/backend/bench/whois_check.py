@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Проверка app/whois_pool.py против локального фейкового whois (bench/fake_whois.py):
+переиспользование постоянных соединений RADB, лимит одновременных соединений на хост,
+порядок ответов в конвейере при обрывах и быстрый отказ «разомкнутого» хоста — в том числе
+когда вызывающий сдаётся раньше TIMEOUT пула (дедлайн источника); срок кэша ответов режима race.
+
+    cd webapp/backend
+    python3 -m bench.whois_check          # код выхода 1, если какая-то проверка не прошла
+"""
+import asyncio
+import random
+import sys
+import time
+
+from app import asn_lookup
+from app.asn_cache import AsnCache
+from app.asn_lookup import _parse_cymru, _parse_radb
+from app.whois_pool import IrrdHost, WhoisHost, WhoisUnavailable
+
+from .fake_whois import FakeWhois, fake_route
+
+failed = 0
+
+
+def check(ok: bool, what: str) -> None:
+    global failed
+    failed += not ok
+    print(f"{'ok  ' if ok else 'FAIL'} {what}", flush=True)
+
+
+def random_ips(n: int, seed: int = 1):
+    rnd = random.Random(seed)
+    return [f"{rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}"
+            for _ in range(n)]
+
+
+def expected(ip: str):
+    asn, prefix = fake_route(ip)
+    return {"asn": asn, "prefix": prefix} if asn else {}
+
+
+async def persistent_reuse() -> None:
+    fake = FakeWhois(latency=0.002)
+    server = await fake.start()
+    port = server.sockets[0].getsockname()[1]
+    host = IrrdHost("127.0.0.1", port, max_conns=2, timeout=2.0, breaker_failures=5, breaker_cooldown=1.0,
+                    pipeline=8, idle_timeout=60.0)
+    ips = random_ips(400)
+    async with server:
+        res = await asyncio.gather(*(host.lookup(ip) for ip in ips))
+        await host.close()
+    check(all(_parse_radb(raw) == expected(ip) for ip, raw in zip(ips, res)),
+          "RADB !!: каждый ответ достался своему запросу")
+    check(fake.connections <= 2, f"RADB !!: {len(ips)} запросов по {fake.connections} соединениям (≤ 2)")
+    check(fake.max_open_conns <= 2, f"RADB !!: одновременно открыто ≤ 2 ({fake.max_open_conns})")
+
+
+async def concurrency_cap() -> None:
+    fake = FakeWhois(latency=0.03)
+    server = await fake.start()
+    port = server.sockets[0].getsockname()[1]
+    host = WhoisHost("127.0.0.1", port, max_conns=4, timeout=2.0, breaker_failures=5, breaker_cooldown=1.0)
+    batches = [random_ips(10, seed) for seed in range(40)]
+    async with server:
+        res = await asyncio.gather(*(host.query("begin\nverbose\n" + "\n".join(b) + "\nend\n") for b in batches))
+    check(all(len(_parse_cymru(raw)) == len(b) for b, raw in zip(batches, res)), "Cymru: все bulk-ответы полные")
+    check(fake.max_open_conns <= 4, f"Cymru: одновременно открыто ≤ 4 ({fake.max_open_conns}) при 40 запросах")
+
+
+async def pipeline_with_drops() -> None:
+    # сервер иногда рвёт соединение посреди конвейера: ждущие получают ошибку, но не чужой ответ
+    fake = FakeWhois(latency=0.001, fail_rate=0.05, seed=3)
+    server = await fake.start()
+    port = server.sockets[0].getsockname()[1]
+    host = IrrdHost("127.0.0.1", port, max_conns=2, timeout=2.0, breaker_failures=10 ** 6, breaker_cooldown=1.0,
+                    pipeline=8, idle_timeout=60.0)
+    ips = random_ips(300, seed=5)
+    async with server:
+        res = await asyncio.gather(*(host.lookup(ip) for ip in ips), return_exceptions=True)
+        await host.close()
+    good = [(ip, r) for ip, r in zip(ips, res) if not isinstance(r, BaseException)]
+    check(all(_parse_radb(r) == expected(ip) for ip, r in good),
+          f"RADB !! с обрывами: {len(good)} ответов верны, {len(ips) - len(good)} ошибок, чужих ответов нет")
+
+
+async def breaker() -> None:
+    # «мёртвый» апстрим: сервер принимает соединение и молчит
+    fake = FakeWhois(fail_rate=1.0, fail_mode="hang")
+    server = await fake.start()
+    port = server.sockets[0].getsockname()[1]
+    host = WhoisHost("127.0.0.1", port, max_conns=4, timeout=0.2, breaker_failures=3, breaker_cooldown=0.5)
+    async with server:
+        for _ in range(3):
+            try:
+                await host.query("192.0.2.1\n")
+            except Exception:
+                pass
+        t0 = time.perf_counter()
+        try:
+            await host.query("192.0.2.1\n")
+            fast = False
+        except WhoisUnavailable:
+            fast = True
+        ms = (time.perf_counter() - t0) * 1000
+        check(fast and ms < 10, f"предохранитель: после 3 таймаутов отказ за {ms:.2f} мс, а не за TIMEOUT")
+
+        fake.fail_rate = 0.0                # апстрим ожил
+        await asyncio.sleep(0.5)
+        raw = await host.query("192.0.2.1\n")
+        check(host.breaker.state == "closed" and bool(raw), "предохранитель: после cooldown пробный запрос замыкает")
+
+
+async def breaker_under_deadline() -> None:
+    # вызывающие уходят по своему wait_for раньше TIMEOUT пула (как RADB_DEADLINE < TIMEOUT),
+    # а зависания всё равно должны доходить до предохранителя
+    for name, make in (
+        ("RADB !!", lambda port: IrrdHost("127.0.0.1", port, max_conns=2, timeout=0.3, breaker_failures=3,
+                                          breaker_cooldown=5.0, pipeline=8, idle_timeout=60.0)),
+        ("RADB", lambda port: WhoisHost("127.0.0.1", port, max_conns=4, timeout=0.3, breaker_failures=3,
+                                        breaker_cooldown=5.0)),
+    ):
+        fake = FakeWhois(fail_rate=1.0, fail_mode="hang")
+        server = await fake.start()
+        host = make(server.sockets[0].getsockname()[1])
+        queued = 0
+        async with server:
+            for _ in range(6):
+                q = host.lookup("192.0.2.1") if isinstance(host, IrrdHost) else host.query("192.0.2.1\n")
+                try:
+                    await asyncio.wait_for(q, 0.1)
+                except (asyncio.TimeoutError, ConnectionError):     # WhoisUnavailable — тоже ConnectionError
+                    pass
+                if isinstance(host, IrrdHost):
+                    queued = max(queued, host.stats()["queued"])
+            await asyncio.sleep(0.5)        # отправленные запросы доходят до своего TIMEOUT
+            try:
+                await asyncio.wait_for(host.query("192.0.2.1\n"), 0.1)
+                opened = False
+            except WhoisUnavailable:
+                opened = True
+            except asyncio.TimeoutError:
+                opened = False
+            await host.close()
+        check(opened and host.breaker.opens >= 1,
+              f"{name}: wait_for(0.1) < TIMEOUT 0.3 — предохранитель разомкнут ({host.breaker.state}, "
+              f"ошибок {host.errors})")
+        if isinstance(host, IrrdHost):
+            check(queued <= 8, f"{name}: в очереди зависшего соединения ≤ pipeline ({queued}), "
+                               f"соединений {fake.connections}")
+
+
+async def race_ttl() -> None:
+    # режим race: проигравший RADB, отменённый после ответа Cymru, не делает ответ «неполным» —
+    # такой ответ живёт полный TTL; короткий (neg_ttl) — только если Cymru не успел
+    async def answer(delay: float, asn):
+        await asyncio.sleep(delay)
+        return {"asn": asn, "prefix": "192.0.2.0/24"} if asn else {}
+
+    cache = AsnCache(100, ttl=3600, neg_ttl=60)
+    cases = (
+        ("Cymru ответил, RADB отменён", 0.01, 64500, 1.0, 64501, False, 3600),
+        ("Cymru без ASN, ответ RADB", 0.01, None, 0.02, 64501, False, 3600),
+        ("Cymru не успел, ответ RADB", 1.0, 64500, 0.01, 64501, True, 60),
+    )
+    saved = asn_lookup.cymru_one, asn_lookup.radb_one
+    try:
+        for what, c_delay, c_asn, r_delay, r_asn, partial, ttl in cases:
+            asn_lookup.cymru_one = lambda ip, d=c_delay, a=c_asn: answer(d, a)
+            asn_lookup.radb_one = lambda ip, d=r_delay, a=r_asn: answer(d, a)
+            res = await asn_lookup._resolve_race("192.0.2.1", 0.2)
+            check(res["partial"] is partial and cache._ttl(res) == ttl,
+                  f"race: {what} — partial={res['partial']}, TTL кэша {cache._ttl(res)} с")
+    finally:
+        asn_lookup.cymru_one, asn_lookup.radb_one = saved
+
+
+async def main() -> None:
+    await persistent_reuse()
+    await concurrency_cap()
+    await pipeline_with_drops()
+    await breaker()
+    await breaker_under_deadline()
+    await race_ttl()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,4 +2,7 @@
 set -e
 source .venv/bin/activate
 export PYTHONUNBUFFERED=1
-exec uvicorn app.main:app --host 127.0.0.1 --port 8095
+# WORKERS=4 ./run.sh — несколько процессов uvicorn (общий кэш ASN и состояние — через файлы в data/)
+WORKERS=${WORKERS:-1}
+export APP_WORKERS=$WORKERS
+exec uvicorn app.main:app --host 127.0.0.1 --port 8095 --workers "$WORKERS"
@@ -246,7 +246,7 @@ $("#clearPingStats").onclick = async () => {
     const r = await apiPingClear();
     notify(`Очищено записей: ${r.deleted}`, "success", 2500);
     // обновим виджеты статистики и таблицу
-    await loadPingStats();
+    await loadPingStats(true);
   } catch (e) {
     notify(`Не удалось очистить: ${e.message}`, "error", 6000);
   } finally {
@@ -267,7 +267,10 @@ $("#tokenSend").onclick = async () => {
     const r = await apiPing(t);  // теперь ответ содержит r.duplicate
     const name = r.as_name ? ` (${r.as_name})` : "";
     const pref = r.prefix ? `, ${r.prefix}` : "";
-    if (r.duplicate) {
+    if (r.pending) {
+      // ASN определяется на сервере в фоне — покажем то, что уже есть
+      notify(`${r.duplicate ? "IP уже есть в базе" : "Записано"}: ${r.ip}. ASN ещё определяется…`, r.duplicate ? "warn" : "success", 3000);
+    } else if (r.duplicate) {
       notify(`IP уже есть в базе: ${r.ip} → AS${r.asn ?? "?"}${name}${pref}. Новая запись не добавлена.`, "warn", 5000);
     } else {
       notify(`Записано: ${r.ip} → AS${r.asn ?? "?"}${name}${pref}`, "success", 3000);
@@ -277,39 +280,61 @@ $("#tokenSend").onclick = async () => {
   }
 };
 
-async function loadPingStats() {
-  try {
-    const stats = await apiPingStats();
-    $("#pingSummary").textContent = `Всего пингов: ${stats.total_hits}, уникальных IP: ${stats.unique_ips}`;
+function renderPingSummary(stats) {
+  const pend = stats.pending ? `, ASN определяется: ${stats.pending}` : "";
+  $("#pingSummary").textContent = `Всего пингов: ${stats.total_hits}, уникальных IP: ${stats.unique_ips}${pend}`;
 
-    const top = $("#pingTop"); top.innerHTML = "";
-    for (const row of stats.top) {
-      const name = row.as_name ? ` (${row.as_name})` : "";
-      top.appendChild(CE("li", { textContent: `AS${row.asn ?? "?"}${name} — ${row.count}` }));
-    }
+  const top = $("#pingTop"); top.innerHTML = "";
+  for (const row of stats.top) {
+    const name = row.as_name ? ` (${row.as_name})` : "";
+    top.appendChild(CE("li", { textContent: `AS${row.asn ?? "?"}${name} — ${row.count}` }));
+  }
+}
+
+function pingRow(r) {
+  const tr = CE("tr");
+  tr.append(
+    CE("td", { textContent: r.when }),
+    CE("td", { textContent: r.token }),
+    CE("td", { textContent: r.ip }),
+    CE("td", { textContent: r.asn ?? "" }),
+    CE("td", { textContent: r.as_name ?? "" }),
+    CE("td", { textContent: r.prefix ?? "" }),
+    CE("td", { textContent: r.user_agent ?? "" }),
+  );
+  return tr;
+}
+
+async function loadPingStats(silent = false) {
+  try {
+    renderPingSummary(await apiPingStats());
 
     const tbody = $("#pingTable tbody"); tbody.innerHTML = "";
     const last = await apiPingLast(100);
-    for (const r of last) {
-      const tr = CE("tr");
-      tr.append(
-        CE("td", { textContent: r.when }),
-        CE("td", { textContent: r.token }),
-        CE("td", { textContent: r.ip }),
-        CE("td", { textContent: r.asn ?? "" }),
-        CE("td", { textContent: r.as_name ?? "" }),
-        CE("td", { textContent: r.prefix ?? "" }),
-        CE("td", { textContent: r.user_agent ?? "" }),
-      );
-      tbody.appendChild(tr);
-    }
+    for (const r of last) tbody.appendChild(pingRow(r));
 
-    notify("Статистика по токенам обновлена", "success", 1500);
+    if (!silent) notify("Статистика по токенам обновлена", "success", 1500);
   } catch (e) {
     notify(`Ошибка загрузки статистики: ${e.message}`, "error", 6000);
   }
 }
-$("#loadPingStats").onclick = loadPingStats;
+$("#loadPingStats").onclick = () => loadPingStats();
+
+// ---------- Живая лента (SSE) ----------
+// Сервер сам присылает новые пинги и свежую статистику; при обрыве EventSource
+// переподключается с Last-Event-ID и получает пропущенное. reset — отстали слишком сильно.
+function startLiveFeed() {
+  if (!window.EventSource) return;
+  const es = new EventSource("/api/ping/stream");
+  es.addEventListener("hit", ev => {
+    const tbody = $("#pingTable tbody");
+    tbody.insertBefore(pingRow(JSON.parse(ev.data)), tbody.firstChild);
+    while (tbody.children.length > 100) tbody.lastChild.remove();
+  });
+  es.addEventListener("stats", ev => renderPingSummary(JSON.parse(ev.data)));
+  es.addEventListener("clear", () => { $("#pingTable tbody").innerHTML = ""; });
+  es.addEventListener("reset", () => loadPingStats(true));
+}
 
 // Читаем ответ fetch() потоком и обновляем прогресс
 async function fetchWithProgress(url, onProgress) {
@@ -333,42 +358,6 @@ async function fetchWithProgress(url, onProgress) {
   return text;
 }
 
-// Разбор delegated-ripencc-latest для ASN RU
-function parseRipeDelegated(text) {
-  const lines = text.split(/\r?\n/);
-  const perDay = new Map(); // YYYYMMDD -> count
-  for (const ln of lines) {
-    if (!ln || ln[0] === '#') continue;
-    const parts = ln.split('|');
-    if (parts.length < 7) continue;
-    const [registry, cc, type, start, value, date, status] = parts;
-    if (type !== 'asn') continue;
-    if (cc !== 'RU') continue;
-    const st = (status || '').toLowerCase();
-    if (st !== 'allocated' && st !== 'assigned') continue;
-
-    const count = parseInt(value, 10);
-    if (!Number.isFinite(count)) continue;
-    if (!/^\d{8}$/.test(date)) continue;
-
-    perDay.set(date, (perDay.get(date) || 0) + count);
-  }
-
-  // агрегация по годам
-  const perYear = new Map(); // YYYY -> count
-  for (const [d, cnt] of perDay) {
-    const y = d.slice(0, 4);
-    perYear.set(y, (perYear.get(y) || 0) + cnt);
-  }
-
-  const years = Array.from(perYear.keys()).sort();
-  const perYearArr = years.map(y => perYear.get(y));
-  let cum = 0;
-  const cumulative = years.map(y => { cum += perYear.get(y); return cum; });
-
-  return { years, perYear: perYearArr, cumulative, total: cum };
-}
-
 let ripeChart = null;
 function renderRipeChart(data) {
   const ctx = document.getElementById('ripeChart').getContext('2d');
@@ -403,8 +392,9 @@ document.getElementById('ripeLoad').onclick = async () => {
   try {
     ripeBar.value = 0;
     const info = await ensureRipe(false);
-    const text = await fetchWithProgress('/api/ripe/file', v => ripeBar.value = v);
-    const parsed = parseRipeDelegated(text);
+    // агрегаты считает сервер: качаем несколько КБ вместо всего delegated-файла
+    const text = await fetchWithProgress('/api/ripe/asn-stats?cc=RU', v => ripeBar.value = v);
+    const parsed = JSON.parse(text);
     renderRipeChart(parsed);
     const mb = info.size ? (info.size / 1024 / 1024).toFixed(2) : '?';
     ripeInfo.textContent = `Размер файла: ${mb} MB. Всего выдано ASN (RU): ${parsed.total}.`;
@@ -426,3 +416,5 @@ document.getElementById('ripeForce').onclick = async () => {
 
 // first load
 reload();
+loadPingStats(true);
+startLiveFeed();